@@ -1,2 +1,10 @@
 from breadboard.client import BreadboardClient
 from breadboard.auth import BreadboardAuth
+
+
+def __getattr__(name):
+    # The async client pulls in httpx, so it's only imported when it's used
+    if name == 'AsyncBreadboardClient':
+        from breadboard.async_client import AsyncBreadboardClient
+        return AsyncBreadboardClient
+    raise AttributeError("module 'breadboard' has no attribute '{}'".format(name))
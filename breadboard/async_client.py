@@ -0,0 +1,174 @@
+import time
+import urllib
+import asyncio
+
+from breadboard.auth import BreadboardAuth
+from breadboard.instrumentation import Instrumentation
+from breadboard.pagination import NoResultsError
+from breadboard import serializer
+from breadboard.serializer import decode_once
+from breadboard.client import read_api_config, unquote_separators, make_rate_limiter, CONNECTION_DEFAULTS
+from breadboard.mixins.ImageMixins import TIMEFORMATS, image_query_payload, image_update_payload, image_endpoint
+from breadboard.mixins.RunMixins import (run_query_payload, run_endpoint, merge_measurement_name, merge_image_filenames,
+                                         merge_analysis, check_instrument_names, merge_instrument_readout, print_run_update)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class AsyncBreadboardClient:
+    """ An asyncio version of BreadboardClient, over a pooled async http connection.
+    The payloads are built by the same functions as the sync client's.
+
+    Use it as an async context manager, which looks up the lab on the way in:
+
+        async with AsyncBreadboardClient(config_path='API_CONFIG.json') as bc:
+            response = await bc.post_images(image_names)
+
+    Inputs:
+    - config_path: the path to the API configuration json file
+    - lab_name: the lab name, if it isn't in the configuration file
+    - max_connections: the size of the connection pool (default: pool_maxsize from the configuration)
+    The connect and read timeouts come from the configuration, like the sync client.
+    """
+
+    def __init__(self, config_path, lab_name=None, max_connections=None):
+        if httpx is None:
+            raise ImportError('AsyncBreadboardClient needs httpx. Install it with: pip install httpx')
+
+        api_config, self.api_url, self.lab_name = read_api_config(config_path, lab_name)
+        self.auth = BreadboardAuth(api_config.get('api_key'))
+        self.lab = None
+        if max_connections is None:
+            max_connections = api_config.get('pool_maxsize', CONNECTION_DEFAULTS['pool_maxsize'])
+        timeout = httpx.Timeout(api_config.get('read_timeout', CONNECTION_DEFAULTS['read_timeout']),
+                                connect=api_config.get('connect_timeout', CONNECTION_DEFAULTS['connect_timeout']))
+        self.session = httpx.AsyncClient(
+            headers=self.auth.headers,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.rate_limiter = make_rate_limiter(api_config)
+        self.instrumentation = Instrumentation()
+
+
+    async def __aenter__(self):
+        await self.get_lab()
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+    async def aclose(self):
+        """ Close the connection pool """
+        await self.session.aclose()
+
+
+    async def _send_message(self, method, endpoint, params=None, data=None):
+        """ Send an HTTP message to the API
+        """
+        url = self.api_url + endpoint
+        if params:
+            url += ('&' if '?' in url else '?') + urllib.parse.urlencode(params)
+        url = unquote_separators(url)
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.reserve(method, endpoint)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        start = time.perf_counter()
+        try:
+            r = await self.session.request(method.upper(), url, content=data)
+        except httpx.HTTPError as e:
+            self.instrumentation.record_request(method, endpoint, None, 0, time.perf_counter() - start)
+            if isinstance(e, httpx.TimeoutException):
+                raise RuntimeError('The API timed out on {} {}'.format(method.upper(), endpoint)) from e
+            raise RuntimeError('Error sending the message to the API url. Please check your API url.') from e
+        self.instrumentation.record_request(method, endpoint, r.status_code, len(r.content), time.perf_counter() - start)
+        return decode_once(r, self.instrumentation)
+
+
+    async def get_lab(self):
+        """ Get the lab object and store it as a property of the client """
+        resp = await self._send_message('get', '/labs/')
+        res = resp.json()['results']
+        labs = [lab for lab in res if lab['name']==self.lab_name]
+        if not labs:
+            raise ValueError("The API doesn't know the lab '{}'".format(self.lab_name))
+        self.lab = labs[0]
+        return self.lab
+
+
+    async def post_images(self, image_names=None, auto_time=True, image_times=None, force_match=False, datetime_range=None, imagetimeformat=TIMEFORMATS['FERMI3'], page='', **kwargs):
+        """ Returns the API response for a set of images. See BreadboardClient.post_images for the inputs.
+        """
+        payload_clean = image_query_payload(self.lab_name, image_names, auto_time, image_times, force_match,
+                                            datetime_range, imagetimeformat, **kwargs)
+        response = await self._send_message('post', '/images/'+page, data=serializer.dumps(payload_clean))
+        if not response.json().get('results'):
+            raise NoResultsError(response.json().get('detail'))
+        return response
+
+
+    async def update_image(self, id, image_name, params):
+        payload = image_update_payload(image_name, params)
+        return await self._send_message('put', image_endpoint(id), data=serializer.dumps(payload))
+
+
+    async def get_runs(self, datetime_range=None, page='', **kwargs):
+        """ Returns the API response for a set of runs. See BreadboardClient.get_runs for the inputs.
+        """
+        payload_clean = run_query_payload(self.lab_name, datetime_range, **kwargs)
+        response = await self._send_message('get', '/runs/' + page, params=payload_clean)
+        if not response.json().get('results'):
+            raise NoResultsError(response.json().get('detail'))
+        return response
+
+
+    async def get_run(self, run_id):
+        """ Return the run dict for a run id """
+        response = await self._send_message('get', run_endpoint(run_id))
+        return response.json()
+
+
+    async def _put_run(self, run_id, run_dict):
+        return await self._send_message('put', run_endpoint(run_id), data=serializer.dumps(run_dict))
+
+
+    async def add_measurement_name_to_run(self, run_id, measurement_name):
+        run_dict = await self.get_run(run_id)
+        merge_measurement_name(run_dict, measurement_name)
+        return await self._put_run(run_id, run_dict)
+
+
+    async def append_images_to_run(self, run_id, image_filenames, measurement_name=None, printing=True):
+        run_dict = await self.get_run(run_id)
+        image_filenames = merge_image_filenames(run_dict, image_filenames)
+        response = await self._put_run(run_id, run_dict)
+        if printing:
+            print_run_update(run_id, 'associated with ' + str(image_filenames), run_dict)
+        if measurement_name is not None:
+            await self.add_measurement_name_to_run(run_id, measurement_name)
+        return response
+
+
+    async def append_analysis_to_run(self, run_id, analysis_dict, printing=True):
+        run_dict = await self.get_run(run_id)
+        merge_analysis(run_dict, analysis_dict)
+        response = await self._put_run(run_id, run_dict)
+        if printing:
+            print_run_update(run_id, 'analyzed: ' + str(analysis_dict), run_dict)
+        return response
+
+
+    async def add_instrument_readout_to_run(self, run_id, instruments_dict, printing=True):
+        check_instrument_names(instruments_dict)
+        run_dict = await self.get_run(run_id)
+        merge_instrument_readout(run_dict, instruments_dict)
+        response = await self._put_run(run_id, run_dict)
+        if printing:
+            print_run_update(run_id, 'associated with: ' + str(instruments_dict), run_dict)
+        return response
@@ -0,0 +1,248 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from breadboard import serializer
+from breadboard.records import KeyTable, compact as compact_record
+
+
+class RecordCache:
+    """ An on-disk cache of image and run records, stored in a sqlite database.
+    Records are keyed by lab + kind ('image' or 'run') + key (the image name or the run id).
+
+    Inputs:
+    - path: the sqlite file to use
+    - ttl: seconds after which a cached record is considered stale (None to never go stale)
+    - max_bytes: the total size of cached records above which the oldest records get evicted
+    """
+
+    def __init__(self, path, ttl=7*24*3600, max_bytes=500*1024**2):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS records (
+                    lab TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    record_id INTEGER,
+                    run_id INTEGER,
+                    fetched_at REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    body TEXT NOT NULL,
+                    PRIMARY KEY (lab, kind, key)
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS records_fetched_at ON records (fetched_at)")
+
+
+    def get_many(self, lab, kind, keys, compact=False):
+        """ Return a dict of key: record for the keys that are cached and fresh.
+        With compact, the records are CompactDicts (see breadboard/records.py), which take much less memory.
+        """
+        keys = [str(key) for key in keys]
+        decode = serializer.loads
+        if compact:
+            table = KeyTable()
+            decode = lambda body: compact_record(serializer.loads(body), table)
+        found = {}
+        oldest = time.time() - self.ttl if self.ttl is not None else float('-inf')
+        with self._lock:
+            # sqlite limits the number of query parameters, so look keys up in chunks
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                rows = self._conn.execute(
+                    "SELECT key, body FROM records WHERE lab=? AND kind=? AND fetched_at>=? AND key IN ({})".format(
+                        ','.join('?'*len(chunk))),
+                    [lab, kind, oldest] + chunk)
+                found.update({key: decode(body) for key, body in rows})
+        return found
+
+
+    def put_many(self, lab, kind, records):
+        """ Store a dict of key: record, then evict the oldest records if the cache is too big """
+        now = time.time()
+        rows = []
+        for key, record in records.items():
+            body = serializer.dumps(record)
+            if kind == 'image':
+                run_id = (record.get('run') or {}).get('id')
+            else:
+                run_id = record.get('id')
+            rows.append((lab, kind, str(key), record.get('id'), run_id, now, len(body), body))
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO records VALUES (?,?,?,?,?,?,?,?)", rows)
+        self.evict()
+
+
+    def evict(self):
+        """ Drop stale records, then the oldest records until the cache fits in max_bytes """
+        with self._lock, self._conn:
+            if self.ttl is not None:
+                self._conn.execute("DELETE FROM records WHERE fetched_at<?", [time.time() - self.ttl])
+            if self.max_bytes is None:
+                return
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM records").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._conn.execute("SELECT rowid, size FROM records ORDER BY fetched_at ASC")
+            to_delete = []
+            for rowid, size in rows:
+                if total <= self.max_bytes:
+                    break
+                to_delete.append((rowid,))
+                total -= size
+            self._conn.executemany("DELETE FROM records WHERE rowid=?", to_delete)
+
+
+    def invalidate(self, lab, kind=None, keys=None):
+        """ Drop cached records. With no kind, drop everything for the lab. With no keys, drop the whole kind. """
+        with self._lock, self._conn:
+            if kind is None:
+                self._conn.execute("DELETE FROM records WHERE lab=?", [lab])
+            elif keys is None:
+                self._conn.execute("DELETE FROM records WHERE lab=? AND kind=?", [lab, kind])
+            else:
+                self._conn.executemany("DELETE FROM records WHERE lab=? AND kind=? AND key=?",
+                                       [(lab, kind, str(key)) for key in keys])
+
+
+    def invalidate_endpoint(self, lab, endpoint):
+        """ Drop the records affected by a write to an endpoint like /runs/123/ or /images/45/.
+        A write to a run also drops the cached images that were matched to it.
+        """
+        match = re.match(r'^/(runs|images)/(\d+)', endpoint)
+        if not match:
+            return
+        resource, record_id = match.group(1), int(match.group(2))
+        with self._lock, self._conn:
+            if resource == 'runs':
+                self._conn.execute("DELETE FROM records WHERE lab=? AND kind='run' AND record_id=?", [lab, record_id])
+                self._conn.execute("DELETE FROM records WHERE lab=? AND kind='image' AND run_id=?", [lab, record_id])
+            else:
+                self._conn.execute("DELETE FROM records WHERE lab=? AND kind='image' AND record_id=?", [lab, record_id])
+
+
+class ResponseCache:
+    """ A bounded, in-memory LRU cache of API responses to reads (GETs, and image queries without force_match).
+
+    Responses are revalidated with If-None-Match / If-Modified-Since if the server sent an ETag / Last-Modified
+    (a 304 reuses the cached body), and otherwise fetched again. With a ttl, responses about a single run or
+    image, or the labs, are served without a request for ttl seconds, so they can be stale if another process
+    changes them. Image queries are always checked, since an image that isn't matched to a run yet can be
+    matched at any time, and so are lists and time range queries, which grow as new shots come in.
+    Writes through the client drop the responses they could have changed.
+
+    Inputs:
+    - max_entries: the number of responses to keep
+    - max_bytes: the total size of the response bodies to keep
+    - ttl: seconds during which a single run or image is served without asking the server (0 to always ask)
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64*1024**2, ttl=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(method, endpoint, params=None, data=None):
+        """ A cache key from the method, endpoint and canonical payload, or None if the request isn't a read """
+        method = method.upper()
+        if data:
+            try:
+                data = json.loads(data)
+            except (TypeError, ValueError):
+                return None
+        if method == 'POST':
+            if not endpoint.startswith('/images/') or not isinstance(data, dict) or data.get('force_match'):
+                return None
+        elif method != 'GET':
+            return None
+        return (method, endpoint,
+                json.dumps(params or {}, sort_keys=True, default=str),
+                json.dumps(data or {}, sort_keys=True, default=str))
+
+    @staticmethod
+    def is_fixed(key):
+        """ Whether a key asks for a single run or image, or the labs, rather than for a list or query that can change """
+        method, endpoint, params, data = key
+        path = endpoint.split('?')[0]
+        return method == 'GET' and (path == '/labs/' or bool(re.match(r'^/(?:runs|images)/\d+', path)))
+
+    def get(self, key):
+        """ The cached entry for a key, or None. Entries are dicts of
+        status_code, headers, content, url, stored_at, plus 'fresh' if it can be served without a request
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            fresh = (self.ttl is not None and time.monotonic() - entry['stored_at'] < self.ttl
+                     and self.is_fixed(key))
+            return dict(entry, fresh=fresh)
+
+    def put(self, key, status_code, headers, content, url):
+        size = len(content)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old['content'])
+            self._entries[key] = {'status_code': status_code, 'headers': dict(headers), 'content': content,
+                                  'url': url, 'stored_at': time.monotonic()}
+            self._size += size
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     (self.max_bytes is not None and self._size > self.max_bytes)):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted['content'])
+
+    def touch(self, key):
+        """ Mark an entry as fresh again, after a 304 """
+        with self._lock:
+            if key in self._entries:
+                self._entries[key]['stored_at'] = time.monotonic()
+                self.revalidated += 1
+
+    def count_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def invalidate_endpoint(self, endpoint):
+        """ Drop the responses a write to an endpoint could have changed: those of the run or image itself,
+        and every run or image list and query, since any of them could include it.
+        """
+        resource = re.match(r'^/(?:runs|images)/\d+', endpoint)
+        resource = resource.group(0) if resource else None
+        with self._lock:
+            for key in list(self._entries):
+                path = key[1].split('?')[0]
+                single = re.match(r'^/(?:runs|images)/\d+', path)
+                if single:
+                    drop = single.group(0) == resource
+                else:
+                    drop = path.startswith(('/runs', '/images'))
+                if drop:
+                    self._size -= len(self._entries.pop(key)['content'])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -1,73 +1,317 @@
+import os
 import requests
 import urllib
 import json
+import time
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import ReadTimeoutError
 
 from breadboard.auth import BreadboardAuth
+from breadboard.cache import RecordCache, ResponseCache
+from breadboard.ratelimit import RateLimiter
+from breadboard.instrumentation import Instrumentation, retries_taken
+from breadboard.serializer import decode_once
 from breadboard.mixins import ImageMixins, RunMixins
 
 
+def unquote_separators(url):
+    """ The API expects literal commas and colons in query strings, eg in lists of names and in datetimes """
+    url = url.replace(urllib.parse.quote(","), ",")
+    url = url.replace(urllib.parse.quote(":"), ":")
+    return url
+
+
 class QuoteFixedSession(requests.Session):
     def send(self, *a, **kw):
         # a[0] is prepared request
-        a[0].url = a[0].url.replace(urllib.parse.quote(","), ",")
-        a[0].url = a[0].url.replace(urllib.parse.quote(":"), ":")
+        a[0].url = unquote_separators(a[0].url)
         # print(a[0].url)
         return requests.Session.send(self, *a, **kw)
 
 
+# Connection and retry settings, each of which can be overridden in the API configuration json file
+CONNECTION_DEFAULTS = {
+    'pool_connections': 10,     # number of connection pools to cache
+    'pool_maxsize': 32,         # connections kept alive per pool, ie the number of concurrent requests
+    'max_retries': 3,           # retries on connection errors, 429s and 5xx responses (not on read timeouts)
+    'backoff_factor': 0.5,      # seconds, doubled on each retry
+    'backoff_jitter': 0.25,     # seconds of random jitter added to each backoff
+    'connect_timeout': 10,      # seconds
+    'read_timeout': 30,         # seconds
+}
 
-class BreadboardClient(ImageMixins.ImageMixin, RunMixins.RunMixin):
-    def __init__(self, config_path, lab_name=None, debug=False):
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 
-        if not config_path:
-            raise ValueError("Please enter a directory for your API configuration json file")
 
-        with open(config_path) as file:
-            api_config = json.load(file)
+def is_read_timeout(error):
+    """ Whether a requests error was caused by a read timeout, eg one that ran out of retries """
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, ReadTimeoutError)
 
-        self.auth = BreadboardAuth(api_config.get('api_key'))
 
-        if api_config.get('api_url')==None:
-            self.api_url = 'https://breadboard-215702.appspot.com'
+def make_session(api_config):
+    """ Make a session with a pooled, retrying HTTP adapter configured from the API configuration.
+    Retries back off exponentially with jitter, and 429/503 responses wait for their Retry-After header.
+    """
+    options = {key: api_config.get(key, default) for key, default in CONNECTION_DEFAULTS.items()}
+    retry_options = dict(
+        total=options['max_retries'],
+        backoff_factor=options['backoff_factor'],
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None, # retry every method: image posts and run puts are idempotent
+        read=False, # but don't resend a request the server may still be working on, eg a slow force_match
+        respect_retry_after_header=True,
+        raise_on_status=False, # hand back the last response, rather than raising
+    )
+    try:
+        retry = Retry(backoff_jitter=options['backoff_jitter'], **retry_options)
+    except TypeError:
+        # urllib3 < 2 has no jitter, and urllib3 < 1.26 calls allowed_methods method_whitelist
+        try:
+            retry = Retry(**retry_options)
+        except TypeError:
+            retry_options['method_whitelist'] = retry_options.pop('allowed_methods')
+            retry = Retry(**retry_options)
+
+    adapter = HTTPAdapter(pool_connections=options['pool_connections'],
+                          pool_maxsize=options['pool_maxsize'],
+                          max_retries=retry)
+    session = QuoteFixedSession()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def make_rate_limiter(api_config):
+    """ Make the client-side rate limiter from the API configuration, or None if it sets no 'rate_limits' """
+    limits = api_config.get('rate_limits')
+    if not limits:
+        return None
+    return RateLimiter(limits, lockfile=api_config.get('rate_limit_lockfile'))
+
+
+def make_response_cache(api_config):
+    """ Make the in-memory response cache from the API configuration, or None if 'response_cache_size' is 0 or null """
+    max_entries = api_config.get('response_cache_size', 256)
+    if not max_entries:
+        return None
+    return ResponseCache(max_entries, ttl=api_config.get('response_cache_ttl', 0))
+
+
+def response_from_cache(entry):
+    """ Rebuild a requests Response from a ResponseCache entry """
+    response = requests.models.Response()
+    response.status_code = entry['status_code']
+    response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+    response._content = entry['content']
+    response.url = entry['url']
+    response.from_cache = True
+    return response
+
+
+def conditional_headers(cached_headers):
+    """ The headers to revalidate a cached response with, from the validators the server sent """
+    headers = {}
+    for validator, condition in (('ETag', 'If-None-Match'), ('Last-Modified', 'If-Modified-Since')):
+        value = requests.structures.CaseInsensitiveDict(cached_headers).get(validator)
+        if value:
+            headers[condition] = value
+    return headers
+
+
+def read_api_config(config_path, lab_name=None):
+    """ Read the API configuration json file
+
+    Outputs:
+    - api_config: the whole configuration dict
+    - api_url: the API url, without a trailing slash
+    - lab_name: the lab name, from the inputs or else from the file
+    """
+    if not config_path:
+        raise ValueError("Please enter a directory for your API configuration json file")
+
+    with open(config_path) as file:
+        api_config = json.load(file)
+
+    if api_config.get('api_url')==None:
+        api_url = 'https://breadboard-215702.appspot.com'
+    else:
+        api_url = api_config.get('api_url').rstrip('/')
+
+    if lab_name==None:
+        if api_config.get('lab_name')==None:
+            raise ValueError("Please enter a lab name.")
         else:
-            self.api_url = api_config.get('api_url').rstrip('/')
-        
-
-        if lab_name==None:
-            if api_config.get('lab_name')==None:
-                raise ValueError("Please enter a lab name.")
-            else:
-                self.lab_name = api_config.get('lab_name')
+            lab_name = api_config.get('lab_name')
+
+    return api_config, api_url, lab_name
+
+
+
+# Where lab objects are kept between sessions, so that clients don't have to look them up.
+# Override it with 'lab_cache_path' in the API configuration, or set that to null to always look labs up.
+LAB_CACHE_PATH = '~/.breadboard/labs.json'
+
+
+def read_cached_lab(path, api_url, lab_name):
+    """ The lab object saved by an earlier session, or None """
+    if not path:
+        return None
+    try:
+        with open(os.path.expanduser(path)) as file:
+            return json.load(file).get(api_url + ' ' + lab_name)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cached_lab(path, api_url, lab_name, lab):
+    """ Save a lab object for later sessions. Failing to save it isn't an error """
+    if not path:
+        return
+    path = os.path.expanduser(path)
+    try:
+        with open(path) as file:
+            labs = json.load(file)
+    except (OSError, ValueError):
+        labs = {}
+    labs[api_url + ' ' + lab_name] = lab
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(labs, file)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logging.debug('Could not save the lab to {}: {}'.format(path, e))
+
+
+class BreadboardClient(ImageMixins.ImageMixin, RunMixins.RunMixin):
+    def __init__(self, config_path, lab_name=None, debug=False, cache_path=None):
+
+        api_config, self.api_url, self.lab_name = read_api_config(config_path, lab_name)
+        self.auth = BreadboardAuth(api_config.get('api_key'))
+
+        # Optional on-disk cache of image and run records
+        if cache_path==None:
+            cache_path = api_config.get('cache_path')
+        if cache_path:
+            cache_options = {key: api_config[option] for key, option in
+                             [('ttl', 'cache_ttl'), ('max_bytes', 'cache_max_bytes')] if option in api_config}
+            self.cache = RecordCache(cache_path, **cache_options)
         else:
-            self.lab_name = lab_name
+            self.cache = None
 
-        self.session = QuoteFixedSession()
-        self.get_lab()
-        for handler in logging.root.handlers[:]:
-            logging.root.removeHandler(handler)
+        self.latency = {} # running estimates of request latencies, by kind of request
+        self.timeout = (api_config.get('connect_timeout', CONNECTION_DEFAULTS['connect_timeout']),
+                        api_config.get('read_timeout', CONNECTION_DEFAULTS['read_timeout']))
+        self.session = make_session(api_config)
+        self.rate_limiter = make_rate_limiter(api_config)
+        self.response_cache = make_response_cache(api_config)
+        self.image_batch_endpoint = api_config.get('image_batch_endpoint') # eg '/images/bulk/', if the API has one
+        self.instrumentation = Instrumentation() # request and phase hooks, see breadboard/instrumentation.py
+        # The lab is looked up on first use, see the lab property
+        self._lab = None
+        self.lab_cache_path = api_config.get('lab_cache_path', LAB_CACHE_PATH)
         if debug==True:
+            for handler in logging.root.handlers[:]:
+                logging.root.removeHandler(handler)
             logging.basicConfig(level=logging.DEBUG)
             logging.debug('Hi! You are debugging breadboard.')
-        else:
-            logging.basicConfig(level=logging.WARNING)
 
 
 
-    def _send_message(self, method, endpoint, params=None, data=None):
-        """ Send an HTTP message to the API
+    def _send_message(self, method, endpoint, params=None, data=None, headers=None):
+        """ Send an HTTP message to the API, optionally with extra headers.
+        Reads go through the in-memory response cache; pass headers={'Cache-Control': 'no-cache'}
+        to check with the server even when the cached response is fresh.
         """
         url = self.api_url + endpoint
+
+        # Serve or revalidate reads from the response cache
+        key = entry = None
+        if self.response_cache is not None:
+            key = self.response_cache.key(method, endpoint, params, data)
+            entry = self.response_cache.get(key) if key is not None else None
+        if entry is not None:
+            if entry['fresh'] and (headers or {}).get('Cache-Control') != 'no-cache':
+                self.response_cache.count_hit()
+                return decode_once(response_from_cache(entry), self.instrumentation)
+            headers = {**conditional_headers(entry['headers']), **(headers or {})}
+
+        if headers:
+            headers = {**self.auth.headers, **headers}
+        else:
+            headers = self.auth.headers
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(method, endpoint)
+        start = time.perf_counter()
         try:
             r = self.session.request(method, url, params=params, data=data,
-                                     headers=self.auth.headers, timeout=30)
-        except:
-            raise RuntimeError('Error sending the message to the API url. Please check your API url.')
-        return r
+                                     headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.instrumentation.record_request(method, endpoint, None, 0, time.perf_counter() - start)
+            if isinstance(e, requests.exceptions.Timeout) or is_read_timeout(e):
+                raise RuntimeError('The API timed out on {} {}'.format(method.upper(), endpoint)) from e
+            if isinstance(e, requests.exceptions.RetryError):
+                raise RuntimeError('The API kept failing on {} {}, even after retrying'.format(method.upper(), endpoint)) from e
+            raise RuntimeError('Error sending the message to the API url. Please check your API url.') from e
+        self.instrumentation.record_request(method, endpoint, r.status_code, len(r.content),
+                                            time.perf_counter() - start, retries_taken(r))
+        if self.cache is not None and method.lower() in ('put', 'patch', 'delete'):
+            self.cache.invalidate_endpoint(self.lab_name, endpoint)
+        if self.response_cache is not None:
+            if key is None and method.lower() != 'get':
+                # a write (or an image match), so drop what it could have changed
+                self.response_cache.invalidate_endpoint(endpoint)
+            elif r.status_code == 304 and entry is not None:
+                self.response_cache.touch(key)
+                r = response_from_cache(entry)
+            elif key is not None and r.status_code == 200:
+                self.response_cache.put(key, r.status_code, r.headers, r.content, r.url)
+        return decode_once(r, self.instrumentation)
+
+
+    def invalidate_cache(self, image_names=None, run_ids=None):
+        """ Drop records from the on-disk cache.
+        With no inputs, drop everything cached for this lab.
+
+        Inputs:
+        - image_names: a list of image names to drop
+        - run_ids: a list of run ids to drop
+        """
+        if self.cache is None:
+            return
+        if image_names is None and run_ids is None:
+            self.cache.invalidate(self.lab_name)
+            return
+        if image_names is not None:
+            if isinstance(image_names, str):
+                image_names = [image_names]
+            self.cache.invalidate(self.lab_name, 'image', image_names)
+        if run_ids is not None:
+            if not isinstance(run_ids, list):
+                run_ids = [run_ids]
+            self.cache.invalidate(self.lab_name, 'run', run_ids)
+
+
+    @property
+    def lab(self):
+        """ The lab object. It's looked up on first use, or read from the lab cache file if an earlier session saved it """
+        if self._lab is None:
+            self._lab = read_cached_lab(self.lab_cache_path, self.api_url, self.lab_name) or self.get_lab()
+        return self._lab
 
 
     def get_lab(self):
-        """ Get the lab object and store it as a property of the client """
+        """ Look up the lab object, store it as a property of the client, and save it in the lab cache file """
         resp = self._send_message('get', '/labs/')
         res = resp.json()['results']
-        self.lab = [lab for lab in res if lab['name']==self.lab_name][0]
+        labs = [lab for lab in res if lab['name']==self.lab_name]
+        if not labs:
+            raise ValueError("The API doesn't know the lab '{}'".format(self.lab_name))
+        self._lab = labs[0]
+        write_cached_lab(self.lab_cache_path, self.api_url, self.lab_name, self._lab)
+        return self._lab
@@ -0,0 +1,133 @@
+import json
+import uuid
+
+# Columns whose values aren't parameters, and keep their own types
+INDEX_COLUMNS = ('imagename', 'runtime', 'unixtime', 'id', 'lab', 'date')
+
+FORMATS = {
+    'parquet': 'parquet',
+    'arrow': 'ipc', # uncompressed arrow IPC files, which memory-map without copying
+}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.fs
+    except ImportError:
+        raise ImportError('Exporting to parquet or arrow needs pyarrow. Install it with: pip install pyarrow')
+    return pyarrow
+
+
+def _dataset_format(format):
+    if format not in FORMATS:
+        raise ValueError('Unknown format {}. Use one of {}'.format(format, list(FORMATS)))
+    return FORMATS[format]
+
+
+def typed_chunk(df, lab_name):
+    """ Give a page of the image or run dataframe column types that stay the same from page to page:
+    numbers become float64, booleans become nullable booleans, lists and dicts become json strings,
+    and everything else becomes strings. Columns with no values on this page (eg a param that older runs
+    don't have) are left untyped, as nulls, and take the type of the other pages when read back.
+    Adds the lab and date (UTC, from unixtime) partition columns.
+    """
+    import pandas as pd
+    df = df.drop(columns=['x'], errors='ignore').copy()
+    for column in df.columns:
+        if column in INDEX_COLUMNS:
+            continue
+        values = df[column]
+        if not values.notna().any():
+            df[column] = pd.Series(None, index=df.index, dtype=object)
+            continue
+        if pd.api.types.is_bool_dtype(values):
+            continue
+        if pd.api.types.is_numeric_dtype(values):
+            df[column] = values.astype('float64')
+            continue
+        present = values.dropna()
+        if len(present) and present.map(lambda value: isinstance(value, bool)).all():
+            df[column] = values.astype('boolean')
+        elif len(present) and present.map(lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)).all():
+            df[column] = values.astype('float64')
+        else:
+            df[column] = values.map(
+                lambda value: json.dumps(value) if isinstance(value, (list, dict))
+                else (None if value is None or (isinstance(value, float) and value != value) else str(value))
+            ).astype('string')
+    df['lab'] = lab_name
+    df['date'] = pd.to_datetime(df['unixtime'], unit='s', utc=True).dt.strftime('%Y-%m-%d')
+    return df
+
+
+def write_frames(frames, path, lab_name, format='parquet'):
+    """ Write dataframe chunks into a dataset partitioned by lab and date, one chunk at a time
+
+    Inputs:
+    - frames: an iterable of image or run dataframes, eg from iter_images(as_frames=True)
+    - path: the root folder of the dataset
+    - lab_name: the lab, for the partitioning
+    - format: 'parquet' or 'arrow'
+
+    Outputs:
+    - the number of rows written
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset_format = _dataset_format(format)
+    extension = 'parquet' if format == 'parquet' else 'arrow'
+    run = uuid.uuid4().hex[:8]
+    rows = 0
+    for i, df in enumerate(frames):
+        if not len(df):
+            continue
+        table = pa.Table.from_pandas(typed_chunk(df, lab_name), preserve_index=False)
+        ds.write_dataset(
+            table, path,
+            format=dataset_format,
+            partitioning=['lab', 'date'],
+            partitioning_flavor='hive',
+            basename_template='part-{}-{}-{{i}}.{}'.format(run, i, extension),
+            existing_data_behavior='overwrite_or_ignore',
+        )
+        rows += len(df)
+    return rows
+
+
+def read_export(path, format='parquet', columns=None, filter=None, memory_map=True):
+    """ Read an exported dataset back into pandas
+
+    Pages can have different params, so the schemas of the files are unified first.
+    With memory_map, the files are memory-mapped rather than read (zero-copy for the 'arrow' format).
+
+    Inputs:
+    - path: the root folder of the dataset
+    - format: 'parquet' or 'arrow'
+    - columns: optionally, the columns to read
+    - filter: optionally, a pyarrow.dataset expression, eg pyarrow.dataset.field('date') == '2019-06-20'
+    - memory_map: memory-map the files
+
+    Outputs:
+    - df: the dataframe
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+
+    filesystem = pyarrow.fs.LocalFileSystem(use_mmap=memory_map)
+    options = dict(format=_dataset_format(format), partitioning='hive', filesystem=filesystem)
+    dataset = ds.dataset(path, **options)
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+    schemas.append(dataset.partitioning.schema)
+    try:
+        schema = pa.unify_schemas(schemas, promote_options='permissive')
+    except TypeError:
+        # pyarrow < 14
+        schema = pa.unify_schemas(schemas)
+    dataset = ds.dataset(path, schema=schema, **options)
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
@@ -0,0 +1,388 @@
+import time
+import warnings
+from warnings import warn
+
+from breadboard import serializer
+
+IMAGE_REMOVEPARAMS = {'run', 'name', 'thumbnail', 'atomsperpixel', 'settings', 'ListBoundVariables', 'camera'}
+RUN_REMOVEPARAMS = {'ListBoundVariables'}
+ADDPARAMS = ('unixtime',)
+
+
+def image_parameters(image):
+    """ The run parameters of an image record, or an empty dict if the image has no run """
+    try:
+        return image['run']['parameters'] or {}
+    except (KeyError, TypeError):
+        return {}
+
+
+def image_runtime(image):
+    return image['run']['runtime']
+
+
+def run_parameters(run):
+    """ The parameters of a run record, or an empty dict """
+    try:
+        return run['parameters'] or {}
+    except (KeyError, TypeError):
+        return {}
+
+
+def run_runtime(run):
+    return run['runtime']
+
+
+def projection_fields(paramsin, extended=False):
+    """ The params to ask the API for, when only some are needed: an explicit list of params
+    (not '*' or 'list_bound_only'), without extended. Otherwise None, for the whole record.
+    """
+    if extended or paramsin in ('*', 'list_bound_only'):
+        return None
+    if isinstance(paramsin, str):
+        paramsin = [paramsin]
+    return list(paramsin)
+
+
+def project_run(run, fields):
+    """ A copy of a run record with only the requested fields in its parameters.
+    The other keys of the record (id, runtime, ...) are kept.
+    """
+    if not fields or not isinstance(run, dict):
+        return run
+    parameters = run_parameters(run)
+    return {**run, 'parameters': {field: parameters[field] for field in fields if field in parameters}}
+
+
+def project_image(image, fields):
+    """ A copy of an image record whose run only has the requested fields in its parameters """
+    if not fields or not image.get('run'):
+        return image
+    return {**image, 'run': project_run(image['run'], fields)}
+
+
+def runtimes_to_unixtime(runtimes):
+    """ Convert a batch of ISO 8601 runtime strings to integer unix timestamps in one go.
+    Anything pandas can't parse falls back to dateutil, one string at a time.
+
+    Inputs:
+    - runtimes: a list of runtime strings, eg '2018-10-09T00:21:57Z'
+
+    Outputs:
+    - a list of ints
+    """
+    import dateutil.parser
+    import pandas as pd
+    runtimes = pd.Series(runtimes, dtype=object)
+    if int(pd.__version__.split('.')[0]) >= 2:
+        times = pd.to_datetime(runtimes, format='ISO8601', utc=True, errors='coerce')
+    else:
+        # pandas < 2 has no ISO8601 format (with errors='coerce' it quietly gives all NaT),
+        # but parses ISO 8601 strings quickly without a format
+        times = pd.to_datetime(runtimes, utc=True, errors='coerce')
+    unixtimes = (times - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+
+    unparsed = unixtimes.isna()
+    if unparsed.any():
+        unixtimes = unixtimes.astype(object)
+        unixtimes[unparsed] = [int(dateutil.parser.parse(runtime).timestamp()) for runtime in runtimes[unparsed]]
+    return [int(unixtime) for unixtime in unixtimes]
+
+
+def select_params(records, paramsin, extended, get_parameters, removeparams, addparams=ADDPARAMS):
+    """ Work out which columns to build, in the order they are first seen
+
+    Inputs:
+    - records: a list of image or run records (dicts)
+    - paramsin:
+        > ['param1','param2',...] : a list of params
+        > '*' for all params
+        > 'list_bound_only' for listbound params only
+    - extended: include all the keys of the first record, like the url and id
+    - get_parameters: a function returning the parameter dict of a record
+    - removeparams: params to leave out
+    - addparams: params to always add
+
+    Outputs:
+    - a list of param names
+    """
+    paramsall = {}
+    if extended and records:
+        paramsall.update(dict.fromkeys(records[0].keys()))
+    if paramsin == '*':
+        #  Get all params
+        for record in records:
+            paramsall.update(dict.fromkeys(get_parameters(record)))
+    elif paramsin == 'list_bound_only':
+        # Get listbound params
+        for record in records:
+            paramsall.update(dict.fromkeys(get_parameters(record).get('ListBoundVariables') or []))
+    else:  # use set of params provided
+        if isinstance(paramsin, str):
+            paramsin = [paramsin]
+        paramsall.update(dict.fromkeys(paramsin))
+
+    paramsall.update(dict.fromkeys(addparams))
+    return [param for param in paramsall if param not in removeparams]
+
+
+def records_to_df(records, name_column, names, paramsall, get_parameters, get_runtime):
+    """ Flatten records into per-column lists in one pass, and build the dataframe once
+
+    Each param is looked up in the record's parameters first, then in the bare record,
+    and is nan if it's in neither.
+
+    Inputs:
+    - records: a list of image or run records (dicts)
+    - name_column: the name of the first column, eg 'imagename'
+    - names: the values of the first column
+    - paramsall: the list of params to build columns for
+    - get_parameters: a function returning the parameter dict of a record
+    - get_runtime: a function returning the runtime string of a record
+
+    Outputs:
+    - df: the dataframe with params
+    """
+    import pandas as pd
+    nan = float('nan')
+    columns = {param: [] for param in paramsall if param != name_column}
+    runtimes = []
+    missing_runtime = False
+
+    for record in records:
+        try:  # to get the runtime
+            runtime = get_runtime(record)
+        except (KeyError, TypeError):
+            runtime = '1970'
+            missing_runtime = True
+        runtimes.append(runtime)
+
+        parameters = get_parameters(record)
+        for param, column in columns.items():
+            if param in ('runtime', 'unixtime'):
+                continue
+            if param in parameters:
+                column.append(parameters[param])
+            elif param in record:
+                column.append(record[param])
+            else:
+                column.append(nan)
+
+    if missing_runtime:
+        warn('no run found for some records')
+
+    if 'runtime' in columns:
+        columns['runtime'] = runtimes
+    if 'unixtime' in columns:
+        columns['unixtime'] = runtimes_to_unixtime(runtimes)
+
+    df = pd.DataFrame({name_column: names, 'x': 0}, index=range(len(names)))
+    return pd.concat([df, pd.DataFrame(columns, index=df.index)], axis=1)
+
+
+def images_frame(images, paramsin="list_bound_only", extended=False):
+    """ Build the dataframe for a list of image records (without the xvar or sorting) """
+    try:
+        imagenames = [image['name'] for image in images]
+    except:
+        raise RuntimeError('Couldnt extract imagenames')
+    paramsall = select_params(images, paramsin, extended, image_parameters, IMAGE_REMOVEPARAMS)
+    return records_to_df(images, 'imagename', imagenames, paramsall, image_parameters, image_runtime)
+
+
+def runs_frame(runs, paramsin="list_bound_only", extended=False):
+    """ Build the dataframe for a list of run records (without the xvar or sorting) """
+    try:
+        runtimes = [run['runtime'] for run in runs]
+    except:
+        raise RuntimeError('Couldnt extract runtimes')
+    paramsall = select_params(runs, paramsin, extended, run_parameters, RUN_REMOVEPARAMS)
+    return records_to_df(runs, 'runtime', runtimes, paramsall, run_parameters, run_runtime)
+
+
+def query_frame(records, kind, paramsin="list_bound_only", extended=False):
+    """ Build the dataframe for one page of a query's records, to be combined by finish_frames
+
+    A param can be list-bound on some pages and not others, and its column needs its values from every page.
+    So with 'list_bound_only', the frame gets a column for every param, and the columns this page asks for
+    are kept in df.attrs['columns'], for finish_frames to keep the columns any page asks for.
+    """
+    build, get_parameters, removeparams = ((images_frame, image_parameters, IMAGE_REMOVEPARAMS) if kind == 'images'
+                                           else (runs_frame, run_parameters, RUN_REMOVEPARAMS))
+    if paramsin != 'list_bound_only':
+        return build(records, paramsin, extended)
+    df = build(records, '*', extended)
+    df.attrs['columns'] = select_params(records, paramsin, extended, get_parameters, removeparams, addparams=())
+    return df
+
+
+def page_frame(page, kind, paramsin="list_bound_only", extended=False, fields=None, compact=True):
+    """ Build the dataframe for one page of a query. Runs in a worker process, see iter_page_frames.
+
+    Inputs:
+    - page: the raw body of a page response (bytes), or its list of records
+    - kind: 'images' or 'runs'
+    - paramsin, extended: which params to build columns for
+    - fields: trim the run parameters to these, if the API sent more
+    - compact: give the columns compact dtypes
+
+    Outputs:
+    - (df, ids, seconds, warnings): the dataframe, the record ids, the time it took, and the messages of any warnings
+    """
+    start = time.perf_counter()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        records = serializer.loads(page)['results'] if isinstance(page, (bytes, str)) else page
+        if fields:
+            project = project_image if kind == 'images' else project_run
+            records = [project(record, fields) for record in records]
+        df = query_frame(records, kind, paramsin, extended)
+        if compact:
+            compact_dtypes(df)
+    ids = [record.get('id') for record in records]
+    return df, ids, time.perf_counter() - start, [str(warning.message) for warning in caught]
+
+
+def iter_page_frames(pages, kind, frame_workers, paramsin="list_bound_only", extended=False, fields=None, compact=True):
+    """ Build the dataframes of a stream of pages in a pool of frame_workers processes,
+    yielding the results of page_frame in page order. At most 2*frame_workers pages are held at once.
+
+    The workers are started with 'spawn', so scripts that use this need an if __name__ == '__main__': guard.
+    """
+    import functools
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from breadboard.pagination import map_ordered
+    build = functools.partial(page_frame, kind=kind, paramsin=paramsin, extended=extended, fields=fields, compact=compact)
+    executor = ProcessPoolExecutor(max_workers=frame_workers, mp_context=multiprocessing.get_context('spawn'))
+    for result in map_ordered(build, pages, max_workers=frame_workers, executor=executor):
+        for message in result[3]:
+            warn(message)
+        yield result
+
+
+def iter_frames(pages, kind, instrumentation, paramsin="list_bound_only", extended=False, fields=None, frame_workers=1, compact=True):
+    """ Build a dataframe for each page of a query (see query_frame), timing each as the 'frame' phase
+
+    With frame_workers, the pages (lists of records or undecoded bodies) are decoded and built in a process
+    pool (see iter_page_frames), and the dataframes come back with compact dtypes. Otherwise they are built
+    here, and compacted later by finish_frames.
+
+    Outputs:
+    - a generator of (df, ids), with the ids of each page's records
+    """
+    if frame_workers > 1:
+        for df, ids, seconds, _ in iter_page_frames(pages, kind, frame_workers, paramsin, extended, fields, compact):
+            instrumentation.record_phase('frame', seconds, records=len(ids))
+            yield df, ids
+        return
+    for records in pages:
+        with instrumentation.phase('frame', records=len(records)):
+            df = query_frame(records, kind, paramsin, extended)
+        yield df, [record.get('id') for record in records]
+
+
+def finish_frames(frames, xvar, sort_by, compact=True, dtypes=None, compacted=False):
+    """ Combine the dataframes of a query's pages, compact their dtypes, set df.x and sort
+
+    Inputs:
+    - frames: the dataframes of the pages, from query_frame
+    - xvar: the column to use as df.x
+    - sort_by: the column to sort by, eg 'imagename'
+    - compact, dtypes: see compact_dtypes
+    - compacted: the pages were compacted already (eg by the frame workers), so only reconcile their dtypes
+
+    Outputs:
+    - df: the dataframe
+    """
+    import pandas as pd
+    if compacted and compact:
+        df = select_columns(concat_frames(frames), frames)
+        if dtypes:
+            df = df.astype(dtypes)
+    else:
+        df = select_columns(pd.concat(frames, ignore_index=True, sort=False), frames)
+        if compact:
+            compact_dtypes(df, dtypes=dtypes)
+        elif dtypes:
+            df = df.astype(dtypes)
+
+    # Get the xvar
+    try:        df['x'] = df[xvar]
+    except:     warn('Invalid xvar!')
+
+    return df.sort_values(by=sort_by, ascending=True).reset_index(drop=True)
+
+
+def select_columns(df, frames):
+    """ Keep the columns that any of the page frames asks for in df.attrs['columns'] (see query_frame),
+    in the order they are first asked for, after the name column and x
+    """
+    if not any('columns' in frame.attrs for frame in frames):
+        return df
+    columns = dict.fromkeys([df.columns[0], 'x'])
+    for frame in frames:
+        columns.update(dict.fromkeys(frame.attrs.get('columns', ())))
+    columns.update(dict.fromkeys(ADDPARAMS))
+    df = df[[column for column in columns if column in df.columns]]
+    df.attrs.pop('columns', None)
+    return df
+
+
+def concat_frames(frames):
+    """ Concatenate page dataframes whose dtypes were inferred page by page.
+    Columns whose pages disagree (eg a bool column missing from a page, or categoricals with
+    different categories) are compacted again as a whole.
+    """
+    import pandas as pd
+    df = pd.concat(frames, ignore_index=True, sort=False)
+    mixed = [column for column in df.columns
+             if any(column in frame and frame[column].dtype != df[column].dtype for frame in frames)]
+    if mixed:
+        compacted = compact_dtypes(df[mixed].copy())
+        for column in mixed:
+            df[column] = compacted[column]
+    return df
+
+
+def compact_dtypes(df, dtypes=None, float_precision='double', category_ratio=0.5, exclude=('imagename', 'runtime', 'x')):
+    """ Give each param column a compact dtype, inferred from its values, in place
+
+    - booleans become bool (or the nullable 'boolean' if some are missing)
+    - integers become int64 (or floats if some are missing)
+    - floats become float64, or float32 with float_precision='single'
+    - strings that repeat a lot (eg camera or measurement_name) become categoricals
+    - anything else (lists, dicts, mixed types) stays as objects
+
+    Inputs:
+    - df: the image or run dataframe
+    - dtypes: a dict of column: dtype overriding the inferred dtypes
+    - float_precision: 'double' or 'single'
+    - category_ratio: strings become categorical when there are at most this many unique values per value
+    - exclude: columns to leave alone, unless they are in dtypes
+
+    Outputs:
+    - df: the same dataframe
+    """
+    import pandas as pd
+    dtypes = dtypes or {}
+    float_dtype = 'float32' if float_precision == 'single' else 'float64'
+    for column in df.columns:
+        if column in dtypes:
+            df[column] = df[column].astype(dtypes[column])
+            continue
+        if column in exclude:
+            continue
+        values = df[column]
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        has_missing = values.isna().any()
+        if kind == 'boolean':
+            df[column] = values.astype('boolean' if has_missing else bool)
+        elif kind == 'integer':
+            df[column] = values.astype('float64' if has_missing else 'int64')
+        elif kind in ('floating', 'mixed-integer-float'):
+            df[column] = values.astype(float_dtype)
+        elif kind == 'string':
+            if values.nunique() <= category_ratio * values.notna().sum():
+                df[column] = values.astype('category')
+    return df
@@ -0,0 +1,87 @@
+import datetime
+
+from breadboard.pagination import NoResultsError
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class IncrementalQuery:
+    """ A dataframe of images or runs that is kept up to date by fetching only what is new
+
+    Each refresh asks the API for the records at or after the latest runtime seen so far (the high-water mark),
+    and merges them into the dataframe. Records seen again replace their old rows, eg images that have since
+    been matched to a run. Rows older than the rolling window are dropped.
+
+        query = bc.incremental_images(window=datetime.timedelta(hours=2), paramsin=['holdTime'])
+        while True:
+            df = query.refresh()
+            ...
+
+    Inputs:
+    - client: a BreadboardClient
+    - kind: 'images' or 'runs'
+    - start: the time to start from, a naive UTC datetime (default: the start of the window, or now)
+    - window: keep rows this recent, relative to the latest row: a timedelta or a number of seconds (default: keep everything)
+    - max_rows: keep at most this many of the latest rows
+    Extra inputs are passed on to get_images_df or get_runs_df, eg paramsin or xvar
+    """
+
+    def __init__(self, client, kind='images', start=None, window=None, max_rows=None, **kwargs):
+        if kind not in ('images', 'runs'):
+            raise ValueError("kind should be 'images' or 'runs'")
+        if 'datetime_range' in kwargs or 'image_names' in kwargs:
+            raise ValueError('An incremental query follows the latest records, so it takes a start rather than a datetime_range or image_names.')
+        if isinstance(window, (int, float)):
+            window = datetime.timedelta(seconds=window)
+        self.client = client
+        self.kind = kind
+        self.window = window
+        self.max_rows = max_rows
+        self.kwargs = dict(kwargs, tqdm_disable=kwargs.get('tqdm_disable', True))
+        self.key = 'imagename' if kind == 'images' else 'runtime'
+        if start is None:
+            start = utcnow() - window if window is not None else utcnow()
+        self.high_water = start
+        self.df = None
+        self.new_rows = 0
+
+    def fetch(self, start):
+        """ The dataframe of records at or after start, or None if there aren't any """
+        get_df = self.client.get_images_df if self.kind == 'images' else self.client.get_runs_df
+        try:
+            return get_df(datetime_range=[start, None], **self.kwargs)
+        except NoResultsError:
+            return None
+
+    def refresh(self):
+        """ Fetch the new records and merge them in
+
+        Outputs:
+        - df: the up-to-date dataframe (also in self.df), or None until the first records arrive.
+          self.new_rows is the number of rows fetched.
+        """
+        import pandas as pd
+        new = self.fetch(self.high_water)
+        self.new_rows = 0 if new is None else len(new)
+        if new is not None and len(new):
+            if self.df is None:
+                df = new
+            else:
+                df = pd.concat([self.df, new], ignore_index=True, sort=False)
+            df = df.drop_duplicates(subset=self.key, keep='last')
+            latest = datetime.datetime.fromtimestamp(int(df['unixtime'].max()), datetime.timezone.utc).replace(tzinfo=None)
+            # the API's start_datetime is inclusive, so the next refresh sees the latest records again, and deduplicates them
+            self.high_water = max(self.high_water, latest)
+            self.df = self.evict(df).sort_values(by=self.key).reset_index(drop=True)
+        return self.df
+
+    def evict(self, df):
+        """ Drop the rows that have fallen out of the rolling window """
+        if self.window is not None:
+            cutoff = (self.high_water - self.window).replace(tzinfo=datetime.timezone.utc).timestamp()
+            df = df[df['unixtime'] >= cutoff]
+        if self.max_rows is not None and len(df) > self.max_rows:
+            df = df.sort_values(by='unixtime', kind='stable').iloc[-self.max_rows:]
+        return df
@@ -0,0 +1,275 @@
+import re
+import math
+import time
+import socket
+import threading
+from collections import namedtuple, deque
+from contextlib import contextmanager
+
+
+# One HTTP request: the status is None if the request failed before a response came back
+RequestEvent = namedtuple('RequestEvent', ['method', 'endpoint', 'status', 'bytes', 'latency', 'retries'])
+
+def endpoint_name(endpoint):
+    """ Group endpoints for stats: drop the query string, and replace ids with {id}, eg '/runs/{id}/' """
+    path = endpoint.split('?')[0]
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+
+def percentile(values, q):
+    """ The q-th percentile (0-100) of a list of numbers, by nearest rank """
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def retries_taken(response):
+    """ How many times urllib3 retried a request, from the retry history it leaves on the response """
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    return len(getattr(retries, 'history', None) or ())
+
+
+class Instrumentation:
+    """ Hooks for watching what a client spends its time on
+
+    - request hooks are called as hook(event) after every request, with a RequestEvent
+    - phase hooks are called as hook(name, seconds, tags) after every timed phase of a query:
+      'fetch' (waiting for a page), 'parse' (decoding a response body, wherever that happens, so it can overlap
+      with fetch), 'frame' (building a page's dataframe)
+      and 'sort' (compacting, sorting and tidying the combined dataframe). Fetch tags carry the page size.
+
+    Nothing is timed until a hook is added.
+    """
+
+    def __init__(self):
+        self.request_hooks = []
+        self.phase_hooks = []
+
+    def add_request_hook(self, hook):
+        self.request_hooks.append(hook)
+        return hook
+
+    def add_phase_hook(self, hook):
+        self.phase_hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        for hooks in (self.request_hooks, self.phase_hooks):
+            if hook in hooks:
+                hooks.remove(hook)
+
+    @property
+    def enabled(self):
+        return bool(self.request_hooks or self.phase_hooks)
+
+    def record_request(self, method, endpoint, status, nbytes, latency, retries=0):
+        if not self.request_hooks:
+            return
+        event = RequestEvent(method.upper(), endpoint_name(endpoint), status, nbytes, latency, retries)
+        for hook in self.request_hooks:
+            hook(event)
+
+    def record_phase(self, name, seconds, **tags):
+        for hook in self.phase_hooks:
+            hook(name, seconds, tags)
+
+    @contextmanager
+    def phase(self, name, **tags):
+        """ Time the body of a with block as a phase """
+        if not self.phase_hooks:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - start, **tags)
+
+    def timed_pages(self, pages, name='fetch'):
+        """ Time how long each page of a page generator takes to arrive, tagged with its size """
+        pages = iter(pages)
+        while True:
+            start = time.perf_counter()
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            if self.phase_hooks and isinstance(page, bytes):
+                # an undecoded page
+                self.record_phase(name, time.perf_counter() - start, bytes=len(page))
+            elif self.phase_hooks:
+                self.record_phase(name, time.perf_counter() - start, records=len(page))
+            yield page
+
+
+class StatsCollector:
+    """ Collects request and phase timings in memory, and summarizes them with percentiles
+
+        stats = StatsCollector(bc.instrumentation)
+        df = bc.get_images_df(image_names)
+        stats.summary()
+
+    Inputs:
+    - instrumentation: optionally, the client's Instrumentation to collect from
+    - max_samples: the number of latest timings kept for the percentiles, per endpoint or phase
+    """
+
+    def __init__(self, instrumentation=None, max_samples=10000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self.reset()
+        if instrumentation is not None:
+            self.attach(instrumentation)
+
+    def attach(self, instrumentation):
+        instrumentation.add_request_hook(self.on_request)
+        instrumentation.add_phase_hook(self.on_phase)
+        return self
+
+    def detach(self, instrumentation):
+        instrumentation.remove_hook(self.on_request)
+        instrumentation.remove_hook(self.on_phase)
+
+    def reset(self):
+        with self._lock:
+            self._requests = {}
+            self._phases = {}
+
+    def on_request(self, event):
+        key = event.method + ' ' + event.endpoint
+        with self._lock:
+            stats = self._requests.setdefault(key, {'count': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'total': 0.0,
+                                                    'latencies': deque(maxlen=self.max_samples)})
+            stats['count'] += 1
+            stats['errors'] += event.status is None or event.status >= 400
+            stats['retries'] += event.retries
+            stats['bytes'] += event.bytes or 0
+            stats['total'] += event.latency
+            stats['latencies'].append(event.latency)
+
+    def on_phase(self, name, seconds, tags):
+        with self._lock:
+            stats = self._phases.setdefault(name, {'count': 0, 'total': 0.0, 'records': 0,
+                                                   'times': deque(maxlen=self.max_samples)})
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['records'] += tags.get('records', 0)
+            stats['times'].append(seconds)
+
+    @staticmethod
+    def _percentiles(values):
+        values = list(values)
+        return {'p50': percentile(values, 50), 'p90': percentile(values, 90),
+                'p99': percentile(values, 99), 'max': max(values, default=float('nan'))}
+
+    def summary(self):
+        """ Outputs:
+        - {'requests': {'METHOD /endpoint/': {count, errors, retries, bytes, total, p50, p90, p99, max}},
+           'phases': {phase: {count, records, total, p50, p90, p99, max}}}, with times in seconds
+        """
+        with self._lock:
+            requests = {key: {'count': stats['count'], 'errors': stats['errors'], 'retries': stats['retries'],
+                              'bytes': stats['bytes'], 'total': stats['total'],
+                              **self._percentiles(stats['latencies'])}
+                        for key, stats in self._requests.items()}
+            phases = {name: {'count': stats['count'], 'records': stats['records'], 'total': stats['total'],
+                             **self._percentiles(stats['times'])}
+                      for name, stats in self._phases.items()}
+        return {'requests': requests, 'phases': phases}
+
+
+class Exporter:
+    """ The interface for sending timings to a metrics backend. Subclasses implement timing and increment.
+
+        exporter = StatsdExporter('localhost', 8125).attach(bc.instrumentation)
+    """
+
+    prefix = 'breadboard'
+
+    def timing(self, name, seconds, tags):
+        raise NotImplementedError
+
+    def increment(self, name, value, tags):
+        raise NotImplementedError
+
+    def on_request(self, event):
+        tags = {'method': event.method, 'endpoint': event.endpoint, 'status': event.status}
+        self.timing('request.latency', event.latency, tags)
+        self.increment('request.count', 1, tags)
+        if event.bytes:
+            self.increment('request.bytes', event.bytes, tags)
+        if event.retries:
+            self.increment('request.retries', event.retries, tags)
+
+    def on_phase(self, name, seconds, tags):
+        self.timing('phase.' + name, seconds, {'phase': name})
+        if tags.get('records'):
+            self.increment('phase.records', tags['records'], {'phase': name})
+
+    def attach(self, instrumentation):
+        instrumentation.add_request_hook(self.on_request)
+        instrumentation.add_phase_hook(self.on_phase)
+        return self
+
+
+class StatsdExporter(Exporter):
+    """ Sends timings to a statsd server over UDP, with dogstatsd-style tags
+
+    Inputs:
+    - host, port: the statsd server
+    - prefix: the prefix of the metric names
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='breadboard'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, name, value, kind, tags):
+        tagstr = ','.join('{}:{}'.format(key, value) for key, value in tags.items() if value is not None)
+        line = '{}.{}:{}|{}'.format(self.prefix, name, value, kind) + ('|#' + tagstr if tagstr else '')
+        try:
+            self.socket.sendto(line.encode(), self.address)
+        except OSError:
+            pass # metrics are best effort
+
+    def timing(self, name, seconds, tags):
+        self._send(name, round(seconds * 1000, 3), 'ms', tags)
+
+    def increment(self, name, value, tags):
+        self._send(name, value, 'c', tags)
+
+
+class OpenTelemetryExporter(Exporter):
+    """ Records timings as OpenTelemetry histograms and counters, through the global meter provider
+    (or the one given). Needs opentelemetry-api.
+    """
+
+    def __init__(self, meter_provider=None, prefix='breadboard'):
+        try:
+            from opentelemetry import metrics
+        except ImportError:
+            raise ImportError('OpenTelemetryExporter needs opentelemetry. Install it with: pip install opentelemetry-api')
+        provider = meter_provider or metrics.get_meter_provider()
+        self.meter = provider.get_meter('breadboard')
+        self.prefix = prefix
+        self._instruments = {}
+        self._lock = threading.Lock()
+
+    def _instrument(self, name, kind):
+        with self._lock:
+            if name not in self._instruments:
+                full_name = self.prefix + '.' + name
+                if kind == 'histogram':
+                    self._instruments[name] = self.meter.create_histogram(full_name, unit='s')
+                else:
+                    self._instruments[name] = self.meter.create_counter(full_name)
+            return self._instruments[name]
+
+    def timing(self, name, seconds, tags):
+        self._instrument(name, 'histogram').record(seconds, {key: str(tag) for key, tag in tags.items()})
+
+    def increment(self, name, value, tags):
+        self._instrument(name, 'counter').add(value, {key: str(tag) for key, tag in tags.items()})
@@ -1,11 +1,17 @@
-import json
-import pandas as pd
 import datetime
-import dateutil
+import math
 import re
-from tqdm.auto import tqdm
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import logging
 
+from breadboard import serializer
+from breadboard.pagination import iter_pages, map_ordered, NoResultsError
+from breadboard.frames import compact_dtypes, images_frame, query_frame, iter_frames, finish_frames, projection_fields, project_image
+from breadboard.export import write_frames
+from breadboard.incremental import IncrementalQuery
+
 from warnings import warn
 
 TIMEFORMATS = {
@@ -14,7 +20,12 @@ TIMEFORMATS = {
     'FERMI3_2':'%Y-%m-%d_%H-%M-%S',
 }
 
-FORCEMATCH_BATCHSIZE = 20
+FORCEMATCH_BATCHSIZE = 20 # initial batch size, adapted to the server latency
+FORCEMATCH_MAX_BATCHSIZE = 500
+FORCEMATCH_TARGET_LATENCY = 10 # seconds, well under the 30 s request timeout
+FORCEMATCH_RETRIES = 3
+
+IMAGE_BATCH_SIZE = 100 # updates per request to a batched image endpoint
 
 def timestr_to_datetime(time_string, format=None):
     time_string = re.sub(' ','0',time_string[0:19])
@@ -22,6 +33,34 @@ def timestr_to_datetime(time_string, format=None):
     return datetime.datetime.strptime(time_string,format)
 
 
+def timestrs_to_datetimes(time_strings, formats=None):
+    """ Parse a batch of image-name timestamps.
+    The format is inferred once, from the first name, out of the candidate formats, and then used for the whole batch.
+
+    Inputs:
+    - time_strings: a list of image names starting with a timestamp
+    - formats: a list of candidate strptime formats, in order of preference (default: all TIMEFORMATS)
+
+    Outputs:
+    - a list of python datetimes
+    """
+    if not formats: formats = list(TIMEFORMATS.values())
+    time_strings = [time_string[0:19].replace(' ','0') for time_string in time_strings]
+    if not time_strings:
+        return []
+    for format in formats:
+        try:
+            datetime.datetime.strptime(time_strings[0], format)
+        except ValueError:
+            continue
+        strptime = datetime.datetime.strptime
+        try:
+            return [strptime(time_string, format) for time_string in time_strings]
+        except ValueError:
+            break
+    raise ValueError('Please check your image timestamps')
+
+
 def clean_image_time(image_time):
     if type(image_time)==datetime.datetime:
         return image_time.isoformat()+'Z'
@@ -29,6 +68,129 @@ def clean_image_time(image_time):
         return image_time
 
 
+def image_query_payload(lab_name, image_names=None, auto_time=True, image_times=None, force_match=False, datetime_range=None, imagetimeformat=TIMEFORMATS['FERMI3'], fields=None, **kwargs):
+    """ Build the payload for an images query. Shared by the sync and async clients (see post_images for the inputs).
+    """
+    if image_names:
+        if isinstance(image_names,str):
+            image_names = [image_names]
+        namelist = ','.join(image_names)
+    else:
+        namelist = None
+
+    if lab_name=='bec1':
+        imagetimeformat = TIMEFORMATS['BEC1']
+
+    # Automatically find the image times from the imagenames
+    if image_names:
+        if auto_time:
+            image_times = timestrs_to_datetimes(image_names, formats=[imagetimeformat, TIMEFORMATS['FERMI3_2']])
+    else:
+        image_times = None
+
+    if image_times:
+        if type(image_times)==datetime.datetime:
+            image_times = [image_times]
+        image_times = [clean_image_time(image_time) for image_time in image_times]
+        image_times = ','.join(image_times)
+    else:
+        image_times = None
+
+    if datetime_range:
+        datetime_range = [clean_image_time(image_time) for image_time in datetime_range]
+    else:
+        datetime_range = [None, None]
+    
+    payload_dirty = {
+        'lab': lab_name,
+        'names': namelist,
+        'force_match': force_match,
+        'created': image_times,
+        'start_datetime': datetime_range[0],
+        'end_datetime': datetime_range[1],
+        'fields': ','.join(fields) if fields else None,
+        **kwargs
+    }
+
+    payload_clean = {k: v for k, v in payload_dirty.items() if not (
+                    v==None or
+                    (isinstance(v, tuple) and (None in v))
+            )}
+    return payload_clean
+
+
+def image_update_payload(image_name, params):
+    """ Build the payload for an image update. Shared by the sync and async clients.
+    """
+    payload = {
+        'name': image_name
+    }
+    return {**payload, **params}
+
+
+def image_endpoint(id):
+    if isinstance(id, float):
+        id = int(id)
+    return '/images/'+str(id)+'/'
+
+
+def is_missing(value):
+    """ Whether a dataframe cell is missing (NaN, NA or NaT). Arrays, like an ROI, and other values aren't """
+    if isinstance(value, float):
+        return math.isnan(value)
+    return type(value).__name__ in ('NAType', 'NaTType')
+
+
+def image_update_items(updates):
+    """ Iterate over image updates as (id, image_name, params)
+
+    Inputs:
+    - updates: any of
+        - an iterable of (id, image_name, params) tuples
+        - an iterable of dicts like {'id': 45, 'name': '...', 'params': {...}}, or {'id': 45, 'name': '...', **params}
+        - a dataframe with 'id' and 'name' (or 'imagename') columns, and either a 'params' column of dicts
+          or one column per param. Missing (NaN) values are left out.
+    An update that isn't one of these is yielded as (None, None, update), for image_update_body to reject.
+    """
+    if hasattr(updates, 'to_dict') and hasattr(updates, 'columns'):
+        updates = (row for row in updates.to_dict('records'))
+    for update in updates:
+        if isinstance(update, dict):
+            update = dict(update)
+            id = update.pop('id', None)
+            image_name = update.pop('name', None)
+            if image_name is None:
+                image_name = update.pop('imagename', None)
+            params = update.pop('params', None)
+            if params is None:
+                params = {key: value for key, value in update.items() if not is_missing(value)}
+            yield id, image_name, params
+        else:
+            try:
+                id, image_name, params = update
+            except (TypeError, ValueError):
+                id, image_name, params = None, None, update
+            yield id, image_name, params
+
+
+def image_update_body(id, image_name, params):
+    """ Validate and serialize one image update. Returns (id, payload json), or raises ValueError """
+    if isinstance(id, float) and id.is_integer():
+        id = int(id)
+    if isinstance(id, str) and id.isdigit():
+        id = int(id)
+    if not isinstance(id, int) or isinstance(id, bool):
+        raise ValueError('The image id should be an integer, not {!r}'.format(id))
+    if not isinstance(image_name, str) or not image_name:
+        raise ValueError('The image name should be a string, not {!r}'.format(image_name))
+    if not isinstance(params, dict):
+        raise ValueError('The params should be a dict, not {}'.format(type(params).__name__))
+    try:
+        return id, serializer.dumps(image_update_payload(image_name, params))
+    except (TypeError, ValueError) as e:
+        raise ValueError('The params could not be serialized: {}'.format(e))
+
+
 class ImageMixin:
     """ Useful functions for Image queries through the breadboard Client
     Plugs into breadboard/client.py
@@ -37,20 +199,107 @@ class ImageMixin:
     def update_image(self, id, image_name, params ):
         # return all the API data corresponding to a set of images as JSON
         # todo: validate inputs
-        payload = {
-            'name': image_name
-        }
-        payload = {**payload, **params}
-        if isinstance(id, float):
-            id = int(id)
-        update_url =  '/images/'+str(id)+'/'
-        response = self._send_message('PUT', update_url,
-                            data=json.dumps(payload)
+        payload = image_update_payload(image_name, params)
+        response = self._send_message('PUT', image_endpoint(id),
+                            data=serializer.dumps(payload)
                             )
         return response
 
 
-    def post_images(self, image_names=None, auto_time=True, image_times=None, force_match=False, datetime_range=None, imagetimeformat=TIMEFORMATS['FERMI3'], page='', **kwargs):
+    def bulk_update_images(self, updates, max_workers=8, batch_size=IMAGE_BATCH_SIZE, tqdm_disable=False):
+        """ Update many images at once, eg to set settings or atomsperpixel on every frame
+
+        Each update is validated and serialized once, and the updates are sent concurrently over the
+        client's session. If the API config sets an 'image_batch_endpoint', the updates are sent to it
+        in batches of batch_size, as a JSON list of image payloads with their ids; a batch that fails is
+        retried one image at a time. Otherwise each image gets a PUT, like update_image.
+        Updates are read lazily, so an iterator of updates is never held in memory all at once.
+
+        Inputs:
+        - updates: a list, iterator or dataframe of (id, image_name, params) updates, see image_update_items
+        - max_workers: the number of requests in flight at once
+        - batch_size: the number of images per request to the batched endpoint
+        - tqdm_disable: hide the progress bar
+
+        Outputs:
+        - a dict of id: {'ok': bool, 'status_code': int, 'error': str or None}, in the order of the updates
+        """
+        from tqdm.auto import tqdm
+        total = len(updates) if hasattr(updates, '__len__') else None
+        pbar = tqdm(total=total, desc='Updating...', leave=False, disable=tqdm_disable)
+
+        def validated():
+            for id, image_name, params in image_update_items(updates):
+                try:
+                    yield image_update_body(id, image_name, params)
+                except ValueError as e:
+                    yield id, e
+
+        def batches(items, size):
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        if self.image_batch_endpoint:
+            send, items = self._update_image_batch, batches(validated(), max(1, batch_size))
+        else:
+            send, items = (lambda item: [self._update_image_body(*item)]), validated()
+
+        results = {}
+        for batch_results in map_ordered(send, items, max_workers=max_workers):
+            for id, result in batch_results:
+                results[id] = result
+            pbar.update(len(batch_results))
+        pbar.close()
+
+        failed = [id for id, result in results.items() if not result['ok']]
+        if failed:
+            warn('Could not update images: ' + str(failed))
+        return results
+
+    def _update_image_body(self, id, body):
+        """ PUT one serialized image update. Returns (id, result) """
+        if isinstance(body, Exception):
+            return id, {'ok': False, 'status_code': None, 'error': str(body)}
+        try:
+            response = self._send_message('PUT', image_endpoint(id), data=body)
+        except RuntimeError as e:
+            return id, {'ok': False, 'status_code': None, 'error': str(e)}
+        ok = 200 <= response.status_code < 300
+        return id, {'ok': ok, 'status_code': response.status_code, 'error': None if ok else 'Could not put the image'}
+
+    def _update_image_batch(self, batch):
+        """ Send a batch of serialized image updates to the batched endpoint. Returns a list of (id, result) """
+        valid = [(id, body) for id, body in batch if not isinstance(body, Exception)]
+        if not valid:
+            return [self._update_image_body(id, body) for id, body in batch]
+        # splice the ids into the payloads, which are already serialized
+        data = '[' + ','.join('{"id":' + str(id) + ',' + body[1:] for id, body in valid) + ']'
+        try:
+            response = self._send_message('POST', self.image_batch_endpoint, data=data)
+            ok = 200 <= response.status_code < 300
+        except RuntimeError as e:
+            logging.debug('Batched image update failed: {}'.format(e))
+            ok = False
+        if not ok:
+            logging.debug('Batched image update failed, updating the images one at a time')
+            return [self._update_image_body(id, body) for id, body in batch]
+
+        # the batched endpoint doesn't say which images it changed, so drop them all from the caches
+        for id, _ in valid:
+            if self.cache is not None:
+                self.cache.invalidate_endpoint(self.lab_name, image_endpoint(id))
+            if self.response_cache is not None:
+                self.response_cache.invalidate_endpoint(image_endpoint(id))
+        return [(id, {'ok': True, 'status_code': response.status_code, 'error': None}) if not isinstance(body, Exception)
+                else self._update_image_body(id, body) for id, body in batch]
+
+    def post_images(self, image_names=None, auto_time=True, image_times=None, force_match=False, datetime_range=None, imagetimeformat=TIMEFORMATS['FERMI3'], page='', fields=None, **kwargs):
         """
         Returns all the API data corresponding to a set of images as JSON
 
@@ -68,73 +317,155 @@ class ImageMixin:
         - force_match: option to reset image runtimes in the API
         - datetime_range: a [start, end] array of python datetimes
         - imagetimeformat: python strptime format for reading the image times: eg '%Y-%m-%d_%H_%M_%S' (for Fermi 3)
-        
+        - fields: optionally, a list of the run parameters to send back, so the API can leave out the rest
+
         Outputs:
         - a json object containing the entire response from the API
 
         """
-        if image_names:
-            if isinstance(image_names,str):
-                image_names = [image_names]
-            namelist = ','.join(image_names)
-        else:
-            namelist = None
+        payload_clean = image_query_payload(self.lab_name, image_names, auto_time, image_times, force_match,
+                                            datetime_range, imagetimeformat, fields=fields, **kwargs)
 
-        if self.lab_name=='bec1':
-            imagetimeformat = TIMEFORMATS['BEC1']
+        response = self._send_message('post', '/images/'+page, data=serializer.dumps(payload_clean))
+ 
+        if not response.json().get('results'):
+            raise NoResultsError(response.json().get('detail'))
+        return response
 
-        # Automatically find the image times from the imagenames
-        if image_names:
-            if auto_time:
-                try:
-                    image_times = [timestr_to_datetime(image_name, format=imagetimeformat) for image_name in image_names]
-                except:
-                    imagetimeformat = TIMEFORMATS['FERMI3_2']
+
+
+
+    def force_match_images(self, image_names, imagetimeformat=TIMEFORMATS['FERMI3'], match_workers=4, tqdm_disable=False, **kwargs):
+        """ Reset the runtimes of a list of images in the API, posting batches concurrently
+
+        The batch size starts at FORCEMATCH_BATCHSIZE and adapts to the server latency:
+        it grows while batches come back well under FORCEMATCH_TARGET_LATENCY, and halves
+        when a batch is slow or fails. Failed batches are split and retried up to FORCEMATCH_RETRIES times,
+        unless the API found none of their images (NoResultsError), which is raised straight away.
+
+        Inputs:
+        - image_names: a list of image names
+        - imagetimeformat: python strptime format for reading the image times
+        - match_workers: the maximum number of batches in flight at once
+        Extra inputs are passed on to post_images
+
+        Outputs:
+        - the number of images matched
+        """
+        from tqdm.auto import tqdm
+        if isinstance(image_names, str):
+            image_names = [image_names]
+
+        def post_batch(names, attempts):
+            if attempts:
+                time.sleep(0.5 * 2**attempts) # back off before retrying
+            start = time.perf_counter()
+            self.post_images(names, imagetimeformat=imagetimeformat, force_match=True, **kwargs)
+            return time.perf_counter() - start
+
+        batch_size = FORCEMATCH_BATCHSIZE
+        remaining = deque(image_names)
+        retries = deque()
+        in_flight = {}
+        pbar = tqdm(total=len(image_names), desc='Matching...', leave=False, disable=tqdm_disable)
+
+        with ThreadPoolExecutor(max_workers=max(1, match_workers)) as executor:
+            while remaining or retries or in_flight:
+                # Keep the pool busy
+                while len(in_flight) < max(1, match_workers) and (remaining or retries):
+                    if retries:
+                        names, attempts = retries.popleft()
+                    else:
+                        names = [remaining.popleft() for _ in range(min(batch_size, len(remaining)))]
+                        attempts = 0
+                    in_flight[executor.submit(post_batch, names, attempts)] = (names, attempts)
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    names, attempts = in_flight.pop(future)
                     try:
-                        image_times = [timestr_to_datetime(image_name, format=imagetimeformat) for image_name in image_names]
-                    except:
-                        raise ValueError('Please check your image timestamps')
-        else:
-            image_times = None
+                        latency = future.result()
+                    except NoResultsError:
+                        # the API doesn't know these images, so retrying won't help
+                        pbar.close()
+                        raise
+                    except RuntimeError as e:
+                        batch_size = max(1, batch_size // 2)
+                        if attempts >= FORCEMATCH_RETRIES:
+                            pbar.close()
+                            raise RuntimeError('Force matching failed for images: ' + ','.join(names)) from e
+                        logging.debug('Force match batch of {} failed, retrying: {}'.format(len(names), e))
+                        for i in range(0, len(names), batch_size):
+                            retries.append((names[i:i+batch_size], attempts + 1))
+                        continue
+
+                    pbar.update(len(names))
+                    logging.debug('Force matched {} images in {:.2f} s'.format(len(names), latency))
+                    if latency > FORCEMATCH_TARGET_LATENCY:
+                        batch_size = max(1, batch_size // 2)
+                    elif latency < FORCEMATCH_TARGET_LATENCY / 2 and len(names) >= batch_size:
+                        batch_size = min(FORCEMATCH_MAX_BATCHSIZE, int(batch_size * 1.5) + 1)
+
+        pbar.close()
+        return len(image_names)
+
+
+    def _iter_image_pages(self, image_names=None, imagetimeformat=TIMEFORMATS['FERMI3'], page_workers=4, tqdm_disable=True, fields=None, raw=False, **kwargs):
+        """ Yield the list of image records on each page of a query, in page order, as the pages arrive.
+        With fields, the API is asked for only those run parameters, and the records are trimmed
+        to them in case it sends back more. See pagination.iter_pages for raw.
+        """
+        # Every page is asked for with the same body, so parse the image times and serialize it once
+        data = serializer.dumps(image_query_payload(self.lab_name, image_names, imagetimeformat=imagetimeformat,
+                                                    fields=fields, **kwargs))
 
-        if image_times:
-            if type(image_times)==datetime.datetime:
-                image_times = [image_times]
-            image_times = [clean_image_time(image_time) for image_time in image_times]
-            image_times = ','.join(image_times)
-        else:
-            image_times = None
+        def get_page(page):
+            return self._send_message('post', '/images/'+page, data=data)
 
-        if datetime_range:
-            datetime_range = [clean_image_time(image_time) for image_time in datetime_range]
-        else:
-            datetime_range = [None, None]
-    
-        payload_dirty = {
-            'lab': self.lab_name,
-            'names': namelist,
-            'force_match': force_match,
-            'created': image_times,
-            'start_datetime': datetime_range[0],
-            'end_datetime': datetime_range[1],
-            **kwargs
-        }
-
-        payload_clean = {k: v for k, v in payload_dirty.items() if not (
-                        v==None or
-                        (isinstance(v, tuple) and (None in v))
-                )}
-
-        response = self._send_message('post', '/images/'+page, data=json.dumps(payload_clean))
- 
-        if not response.json().get('results'):
-            raise RuntimeError(response.json().get('detail'))
-        return response
+        def first_page():
+            response = get_page('')
+            if not response.json().get('results'):
+                raise NoResultsError(response.json().get('detail'))
+            return response
+
+        project = (lambda image: project_image(image, fields)) if fields else None
+        return iter_pages(first_page, get_page, 'images/', project, page_workers, tqdm_disable, raw)
 
 
+    def _cache_image_pages(self, pages):
+        """ Cache the images of each page on their way through """
+        for images in pages:
+            # Images that haven't been matched to a run yet might be matched later, so don't cache them
+            self.cache.put_many(self.lab_name, 'image', {image['name']: image for image in images if image.get('run')})
+            yield images
 
 
-    def get_images_df(self, image_names=None, paramsin="list_bound_only", xvar='unixtime', extended=False, imagetimeformat=TIMEFORMATS['FERMI3'], force_match=False, tqdm_disable=False, **kwargs):
+    def iter_images(self, image_names=None, as_frames=False, paramsin="list_bound_only", extended=False, imagetimeformat=TIMEFORMATS['FERMI3'], page_workers=4, tqdm_disable=True, **kwargs):
+        """ Stream the images of a query page by page, without holding every page in memory
+
+        Inputs:
+        - image_names: a list of image names
+        - as_frames: if True, yield a dataframe per page instead of single image records
+        - paramsin, extended: which params to put in each dataframe (see get_images_df)
+        - imagetimeformat: python strptime format for reading the image times
+        - page_workers: the number of pages to fetch ahead concurrently
+        Extra inputs are passed on to post_images, eg datetime_range
+
+        Outputs:
+        - a generator of image records (dicts), or of dataframes if as_frames
+        """
+        if isinstance(image_names, str):
+            image_names = [image_names]
+        fields = projection_fields(paramsin, extended) if as_frames else None
+        for images in self._iter_image_pages(image_names, imagetimeformat=imagetimeformat, page_workers=page_workers,
+                                             tqdm_disable=tqdm_disable, fields=fields, **kwargs):
+            if as_frames:
+                yield images_frame(images, paramsin, extended)
+            else:
+                yield from images
+
+
+    def get_images_df(self, image_names=None, paramsin="list_bound_only", xvar='unixtime', extended=False, imagetimeformat=TIMEFORMATS['FERMI3'], force_match=False, tqdm_disable=False, page_workers=4, match_workers=4, compact=True, dtypes=None, frame_workers=1, **kwargs):
         """ Return a pandas dataframe for the given imagenames
         Inputs:
         - image_names: a list of image names
@@ -146,6 +477,12 @@ class ImageMixin:
         - extended: a boolean to show all the keys from the image, like the url and id
         - imagetimeformat : a python strptime format to parse the image times: eg '%Y-%m-%d_%H_%M_%S' (for Fermi 3)
         - force_match: option to reset image runtimes in the API
+        - page_workers: the number of pages to fetch concurrently (1 to fetch them one at a time)
+        - match_workers: the number of force_match batches to post concurrently
+        - compact: give each param column a compact dtype inferred from its values (see frames.compact_dtypes)
+        - dtypes: a dict of column: dtype to override the inferred dtypes
+        - frame_workers: the number of processes to decode pages and build their dataframes in, for very large
+          queries (1 to build them in this process). Scripts need an if __name__ == '__main__': guard for this.
         Extra inputs used by post_message:
         - auto_time: if True, automatically find the image_times from the image names (eg if the image name is a timestamp)
         - image_times: an optional list of image times
@@ -157,12 +494,15 @@ class ImageMixin:
 
         Note: force_match increases the time, so the input is broken up to prevent blackbox timeouts.
         If force_match:
-        - Print a quick message saying this is time-consuming, and wait until the API returns something (TODO: speed this process up)
+        - Print a quick message saying this is time-consuming, and post the images in concurrent batches (see force_match_images)
         - When the API returns something, assume the force_match is done, and then query the rest of the data without force_match (as follows:)
 
         If not force_match:
-        - Query through all pages, with a tqdm display
-        - Collate all the data in a combined json
+        - With a list of params (and no cache), ask the API for only those params
+        - Query the first page to find the total count
+        - Query the remaining pages concurrently (up to page_workers at a time), with a tqdm display
+        - Build a dataframe for each page as it arrives (see iter_images), and combine them in page order
+        - With frame_workers, the pages are decoded and built in a process pool instead, and their column types reconciled
         
         """
         if image_names:
@@ -174,115 +514,74 @@ class ImageMixin:
             # Force match if needed
             if force_match:
                 print('Re-matching runs to images. Note: this takes some time, so run force_match=False to speed up.')
-                for i in tqdm(range(1+len(image_names)//FORCEMATCH_BATCHSIZE), 
-                            desc='Matching...',
-                            leave=False,
-                            disable=tqdm_disable):
-                    images_to_post = image_names[i*FORCEMATCH_BATCHSIZE : (i+1)*FORCEMATCH_BATCHSIZE]
-                    if images_to_post:
-                        self.post_images(images_to_post, imagetimeformat=imagetimeformat, force_match=True, **kwargs)
+                self.force_match_images(image_names, imagetimeformat=imagetimeformat,
+                                        match_workers=match_workers, tqdm_disable=tqdm_disable, **kwargs)
 
 
         
-        # Get the first page
-        response = self.post_images(image_names=image_names, imagetimeformat=imagetimeformat, force_match=False, **kwargs)
-        jsonresponse = response.json()
-        pbar = tqdm(total=jsonresponse.get('count'), disable=tqdm_disable)
-        images = jsonresponse.get('results')
-        pbar.update(len(images))
-
-        # Get all pages. Note: Force matching only needs to be run once
-        while jsonresponse.get('next'):
-            page = re.split('images/', jsonresponse.get('next'))[1]
-            response = self.post_images(image_names, imagetimeformat=imagetimeformat, force_match=False, page=page, **kwargs)
-            jsonresponse = response.json()
-            images = images + jsonresponse.get('results')
-            pbar.update(len(jsonresponse.get('results')))
-
-        # Prepare df
-        df = pd.DataFrame(columns = ['imagename'])
-        try:
-            df['imagename'] = [image['name'] for image in images]
-        except:
-            raise RuntimeError('Couldnt extract imagenames')
-        df['x'] = 0
-
-        # Prepare params:
-        if extended:
-            paramsall = set(images[0].keys())
-        else:
-            paramsall = set()
-        if paramsin=='*':
-            #  Get all params
-            for jr in images:
-                try:    params = set(jr['run']['parameters'].keys())
-                except: params = set()
-                paramsall = paramsall.union(params)
-        elif paramsin=='list_bound_only':
-            # Get listbound params
-            for jr in images:
-                try:    params = set(jr['run']['parameters']['ListBoundVariables'])
-                except: params = set()
-                paramsall = paramsall.union(params)
-        else:# use set of params provided
-            if isinstance(paramsin, str):
-                paramsin = [paramsin]
-            paramsall = paramsall.union(set(paramsin))
-
-        removeparams = set([
-                    'run',
-                    'name',
-                    'thumbnail',
-                    'atomsperpixel',
-                    'settings',
-                    'ListBoundVariables',
-                    'camera',
-                    ])
-        addparams = set([
-                    'unixtime'
-                    ])
-
-        paramsall = (paramsall - removeparams).union(addparams)
-
-
-
-
-        # Populate dataframe
-        for i, _ in df.iterrows():
-
-            try: # to get the runtime
-                runtime = images[i]['run']['runtime']
-                logging.debug(runtime)
-            except:
-                runtime = '1970'
-                warn('no run found for some images')
-
-            for param in paramsall:
-
-                if param=='runtime':
-                    df.at[i, param] = runtime
-                elif param=='unixtime':
-                    df.at[i, param] = int(dateutil.parser.parse(runtime).timestamp())
-                else:
-                    # try to get run params
-                    try: df.at[i,param] = images[i]['run']['parameters'][param]
-                    except:
-                        # try to get the bare image parameters
-                        try:    df.at[i,param] = images[i][param]
-                        except: df.at[i,param] = float('nan') # nan the rest
-
-
-        # Get the xvar
-        try:        df['x'] = df[xvar]
-        except:     warn('Invalid xvar!')
-
-        df = df.sort_values(by='imagename', ascending=True).reset_index(drop=True)
+        # Serve what we can from the on-disk cache, and only fetch the missing or stale images
+        use_cache = self.cache is not None and bool(image_names) and set(kwargs) <= {'auto_time'}
+        # Without the cache, ask the API for only the params we need. The cache keeps whole records
+        fields = None if use_cache else projection_fields(paramsin, extended)
+        cached = {}
+        names_to_fetch = image_names
+        if use_cache:
+            if not force_match:
+                cached = self.cache.get_many(self.lab_name, 'image', image_names, compact=True)
+            names_to_fetch = [image_name for image_name in image_names if image_name not in cached]
+
+        in_processes = frame_workers > 1
+        frames = []
+        if cached:
+            frames.append(query_frame(list(cached.values()), 'images', paramsin, extended))
+            if in_processes and compact:
+                compact_dtypes(frames[0])
+        if not use_cache or names_to_fetch:
+            pages = self._iter_image_pages(names_to_fetch, imagetimeformat=imagetimeformat, page_workers=page_workers,
+                                           tqdm_disable=tqdm_disable, fields=fields, raw=in_processes and not use_cache,
+                                           **kwargs)
+            pages = self.instrumentation.timed_pages(pages)
+            if use_cache:
+                pages = self._cache_image_pages(pages)
+            frames.extend(frame for frame, _ in iter_frames(pages, 'images', self.instrumentation, paramsin, extended,
+                                                            fields, frame_workers, compact))
+
+        with self.instrumentation.phase('sort'):
+            df = finish_frames(frames, xvar, 'imagename', compact, dtypes, compacted=in_processes)
 
         return df
 
 
+    def export_images(self, path, image_names=None, format='parquet', paramsin='*', extended=False, page_workers=4, **kwargs):
+        """ Write images straight from the paginated API into a typed, columnar dataset,
+        partitioned by lab and date (eg path/lab=fermi3/date=2019-06-20/part-....parquet).
+        Read it back with breadboard.export.read_export. Needs pyarrow.
+
+        Inputs:
+        - path: the root folder of the dataset
+        - image_names: a list of image names
+        - format: 'parquet' or 'arrow' (arrow files memory-map without copying)
+        - paramsin, extended: which params to write (see get_images_df)
+        Extra inputs are passed on to post_images, eg datetime_range
+
+        Outputs:
+        - the number of images written
+        """
+        frames = self.iter_images(image_names, as_frames=True, paramsin=paramsin, extended=extended,
+                                  page_workers=page_workers, **kwargs)
+        return write_frames(frames, path, self.lab_name, format=format)
+
+
+    def incremental_images(self, start=None, window=None, max_rows=None, **kwargs):
+        """ An image dataframe that is kept up to date by fetching only the new images on each refresh().
+        See breadboard.incremental.IncrementalQuery for the inputs.
+        """
+        return IncrementalQuery(self, 'images', start=start, window=window, max_rows=max_rows, **kwargs)
+
+
     def get_images_df_clipboard(self, xvar='unixtime', **kwargs):
         """ A convenient clipboard getter. Returns all parameters, and places the desired one in xvar
         """
+        import pandas as pd
         df = self.get_images_df(pd.read_clipboard(header=None)[0].tolist(), xvar=xvar, **kwargs)
         return df
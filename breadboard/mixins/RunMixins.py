@@ -1,20 +1,236 @@
-import json
-import pandas as pd
+import copy
+import math
+import time
 import datetime
-import dateutil
 import re
-from tqdm.auto import tqdm
 import logging
 
 from warnings import warn
 
+from breadboard import serializer
+from breadboard.records import KeyTable, compact
+from breadboard.frames import runs_frame, iter_frames, finish_frames, projection_fields, project_run
+from breadboard.pagination import iter_pages, page_suffix, map_ordered, NoResultsError
+from breadboard.export import write_frames
+from breadboard.incremental import IncrementalQuery
+
+RUNS_PAGE_SIZE = 500
+REVALIDATE = {'Cache-Control': 'no-cache'} # headers for reads that mustn't be served from the response cache unchecked
+RUNS_WINDOW_SIZE = 2000 # runs per time window, when a long datetime_range is split up
+RUNS_MAX_WINDOWS = 64
+
+
+def clean_run_time(run_time):
+    if type(run_time)==datetime.datetime:
+        return run_time.isoformat()+'Z'
+    else:
+        return run_time
+
+DEFAULT_LATENCY = {'run': 0.13, 'page': 0.5} # seconds, starting guesses until latencies are measured
+
+
+def run_endpoint(run_id):
+    return '/runs/' + str(run_id) + '/'
+
+
+def run_query_payload(lab_name, datetime_range=None, fields=None, **kwargs):
+    """ Build the query parameters for a runs query. Shared by the sync and async clients.
+    """
+    if datetime_range:
+        datetime_range = [clean_run_time(run_time)
+                          for run_time in datetime_range]
+    else:
+        datetime_range = [None, None]
+
+    payload_dirty = {
+        'lab': lab_name,
+        'start_datetime': datetime_range[0],
+        'end_datetime': datetime_range[1],
+        'fields': ','.join(fields) if fields else None,
+        **kwargs
+    }
+
+    payload_clean = {k: v for k, v in payload_dirty.items() if not (
+        v == None or
+        (isinstance(v, tuple) and (None in v))
+    )}
+    return payload_clean
+
+
+# Merges for the run annotation methods. Each updates a run dict in place. Shared by the sync and async clients.
+
+def merge_measurement_name(run_dict, measurement_name):
+    if 'measurement_name' in run_dict['parameters']:
+        raise ValueError(
+            'This run_id is already associated with a measurement.')
+    run_dict['parameters'].update({'measurement_name': measurement_name})
+
+
+def merge_image_filenames(run_dict, image_filenames):
+    """ Returns the merged list of image filenames """
+    if isinstance(image_filenames, str):
+        image_filenames = [image_filenames]
+    if 'image_filenames' in run_dict['parameters']:
+        image_filenames = list(set().union(
+            run_dict['parameters']['image_filenames'], image_filenames))
+        warn('Images were already associated with this run_id.')
+    run_dict['parameters'].update({'image_filenames': image_filenames})
+    return image_filenames
+
+
+def merge_analysis(run_dict, analysis_dict):
+    if 'analyzed_variables' in run_dict['parameters']:
+        analyzed_variables = list(set().union(
+            run_dict['parameters']['analyzed_variables'], [var_name for var_name in analysis_dict]))
+        run_dict['parameters'].update(
+            {'analyzed_variables': analyzed_variables})
+    else:
+        run_dict['parameters'].update(
+            {'analyzed_variables': [var_name for var_name in analysis_dict]})
+
+    run_dict['parameters'].update(analysis_dict)
+
+
+def check_instrument_names(instruments_dict):
+    for instr_name in instruments_dict:
+        if '_in_' not in instr_name:
+            raise ValueError(
+                '{name} is not in format intstrname_in_unitname (e.g. wavemeter_in_THz). Add units properly.'.format(name=instr_name))
+
+
+def merge_instrument_readout(run_dict, instruments_dict):
+    if 'instrument_names' in run_dict['parameters']:
+        instrument_names = list(set().union(
+            run_dict['parameters']['instrument_names'], [instr_name for instr_name in instruments_dict]))
+        run_dict['parameters'].update(
+            {'instrument_names': instrument_names})
+    else:
+        run_dict['parameters'].update(
+            {'instrument_names': [instr_name for instr_name in instruments_dict]})
+
+    run_dict['parameters'].update(instruments_dict)
+
+
+def print_run_update(run_id, message, run_dict):
+    print('run_id ' + str(run_id) + ' ' + message + '\n')
+    for var in run_dict['parameters']['ListBoundVariables']:
+        print(var + ': ')
+        print(run_dict['parameters'][var])
+
+
+RUN_UPDATE_KEYS = ('image_filenames', 'measurement_name', 'analysis', 'instruments')
+
+
+def group_run_updates(updates):
+    """ Check a batch of run updates and group them by run id, keeping their order
+
+    Inputs:
+    - updates: a list of dicts with a 'run_id' and any of the RUN_UPDATE_KEYS, or a dict of run_id: update
+
+    Outputs:
+    - a dict of run_id: [update, ...]
+    """
+    if isinstance(updates, dict):
+        updates = [dict(update, run_id=run_id) for run_id, update in updates.items()]
+    grouped = {}
+    for update in updates:
+        if 'run_id' not in update:
+            raise ValueError('Every update needs a run_id.')
+        unknown = set(update) - set(RUN_UPDATE_KEYS) - {'run_id'}
+        if unknown:
+            raise ValueError('Unknown run update keys: {}. Use {}.'.format(sorted(unknown), RUN_UPDATE_KEYS))
+        if 'instruments' in update:
+            check_instrument_names(update['instruments'])
+        grouped.setdefault(update['run_id'], []).append(update)
+    return grouped
+
+
+def apply_run_updates(run_dict, updates):
+    """ Merge a list of updates into a run dict in place, the same way the single annotation methods do """
+    for update in updates:
+        if 'image_filenames' in update:
+            merge_image_filenames(run_dict, update['image_filenames'])
+        if 'analysis' in update:
+            merge_analysis(run_dict, update['analysis'])
+        if 'instruments' in update:
+            merge_instrument_readout(run_dict, update['instruments'])
+        if 'measurement_name' in update:
+            merge_measurement_name(run_dict, update['measurement_name'])
+
+
+def plan_run_id_fetches(run_ids, get_latency, page_latency, page_size=RUNS_PAGE_SIZE, workers=8):
+    """ Split run ids into dense clusters, fetched with windowed queries, and sparse leftovers, fetched one by one
+
+    Sorted ids are grouped wherever consecutive ids are less than a page apart. A group becomes a cluster
+    if paging through its window is expected to be faster than fetching its ids with concurrent single GETs.
+
+    Inputs:
+    - run_ids: a list of run ids
+    - get_latency: the expected time of a single run GET, in seconds
+    - page_latency: the expected time of a page of the runs list, in seconds
+    - page_size: the number of runs per page
+    - workers: the number of concurrent single GETs
+
+    Outputs:
+    - clusters: a list of sorted lists of ids
+    - singles: a list of ids
+    """
+    ids = sorted(set(run_ids))
+    groups = []
+    for run_id in ids:
+        if groups and run_id - groups[-1][-1] <= page_size:
+            groups[-1].append(run_id)
+        else:
+            groups.append([run_id])
+
+    clusters, singles = [], []
+    workers = max(1, workers)
+    for group in groups:
+        span = group[-1] - group[0] + 1
+        window_cost = get_latency + math.ceil(span / page_size) * page_latency
+        single_cost = math.ceil(len(group) / workers) * get_latency
+        if len(group) > 2 and window_cost < single_cost:
+            clusters.append(group)
+        else:
+            singles.extend(group)
+    return clusters, singles
+
+
+def to_utc_datetime(run_time):
+    """ A naive UTC datetime from a datetime or an ISO 8601 string """
+    if isinstance(run_time, str):
+        import dateutil.parser
+        run_time = dateutil.parser.isoparse(run_time)
+    if run_time.tzinfo is not None:
+        run_time = run_time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return run_time
+
+
+def split_time_range(start, end, count, window_runs=RUNS_WINDOW_SIZE, max_windows=RUNS_MAX_WINDOWS):
+    """ Split a time range into equal windows, each expected to hold about window_runs runs,
+    given that the whole range holds count runs. Neighbouring windows share their boundary.
+
+    Inputs:
+    - start, end: naive UTC datetimes
+    - count: the number of runs in the range
+    - window_runs: the number of runs to aim for in each window
+    - max_windows: the most windows to split into
+
+    Outputs:
+    - a list of (start, end) tuples, in order
+    """
+    n_windows = min(max_windows, max(1, math.ceil(count / window_runs)))
+    step = (end - start) / n_windows
+    bounds = [start + i * step for i in range(n_windows)] + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
 
 class RunMixin:
     """ Useful functions for Run queries through the breadboard Client
     Plugs into breadboard/client.py
     """
 
-    def get_runs(self, datetime_range=None, page='', **kwargs):
+    def get_runs(self, datetime_range=None, page='', fields=None, **kwargs):
         """
         Returns all the API data corresponding to a set of runs as JSON
 
@@ -24,39 +240,54 @@ class RunMixin:
 
         Inputs:
         - datetime_range: a [start, end] array of python datetimes
+        - fields: optionally, a list of the run parameters to send back, so the API can leave out the rest
 
         Outputs:
         - a json object containing the entire response from the API
 
         """
 
-        if datetime_range:
-            datetime_range = [clean_run_time(run_time)
-                              for run_time in datetime_range]
-        else:
-            datetime_range = [None, None]
-
-        payload_dirty = {
-            'lab': self.lab_name,
-            'start_datetime': datetime_range[0],
-            'end_datetime': datetime_range[1],
-            **kwargs
-        }
-
-        payload_clean = {k: v for k, v in payload_dirty.items() if not (
-            v == None or
-            (isinstance(v, tuple) and (None in v))
-        )}
+        payload_clean = run_query_payload(self.lab_name, datetime_range, fields=fields, **kwargs)
         logging.debug(payload_clean)
 
         response = self._send_message(
             'get', '/runs/' + page, params=payload_clean)
 
         if not response.json().get('results'):
-            raise RuntimeError(response.json().get('detail'))
+            raise NoResultsError(response.json().get('detail'))
         return response
 
-    def get_runs_df(self, paramsin="list_bound_only", xvar='unixtime', extended=False, tqdm_disable=False, **kwargs):
+    def _iter_run_pages(self, page_workers=4, tqdm_disable=True, fields=None, raw=False, **kwargs):
+        """ Yield the list of run records on each page of a query, in page order, as the pages arrive.
+        With fields, the API is asked for only those parameters, and the records are trimmed
+        to them in case it sends back more. See pagination.iter_pages for raw.
+        """
+        # The next links already carry the query parameters
+        get_page = lambda page: self._send_message('get', '/runs/' + page)
+        first_page = lambda: self.get_runs(fields=fields, **kwargs)
+        project = (lambda run: project_run(run, fields)) if fields else None
+        return iter_pages(first_page, get_page, 'runs/', project, page_workers, tqdm_disable, raw)
+
+    def iter_runs(self, as_frames=False, paramsin="list_bound_only", extended=False, page_workers=4, tqdm_disable=True, **kwargs):
+        """ Stream the runs of a query page by page, without holding every page in memory
+
+        Inputs:
+        - as_frames: if True, yield a dataframe per page instead of single run records
+        - paramsin, extended: which params to put in each dataframe (see get_runs_df)
+        - page_workers: the number of pages to fetch ahead concurrently
+        Extra inputs are passed on to get_runs, eg datetime_range
+
+        Outputs:
+        - a generator of run records (dicts), or of dataframes if as_frames
+        """
+        fields = projection_fields(paramsin, extended) if as_frames else None
+        for runs in self._iter_run_pages(page_workers=page_workers, tqdm_disable=tqdm_disable, fields=fields, **kwargs):
+            if as_frames:
+                yield runs_frame(runs, paramsin, extended)
+            else:
+                yield from runs
+
+    def get_runs_df(self, paramsin="list_bound_only", xvar='unixtime', extended=False, tqdm_disable=False, page_workers=4, compact=True, dtypes=None, window_workers=4, window_runs=RUNS_WINDOW_SIZE, frame_workers=1, **kwargs):
         """ Return a pandas dataframe for run data
         Inputs:
         - paramsin:
@@ -66,208 +297,256 @@ class RunMixin:
         - xvar: a variable to use as df.x
         - extended: a boolean to show all the keys from the run, like the url and id
         - datetime_range: a [start, end] array of python datetimes
+        - page_workers: the number of pages to fetch concurrently (1 to fetch them one at a time)
+        - compact: give each param column a compact dtype inferred from its values (see frames.compact_dtypes)
+        - dtypes: a dict of column: dtype to override the inferred dtypes
+        - window_workers: the number of time windows to fetch concurrently, when a datetime_range is split up (1 to not split it)
+        - window_runs: the number of runs to aim for in each time window
+        - frame_workers: the number of processes to decode pages and build their dataframes in, for very large
+          queries (1 to build them in this process). Scripts need an if __name__ == '__main__': guard for this.
 
 
         Outputs:
         - df: the dataframe with params
 
+        A datetime_range holding more than window_runs runs is split into time windows, sized from the
+        number of runs in the range, and the windows are paged through concurrently. A window that turns
+        out to hold many more runs than expected is split again. Runs are deduplicated by id.
+        With frame_workers, the pages are decoded and built in a process pool, and their column types reconciled.
 
         """
-
-        # Get the first page
-        response = self.get_runs(**kwargs)
-        jsonresponse = response.json()
-        runs = jsonresponse.get('results')
-
-        # Prepare df
-        df = pd.DataFrame(columns=['runtime'])
-        try:
-            df['runtime'] = [run['runtime'] for run in runs]
-        except:
-            raise RuntimeError('Couldnt extract runtimes')
-        df['x'] = 0
-
-        # Prepare params:
-        if extended:
-            paramsall = set(runs[0].keys())
-        else:
-            paramsall = set()
-        if paramsin == '*':
-            #  Get all params
-            for jr in runs:
-                try:
-                    params = set(jr['parameters'].keys())
-                except:
-                    params = set()
-                paramsall = paramsall.union(params)
-        elif paramsin == 'list_bound_only':
-            # Get listbound params
-            for jr in runs:
-                try:
-                    params = set(jr['parameters']['ListBoundVariables'])
-                except:
-                    params = set()
-                paramsall = paramsall.union(params)
-        else:  # use set of params provided
-            if isinstance(paramsin, str):
-                paramsin = [paramsin]
-            paramsall = paramsall.union(set(paramsin))
-
-        removeparams = set([
-            'ListBoundVariables',
-        ])
-        addparams = set([
-            'unixtime'
-        ])
-
-        paramsall = (paramsall - removeparams).union(addparams)
-
-        # Populate dataframe
-        for i, _ in df.iterrows():
-
-            try:  # to get the runtime
-                runtime = runs[i]['runtime']
-            except:
-                runtime = '1970'
-                warn('no run found for some runs')
-
-            for param in paramsall:
-
-                if param == 'runtime':
-                    df.at[i, param] = runtime
-                elif param == 'unixtime':
-                    df.at[i, param] = int(
-                        dateutil.parser.parse(runtime).timestamp())
-                else:
-                    # try to get run params
-                    try:
-                        df.at[i, param] = runs[i]['parameters'][param]
-                    except:
-                        # try to get the bare run parameters
-                        try:
-                            df.at[i, param] = runs[i][param]
-                        except:
-                            df.at[i, param] = float('nan')  # nan the rest
-
-        # Get the xvar
-        try:
-            df['x'] = df[xvar]
-        except:
-            warn('Invalid xvar!')
-
-        df = df.sort_values(
-            by='runtime', ascending=True).reset_index(drop=True)
+        # Get all pages, building a dataframe for each as it arrives.
+        # Without the cache, ask the API for only the params we need. The cache keeps whole records
+        fields = None if self.cache is not None else projection_fields(paramsin, extended)
+        in_processes = frame_workers > 1
+        datetime_range = kwargs.pop('datetime_range', None)
+        pages = None
+        if datetime_range and None not in datetime_range and window_workers > 1:
+            start, end = to_utc_datetime(datetime_range[0]), to_utc_datetime(datetime_range[1])
+            count = self._count_runs((start, end), **kwargs)
+            if count > window_runs:
+                logging.debug('Splitting {} runs into time windows'.format(count))
+                windows = split_time_range(start, end, count, window_runs)
+                pages = self._iter_run_windows(windows, count, window_workers, window_runs, tqdm_disable, fields, **kwargs)
+        if pages is None:
+            # Without the cache, the frame workers can decode the pages themselves
+            pages = self._iter_run_pages(page_workers=page_workers, tqdm_disable=tqdm_disable, fields=fields,
+                                         datetime_range=datetime_range, raw=in_processes and self.cache is None, **kwargs)
+
+        frames = []
+        seen = set()
+        pages = self.instrumentation.timed_pages(pages)
+        if self.cache is not None:
+            pages = self._cache_run_pages(pages)
+        for frame, ids in iter_frames(pages, 'runs', self.instrumentation, paramsin, extended, fields, frame_workers, compact):
+            # Pages can overlap, eg at window boundaries, or when runs are added during the query
+            keep = [run_id not in seen for run_id in ids]
+            seen.update(ids)
+            if any(keep):
+                frames.append(frame if all(keep) else frame[keep])
+        if not frames:
+            raise RuntimeError('No runs found')
+
+        with self.instrumentation.phase('sort'):
+            df = finish_frames(frames, xvar, 'runtime', compact, dtypes, compacted=in_processes)
 
         return df
 
+    def _cache_run_pages(self, pages):
+        """ Cache the runs of each page on its way through """
+        for runs in pages:
+            self.cache.put_many(self.lab_name, 'run', {run['id']: run for run in runs})
+            yield runs
+
+    def _count_runs(self, window, **kwargs):
+        """ The number of runs in a (start, end) time window, from a one-run query """
+        params = run_query_payload(self.lab_name, [clean_run_time(time) for time in window], **dict(kwargs, limit=1))
+        return self._send_message('get', '/runs/', params=params).json().get('count') or 0
+
+    def _iter_run_windows(self, windows, count, window_workers, window_runs, tqdm_disable=True, fields=None, **kwargs):
+        """ Yield the runs of each time window as a page, fetching windows concurrently
+        """
+        from tqdm.auto import tqdm
+        pbar = tqdm(total=count, disable=tqdm_disable)
+        fetch = lambda window: self._fetch_run_window(window, window_runs, fields, **kwargs)
+        for runs in map_ordered(fetch, windows, max_workers=window_workers):
+            pbar.update(len(runs))
+            yield runs
+        pbar.close()
+
+    def _fetch_run_window(self, window, window_runs, fields=None, **kwargs):
+        """ All the runs in a (start, end) time window, paged through one page at a time.
+        If the window holds more than twice window_runs, it is split again by its own density.
+        """
+        count = self._count_runs(window, **kwargs)
+        if not count:
+            return []
+        subwindows = split_time_range(window[0], window[1], count, window_runs)
+        if count > 2 * window_runs and len(subwindows) > 1 and (window[1] - window[0]).total_seconds() > 1:
+            return [run for subwindow in subwindows for run in self._fetch_run_window(subwindow, window_runs, fields, **kwargs)]
+        kwargs.setdefault('limit', RUNS_PAGE_SIZE)
+        pages = self._iter_run_pages(page_workers=1, fields=fields,
+                                     datetime_range=[clean_run_time(time) for time in window], **kwargs)
+        # A window's runs wait for the windows before it, so hold them compactly
+        table = KeyTable()
+        return [compact(run, table) for runs in pages for run in runs]
+
+    def export_runs(self, path, format='parquet', paramsin='*', extended=False, page_workers=4, **kwargs):
+        """ Write runs straight from the paginated API into a typed, columnar dataset,
+        partitioned by lab and date (eg path/lab=fermi3/date=2019-06-20/part-....parquet).
+        Read it back with breadboard.export.read_export. Needs pyarrow.
+
+        Inputs:
+        - path: the root folder of the dataset
+        - format: 'parquet' or 'arrow' (arrow files memory-map without copying)
+        - paramsin, extended: which params to write (see get_runs_df)
+        Extra inputs are passed on to get_runs, eg datetime_range
+
+        Outputs:
+        - the number of runs written
+        """
+        frames = self.iter_runs(as_frames=True, paramsin=paramsin, extended=extended,
+                                page_workers=page_workers, **kwargs)
+        return write_frames(frames, path, self.lab_name, format=format)
+
+    def incremental_runs(self, start=None, window=None, max_rows=None, **kwargs):
+        """ A run dataframe that is kept up to date by fetching only the new runs on each refresh().
+        See breadboard.incremental.IncrementalQuery for the inputs.
+        """
+        return IncrementalQuery(self, 'runs', start=start, window=window, max_rows=max_rows, **kwargs)
+
+    def get_run(self, run_id, revalidate=False):
+        """ Return the run dict for a run id.
+        With revalidate, check with the server even if the run is in the response cache,
+        eg before changing and putting it back.
+        """
+        headers = REVALIDATE if revalidate else None
+        return self._send_message('get', run_endpoint(run_id), headers=headers).json()
+
+    def _put_run(self, run_id, run_dict):
+        return self._send_message('put', run_endpoint(run_id), data=serializer.dumps(run_dict))
+
     def add_measurement_name_to_run(self, run_id, measurement_name):
-        run_dict = self._send_message(
-            'get', '/runs/' + str(run_id) + '/').json()
-        if 'measurement_name' in run_dict['parameters']:
-            raise ValueError(
-                'This run_id is already associated with a measurement.')
-        run_dict['parameters'].update({'measurement_name': measurement_name})
-        payload = json.dumps(run_dict)
-        response = self._send_message(
-            'put', '/runs/' + str(run_id) + '/', data=payload)
+        run_dict = self.get_run(run_id, revalidate=True)
+        merge_measurement_name(run_dict, measurement_name)
+        response = self._put_run(run_id, run_dict)
         return response
 
     def append_images_to_run(self, run_id, image_filenames, measurement_name=None, printing=True):
-        if isinstance(image_filenames, str):
-            image_filenames = [image_filenames]
-        run_dict = self._send_message(
-            'get', '/runs/' + str(run_id) + '/').json()
-        if 'image_filenames' in run_dict['parameters']:
-            image_filenames = list(set().union(
-                run_dict['parameters']['image_filenames'], image_filenames))
-            warn('Images were already associated with this run_id.')
-        run_dict['parameters'].update({'image_filenames': image_filenames})
-        payload = json.dumps(run_dict)
-        response = self._send_message(
-            'put', '/runs/' + str(run_id) + '/', data=payload)
+        run_dict = self.get_run(run_id, revalidate=True)
+        image_filenames = merge_image_filenames(run_dict, image_filenames)
+        response = self._put_run(run_id, run_dict)
         if printing:
-            print('run_id ' + str(run_id) + ' associated with ' +
-                  str(image_filenames) + '\n')
-            for var in run_dict['parameters']['ListBoundVariables']:
-                print(var + ': ')
-                print(run_dict['parameters'][var])
+            print_run_update(run_id, 'associated with ' + str(image_filenames), run_dict)
         if measurement_name is not None:
             self.add_measurement_name_to_run(run_id, measurement_name)
         return response
 
     def append_analysis_to_run(self, run_id, analysis_dict, printing=True):
-        run_dict = self._send_message(
-            'get', '/runs/' + str(run_id) + '/').json()
-        if 'analyzed_variables' in run_dict['parameters']:
-            analyzed_variables = list(set().union(
-                run_dict['parameters']['analyzed_variables'], [var_name for var_name in analysis_dict]))
-            run_dict['parameters'].update(
-                {'analyzed_variables': analyzed_variables})
-        else:
-            run_dict['parameters'].update(
-                {'analyzed_variables': [var_name for var_name in analysis_dict]})
-
-        run_dict['parameters'].update(analysis_dict)
-        payload = json.dumps(run_dict)
-        response = self._send_message(
-            'put', '/runs/' + str(run_id) + '/', data=payload)
+        run_dict = self.get_run(run_id, revalidate=True)
+        merge_analysis(run_dict, analysis_dict)
+        response = self._put_run(run_id, run_dict)
         if printing:
-            print('run_id ' + str(run_id) + ' analyzed: ' +
-                  str(analysis_dict) + '\n')
-            for var in run_dict['parameters']['ListBoundVariables']:
-                print(var + ': ')
-                print(run_dict['parameters'][var])
+            print_run_update(run_id, 'analyzed: ' + str(analysis_dict), run_dict)
         return response
 
     def add_instrument_readout_to_run(self, run_id, instruments_dict, printing=True):
-        for instr_name in instruments_dict:
-            if '_in_' not in instr_name:
-                raise ValueError(
-                    '{name} is not in format intstrname_in_unitname (e.g. wavemeter_in_THz). Add units properly.'.format(name=instr_name))
-
-        run_dict = self._send_message(
-            'get', '/runs/' + str(run_id) + '/').json()
-        if 'instrument_names' in run_dict['parameters']:
-            instrument_names = list(set().union(
-                run_dict['parameters']['instrument_names'], [instr_name for instr_name in instruments_dict]))
-            run_dict['parameters'].update(
-                {'instrument_names': instrument_names})
-        else:
-            run_dict['parameters'].update(
-                {'instrument_names': [instr_name for instr_name in instruments_dict]})
-
-        run_dict['parameters'].update(instruments_dict)
-        payload = json.dumps(run_dict)
-        response = self._send_message(
-            'put', '/runs/' + str(run_id) + '/', data=payload)
+        check_instrument_names(instruments_dict)
+        run_dict = self.get_run(run_id, revalidate=True)
+        merge_instrument_readout(run_dict, instruments_dict)
+        response = self._put_run(run_id, run_dict)
         if printing:
-            print('run_id ' + str(run_id) + ' associated with: ' +
-                  str(instruments_dict) + '\n')
-            for var in run_dict['parameters']['ListBoundVariables']:
-                print(var + ': ')
-                print(run_dict['parameters'][var])
+            print_run_update(run_id, 'associated with: ' + str(instruments_dict), run_dict)
         return response
 
-    def add_measurement_name_to_run(self, run_id, measurement_name):
-        run_dict = self._send_message(
-            'get', '/runs/' + str(run_id) + '/').json()
-        if 'measurement_name' in run_dict['parameters']:
-            raise ValueError(
-                'This run_id is already associated with a measurement.')
-        run_dict['parameters'].update({'measurement_name': measurement_name})
-        payload = json.dumps(run_dict)
-        response = self._send_message(
-            'put', '/runs/' + str(run_id) + '/', data=payload)
-        return response
+    def annotate_runs(self, updates, max_workers=8, check_conflicts=True, conflict_retries=1, printing=False, tqdm_disable=False):
+        """ Annotate many runs at once, with a single GET and PUT per run
+
+        All the updates for a run are merged into one read-modify-write, and runs are written concurrently.
+        If the server sends an ETag, the PUT is conditional on it (If-Match). Otherwise, with check_conflicts,
+        the run is fetched again just before the PUT and compared. A run that changed in between is re-read
+        and re-merged up to conflict_retries times, and then reported as a conflict.
+
+        Inputs:
+        - updates: a list of dicts like
+            {'run_id': 1234, 'analysis': {...}, 'instruments': {...}, 'image_filenames': [...], 'measurement_name': '...'}
+          or a dict of run_id: update. Several updates for the same run are applied in order.
+        - max_workers: the number of runs to write concurrently
+        - check_conflicts: re-check runs before writing when the server doesn't send ETags (one more GET per run)
+        - conflict_retries: how many times to redo a run that changed under us
+        - printing: print the list-bound variables of each run, like the single annotation methods
 
-    def get_runs_df_from_ids(self, run_ids, optional_column_names=[]):
+        Outputs:
+        - a dict of run_id: {'ok': bool, 'status_code': int, 'conflict': bool, 'error': str or None}
+        """
+        from tqdm.auto import tqdm
+        grouped = group_run_updates(updates)
+
+        def annotate(item):
+            run_id, run_updates = item
+            try:
+                result, run_dict = self._annotate_run(run_id, run_updates, check_conflicts, conflict_retries)
+            except (RuntimeError, ValueError) as e:
+                return run_id, {'ok': False, 'status_code': None, 'conflict': False, 'error': str(e)}
+            if printing and result['ok']:
+                print_run_update(run_id, 'updated with ' + str(run_updates), run_dict)
+            return run_id, result
+
+        results = {}
+        pbar = tqdm(total=len(grouped), desc='Annotating...', leave=False, disable=tqdm_disable)
+        for run_id, result in map_ordered(annotate, list(grouped.items()), max_workers=max_workers):
+            results[run_id] = result
+            pbar.update(1)
+        pbar.close()
+
+        failed = [run_id for run_id, result in results.items() if not result['ok']]
+        if failed:
+            warn('Could not annotate runs: ' + str(failed))
+        return results
+
+    def _annotate_run(self, run_id, run_updates, check_conflicts=True, conflict_retries=1):
+        """ One read-modify-write of a run, with conflict detection. Returns (result, run_dict) """
+        for attempt in range(conflict_retries + 1):
+            response = self._send_message('get', run_endpoint(run_id), headers=REVALIDATE)
+            if response.status_code != 200:
+                return {'ok': False, 'status_code': response.status_code, 'conflict': False,
+                        'error': 'Could not get the run'}, None
+            original = response.json()
+            etag = response.headers.get('ETag')
+
+            run_dict = copy.deepcopy(original)
+            apply_run_updates(run_dict, run_updates)
+
+            headers = None
+            if etag:
+                headers = {'If-Match': etag}
+            elif check_conflicts and self._send_message('get', run_endpoint(run_id), headers=REVALIDATE).json() != original:
+                logging.debug('run {} changed while annotating it (attempt {})'.format(run_id, attempt))
+                continue
+
+            response = self._send_message('put', run_endpoint(run_id), data=serializer.dumps(run_dict), headers=headers)
+            if response.status_code == 412:
+                logging.debug('run {} changed while annotating it (attempt {})'.format(run_id, attempt))
+                continue
+            ok = 200 <= response.status_code < 300
+            return {'ok': ok, 'status_code': response.status_code, 'conflict': False,
+                    'error': None if ok else 'Could not put the run'}, run_dict
+
+        return {'ok': False, 'status_code': 412 if etag else None, 'conflict': True,
+                'error': 'The run kept changing while it was being annotated'}, None
+
+    def get_runs_df_from_ids(self, run_ids, optional_column_names=[], max_workers=8):
         """takes run_ids, either a list of run_id's or a single run_id int, and returns a df 
-        of the columns relevant for plotting or analysis
+        of the columns relevant for plotting or analysis.
+        Dense clusters of ids are fetched with windowed queries, and the rest with up to max_workers concurrent GETs.
+        The runs are held as compact records (see breadboard/records.py) until the dataframe is built.
         """
+        import pandas as pd
         def filter_response(resp):
             """ takes breadboard response resp (a nested dict) and returns a filtered and flattened dict.
             Try with resp = bc._send_message('get', '/runs/259499').json() or 
             resp = bc._send_message('get', '/runs/', params=params)['results'][idx]
+            (or a CompactDict of either)
             """
             filtered_rundict = {}
             filtered_rundict['run_id'] = int(resp['id'])
@@ -292,37 +571,85 @@ class RunMixin:
             filtered_rundict.update(
                 {key: run_dict[key] for key in run_dict['ListBoundVariables']})
             return filtered_rundict
-        sec_per_APIrequest = 0.13  # approximate benchmark
-        max_bruteforce_tolerance = 1
-        # sec, maximum time allowed for brute-force style repeated get requests
         if not isinstance(run_ids, list):
             run_ids = [run_ids]
-        if len(run_ids) == 1:
-            resp = self._send_message('get',
-                                      '/runs/{idx}'.format(idx=str(run_ids[0]))
-                                      ).json()
-            filtered_rundict = filter_response(resp)
-            df = pd.DataFrame(filtered_rundict, index=[0])
-        elif len(run_ids) * sec_per_APIrequest < max_bruteforce_tolerance:
-            df_rows = []
-            for run_id in run_ids:
-                resp = self._send_message('get',
-                                          '/runs/{idx}'.format(idx=str(run_id))
-                                          ).json()
-                filtered_rundict = filter_response(resp)
-                df_rows += [pd.DataFrame(filter_response(resp), index=[0])]
-            df = pd.concat(df_rows, sort=False)
-        else:
-            run_ids.sort()
-            datetime_range = []
-            start_datetime, end_datetime = [self._send_message(
-                'get', '/runs/{id}'.format(id=str(run_ids[idx]))).json()['runtime'] for idx in [0, -1]]
-            params = {'lab': self.lab_name,
-                      'start_datetime': start_datetime,
-                      'end_datetime': end_datetime,
-                      'limit': (run_ids[-1] - run_ids[0] + 1)}
-            resp = self._send_message('get', '/runs/', params=params).json()
-            df_rows = [pd.DataFrame(filter_response(result), index=[0])
-                       for result in resp['results'] if result['id'] in run_ids]
-            df = pd.concat(df_rows, sort=False)
+
+        # Serve what we can from the on-disk cache, and only fetch the missing or stale runs
+        cached = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(self.lab_name, 'run', run_ids, compact=True)
+        ids_to_fetch = [run_id for run_id in run_ids if str(run_id) not in cached]
+
+        with self.instrumentation.phase('fetch', records=len(ids_to_fetch)):
+            fetched = self._fetch_runs_by_id(ids_to_fetch, max_workers=max_workers)
+        if self.cache is not None and fetched:
+            self.cache.put_many(self.lab_name, 'run', fetched)
+
+        runs = []
+        for run_id in run_ids:
+            if str(run_id) in cached:
+                runs.append(cached[str(run_id)])
+            elif run_id in fetched:
+                runs.append(fetched[run_id])
+        with self.instrumentation.phase('frame', records=len(runs)):
+            df = pd.DataFrame([filter_response(run) for run in runs])
         return df
+
+    def _timed_get(self, kind, endpoint, params=None):
+        """ GET an endpoint and keep a running estimate of the latency of this kind of request """
+        start = time.perf_counter()
+        response = self._send_message('get', endpoint, params=params)
+        elapsed = time.perf_counter() - start
+        if getattr(response, 'from_cache', False):
+            return response
+        previous = self.latency.get(kind)
+        self.latency[kind] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+        return response
+
+    def _fetch_runs_by_id(self, run_ids, max_workers=8):
+        """ Fetch the runs with the given ids, using windowed queries for dense clusters of ids
+        and concurrent single GETs for the rest. Returns a dict of run_id: run.
+        """
+        if not run_ids:
+            return {}
+        clusters, singles = plan_run_id_fetches(
+            run_ids,
+            get_latency=self.latency.get('run', DEFAULT_LATENCY['run']),
+            page_latency=self.latency.get('page', DEFAULT_LATENCY['page']),
+            page_size=RUNS_PAGE_SIZE,
+            workers=max_workers)
+        logging.debug('Fetching {} runs in {} windows and {} single requests'.format(
+            len(run_ids), len(clusters), len(singles)))
+
+        table = KeyTable()
+
+        def get_run(run_id):
+            return compact(self._timed_get('run', run_endpoint(run_id)).json(), table)
+
+        # Single runs, plus the boundary runs that set the window of each cluster
+        boundaries = [run_id for cluster in clusters for run_id in (cluster[0], cluster[-1])]
+        to_get = list(dict.fromkeys(singles + boundaries))
+        runs = {run['id']: run for run in map_ordered(get_run, to_get, max_workers=max_workers)}
+
+        def get_window(cluster):
+            wanted = set(cluster)
+            params = {'lab': self.lab_name,
+                      'start_datetime': runs[cluster[0]]['runtime'],
+                      'end_datetime': runs[cluster[-1]]['runtime'],
+                      'limit': RUNS_PAGE_SIZE}
+            found = []
+            jsonresponse = self._timed_get('page', '/runs/', params=params).json()
+            found += [compact(run, table) for run in jsonresponse['results'] if run['id'] in wanted]
+            while jsonresponse.get('next'):
+                page = page_suffix(jsonresponse.get('next'), 'runs/')
+                jsonresponse = self._timed_get('page', '/runs/' + page).json()
+                found += [compact(run, table) for run in jsonresponse['results'] if run['id'] in wanted]
+            return found
+
+        for found in map_ordered(get_window, clusters, max_workers=max_workers):
+            runs.update({run['id']: run for run in found})
+
+        # Anything the windows missed (eg runs sharing a boundary runtime) gets fetched one by one
+        missing = [run_id for run_id in run_ids if run_id not in runs]
+        runs.update({run['id']: run for run in map_ordered(get_run, missing, max_workers=max_workers)})
+        return runs
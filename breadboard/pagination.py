@@ -0,0 +1,123 @@
+import re
+import math
+import urllib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class NoResultsError(RuntimeError):
+    """ The API found nothing for a query. The message is the API's detail """
+
+
+def page_suffix(next_url, endpoint):
+    """ Return the part of a 'next' link that follows the endpoint, eg '?limit=100&offset=100'
+    """
+    return re.split(endpoint, next_url)[1]
+
+
+def remaining_pages(next_url, endpoint, count, page_size):
+    """ Work out the page suffixes of every remaining page from the 'next' link of the first page
+
+    Inputs:
+    - next_url: the 'next' link returned with the first page
+    - endpoint: the endpoint to split the link on, eg 'images/'
+    - count: the total number of results reported by the API
+    - page_size: the number of results on the first page
+
+    Outputs:
+    - a list of page suffixes, in order, or None if the pagination scheme isn't recognized
+    """
+    if not next_url or not count or not page_size:
+        return None
+    path, _, querystring = page_suffix(next_url, endpoint).partition('?')
+    query = urllib.parse.parse_qs(querystring)
+
+    if 'offset' in query:
+        # limit/offset pagination
+        key = 'offset'
+        limit = int(query.get('limit', [page_size])[0])
+        values = range(int(query['offset'][0]), count, limit)
+    elif 'page' in query:
+        # page number pagination
+        key = 'page'
+        values = range(int(query['page'][0]), math.ceil(count / page_size) + 1)
+    else:
+        return None
+
+    pages = []
+    for value in values:
+        query[key] = [str(value)]
+        pages.append(path + '?' + urllib.parse.urlencode(query, doseq=True))
+    return pages
+
+
+def map_ordered(fn, items, max_workers=1, executor=None):
+    """ Apply fn to each item with a bounded thread pool, yielding the results in input order.
+    At most 2*max_workers results are held in memory at any time.
+    An executor, eg a process pool, can be passed in instead; it is shut down at the end.
+    """
+    if executor is None and (not max_workers or max_workers <= 1):
+        for item in items:
+            yield fn(item)
+        return
+
+    with executor or ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_pages(first_page, get_page, endpoint, project=None, page_workers=4, tqdm_disable=True, raw=False):
+    """ Yield the records on each page of a query, in page order, as the pages arrive.
+    The pages after the first are fetched concurrently when their links can be worked out from the first,
+    and otherwise by following the next links one at a time.
+
+    Inputs:
+    - first_page: a function returning the response of the first page
+    - get_page: a function returning the response of a page suffix, eg '?limit=100&offset=100'
+    - endpoint: the endpoint to split the next links on, eg 'runs/'
+    - project: optionally, a function trimming each record, eg to the requested fields
+    - page_workers: the number of pages to fetch ahead concurrently
+    - raw: yield the pages after the first as undecoded response bodies (untrimmed),
+      to be decoded elsewhere, eg in the frame workers
+
+    Outputs:
+    - a generator of lists of records (or of bytes, with raw)
+    """
+    from tqdm.auto import tqdm
+
+    def trim(records):
+        return [project(record) for record in records] if project else records
+
+    # Get the first page
+    jsonresponse = first_page().json()
+    count = jsonresponse.get('count')
+    pbar = tqdm(total=count, disable=tqdm_disable)
+    records = trim(jsonresponse.get('results'))
+    page_size = len(records)
+    pbar.update(page_size)
+    yield records
+
+    # Get all pages
+    pages = remaining_pages(jsonresponse.get('next'), endpoint, count, page_size)
+    if pages is not None and raw:
+        for content in map_ordered(lambda page: get_page(page).content, pages, max_workers=page_workers):
+            pbar.update(min(page_size, count - pbar.n)) # the page size, without decoding the page
+            yield content
+    elif pages is not None:
+        fetch = lambda page: trim(get_page(page).json().get('results'))
+        for records in map_ordered(fetch, pages, max_workers=page_workers):
+            pbar.update(len(records))
+            yield records
+    else:
+        # Unknown pagination scheme: follow the next links one at a time
+        while jsonresponse.get('next'):
+            jsonresponse = get_page(page_suffix(jsonresponse.get('next'), endpoint)).json()
+            records = trim(jsonresponse.get('results'))
+            pbar.update(len(records))
+            yield records
+    pbar.close()
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import threading
+from warnings import warn
+
+try:
+    import fcntl
+except ImportError: # windows
+    fcntl = None
+
+
+class TokenBucket:
+    """ A thread-safe token bucket.
+    Reservations can overdraw the bucket; the caller then waits until the tokens would have refilled.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _reserve(state, rate, burst, now, tokens):
+        """ Refill a {'tokens', 'updated'} state, take tokens out of it, and return the wait in seconds """
+        state['tokens'] = min(burst, state['tokens'] + (now - state['updated']) * rate)
+        state['updated'] = now
+        state['tokens'] -= tokens
+        return max(0.0, -state['tokens'] / rate)
+
+    def reserve(self, tokens=1):
+        """ Take tokens out of the bucket, and return how long to wait before using them """
+        with self._lock:
+            state = {'tokens': self.tokens, 'updated': self.updated}
+            wait = self._reserve(state, self.rate, self.burst, time.monotonic(), tokens)
+            self.tokens, self.updated = state['tokens'], state['updated']
+        return wait
+
+
+class FileTokenBucket(TokenBucket):
+    """ A token bucket whose state lives in a json file, under an exclusive file lock,
+    so that it is shared by every process using the same file.
+    """
+
+    def __init__(self, rate, burst, path, key):
+        super().__init__(rate, burst)
+        self.path = path
+        self.key = key
+
+    def reserve(self, tokens=1):
+        with self._lock, open(self.path, 'a+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                try:
+                    states = json.loads(file.read() or '{}')
+                except ValueError:
+                    states = {}
+                # the file is shared between processes, so use wall clock time
+                now = time.time()
+                state = states.get(self.key, {'tokens': self.burst, 'updated': now})
+                wait = self._reserve(state, self.rate, self.burst, now, tokens)
+                states[self.key] = state
+                file.seek(0)
+                file.truncate()
+                file.write(json.dumps(states))
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        return wait
+
+
+class RateLimiter:
+    """ Client-side rate limiting, with a token bucket per endpoint budget
+
+    Inputs:
+    - limits: a dict of budget: {'rate': requests per second, 'burst': bucket size}.
+      Budgets are 'METHOD /endpoint/' prefixes like 'POST /images/' or 'GET /runs/', plus 'default'.
+    - lockfile: optionally, a file to share the buckets with other processes
+    """
+
+    def __init__(self, limits, lockfile=None):
+        if lockfile and fcntl is None:
+            warn('File locks are not available on this platform, so the rate limit is only shared between threads.')
+            lockfile = None
+        if lockfile:
+            lockfile = os.path.expanduser(lockfile)
+            directory = os.path.dirname(lockfile)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        self.buckets = {}
+        for budget, limit in limits.items():
+            if lockfile:
+                self.buckets[budget] = FileTokenBucket(limit['rate'], limit.get('burst'), lockfile, budget)
+            else:
+                self.buckets[budget] = TokenBucket(limit['rate'], limit.get('burst'))
+        # longest prefixes first, so the most specific budget wins
+        self._prefixes = sorted((budget for budget in self.buckets if budget != 'default'), key=len, reverse=True)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {budget: {'requests': 0, 'waits': 0, 'wait_time': 0.0, 'max_wait': 0.0} for budget in self.buckets}
+
+    def budget(self, method, endpoint):
+        """ The budget a request counts against, or None if it isn't limited """
+        request = method.upper() + ' ' + endpoint
+        for prefix in self._prefixes:
+            if request.startswith(prefix):
+                return prefix
+        return 'default' if 'default' in self.buckets else None
+
+    def reserve(self, method, endpoint):
+        """ Reserve a request, and return how long to wait before sending it """
+        budget = self.budget(method, endpoint)
+        if budget is None:
+            return 0.0
+        wait = self.buckets[budget].reserve()
+        with self._stats_lock:
+            stats = self._stats[budget]
+            stats['requests'] += 1
+            if wait > 0:
+                stats['waits'] += 1
+                stats['wait_time'] += wait
+                stats['max_wait'] = max(stats['max_wait'], wait)
+        return wait
+
+    def acquire(self, method, endpoint):
+        """ Block until a request is allowed. Returns the time waited, in seconds """
+        wait = self.reserve(method, endpoint)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self):
+        """ Per-budget counts of requests and of the time spent waiting """
+        with self._stats_lock:
+            return {budget: dict(stats) for budget, stats in self._stats.items()}
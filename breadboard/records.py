@@ -0,0 +1,113 @@
+""" Compact, read-only image and run records, for holding many records at once
+
+A record decoded from JSON is a tree of dicts, and a run with a hundred parameters takes a few kilobytes.
+compact() turns the dicts into CompactDicts: the keys of each dict are interned in a KeyTable and shared
+by every dict with the same keys (most runs have the same parameters), float values are packed into a
+typed array, and the other values are kept in a tuple. CompactDicts are Mappings, so the frame builders
+and filters read them like the dicts they replace.
+
+    table = KeyTable()
+    runs = [compact(run, table) for run in page['results']]
+    runs[0]['parameters']['ListBoundVariables']
+"""
+import sys
+from array import array
+from collections.abc import Mapping
+
+NO_FLOATS = array('d') # shared by the dicts without float values, and never changed
+
+
+class Schema:
+    """ The layout shared by the compact dicts with the same keys, and the same keys holding floats """
+    __slots__ = ('names', 'index')
+
+    def __init__(self, names, floats):
+        self.names = names
+        # name: (True, position in the float array) or (False, position in the tuple of other values)
+        self.index = {}
+        positions = [0, 0]
+        for name, is_float in zip(names, floats):
+            self.index[name] = (is_float, positions[is_float])
+            positions[is_float] += 1
+
+
+class KeyTable:
+    """ Interns the keys of compact dicts, so that dicts with the same keys share one Schema """
+
+    def __init__(self):
+        self.schemas = {}
+
+    def schema(self, names, floats):
+        schema = self.schemas.get((names, floats))
+        if schema is None:
+            names = tuple(sys.intern(name) if isinstance(name, str) else name for name in names)
+            schema = self.schemas[(names, floats)] = Schema(names, floats)
+        return schema
+
+    def __len__(self):
+        return len(self.schemas)
+
+
+class CompactDict(Mapping):
+    """ A read-only dict, with its keys in a shared Schema and its floats in a typed array. See compact() """
+    __slots__ = ('_schema', '_floats', '_values')
+
+    def __init__(self, schema, floats, values):
+        self._schema = schema
+        self._floats = floats
+        self._values = values
+
+    def __getitem__(self, key):
+        is_float, position = self._schema.index[key]
+        return self._floats[position] if is_float else self._values[position]
+
+    def __contains__(self, key):
+        return key in self._schema.index
+
+    def __iter__(self):
+        return iter(self._schema.names)
+
+    def __len__(self):
+        return len(self._schema.names)
+
+    def get(self, key, default=None):
+        location = self._schema.index.get(key)
+        if location is None:
+            return default
+        return self._floats[location[1]] if location[0] else self._values[location[1]]
+
+    def to_dict(self):
+        """ A plain (nested) dict with the same contents """
+        return {key: to_plain(value) for key, value in self.items()}
+
+    def __repr__(self):
+        return 'CompactDict({!r})'.format(self.to_dict())
+
+
+def compact(value, table=None):
+    """ A compact copy of a decoded JSON value: its dicts become CompactDicts, at any depth
+
+    Inputs:
+    - value: eg an image or run record
+    - table: the KeyTable to share keys through. Use one table for all the records of a query.
+    """
+    if isinstance(value, dict):
+        if table is None:
+            table = KeyTable()
+        values = value.values()
+        floats = tuple(type(item) is float for item in values)
+        schema = table.schema(tuple(value), floats)
+        packed = array('d', [item for item in values if type(item) is float]) if any(floats) else NO_FLOATS
+        return CompactDict(schema, packed, tuple(compact(item, table) for item in values if type(item) is not float))
+    if isinstance(value, list):
+        return [compact(item, table) for item in value]
+    return value
+
+
+def to_plain(value):
+    """ The inverse of compact """
+    if isinstance(value, CompactDict):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [to_plain(item) for item in value]
+    return value
@@ -0,0 +1,104 @@
+""" The JSON backend used to decode API responses
+
+orjson or msgspec is used when it's installed, since decoding large pages is a measurable share of the
+client's time, and the standard library's json otherwise. Pick one with set_backend, or with the
+BREADBOARD_JSON environment variable ('orjson', 'msgspec' or 'json'). Bodies the fast backends reject,
+eg with NaN in them, are decoded by json instead, so every backend decodes the same things.
+
+Payloads are always encoded with json, so what is sent doesn't depend on what's installed:
+NaN is sent as NaN, and big integers are sent as they are.
+
+Responses from the clients decode their body once, on the first response.json(), and return the same
+dict after that, so code that changes the decoded body should copy it first.
+"""
+import os
+import json
+
+BACKENDS = ('orjson', 'msgspec', 'json')
+
+
+def _default(value):
+    """ Serialize numpy scalars and arrays, eg from a dataframe, as plain numbers and lists,
+    and compact records as dicts
+    """
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+
+def dumps(obj):
+    """ Encode a payload """
+    return json.dumps(obj, default=_default)
+
+
+def _orjson():
+    import orjson
+    return orjson.loads, orjson.JSONDecodeError
+
+
+def _msgspec():
+    import msgspec
+    return msgspec.json.Decoder().decode, msgspec.DecodeError
+
+
+def _with_fallback(fast_loads, error):
+    def loads(data):
+        try:
+            return fast_loads(data)
+        except error:
+            return json.loads(data)
+    return loads
+
+
+def set_backend(name=None):
+    """ Switch the JSON decoder: 'orjson', 'msgspec' or 'json', or None for the fastest one installed.
+    Returns the name of the backend in use.
+    """
+    global loads, backend
+    if name is not None and name not in BACKENDS:
+        raise ValueError('The JSON backend should be one of {}'.format(BACKENDS))
+    for candidate in ([name] if name else BACKENDS):
+        if candidate == 'json':
+            loads = json.loads
+        else:
+            try:
+                loads = _with_fallback(*{'orjson': _orjson, 'msgspec': _msgspec}[candidate]())
+            except ImportError:
+                if name:
+                    raise ImportError('The {0} JSON backend needs {0}. Install it with: pip install {0}'.format(name))
+                continue
+        backend = candidate
+        return backend
+
+
+def decode_once(response, instrumentation=None):
+    """ Make response.json() decode the body with the JSON backend on its first call, and return the
+    same object after that. Works on requests and httpx responses. Returns the response.
+    With a client's instrumentation, the decode is timed as its 'parse' phase.
+    """
+    decoded = []
+    fallback = response.json
+
+    def cached_json(**kwargs):
+        if kwargs:
+            return fallback(**kwargs)
+        if not decoded:
+            try:
+                if instrumentation is not None:
+                    with instrumentation.phase('parse'):
+                        decoded.append(loads(response.content))
+                else:
+                    decoded.append(loads(response.content))
+            except ValueError:
+                # let the library raise its usual error, eg for an empty body
+                return fallback()
+        return decoded[0]
+
+    response.json = cached_json
+    return response
+
+
+loads = backend = None
+set_backend(os.environ.get('BREADBOARD_JSON') or None)
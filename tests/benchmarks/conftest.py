@@ -0,0 +1,31 @@
+""" Fixtures for the offline benchmarks: a mock Breadboard server per data size, with injected latency.
+
+The sizes and the latency can be changed without editing the benchmarks:
+
+    BREADBOARD_BENCH_SIZES=100,1000,10000 BREADBOARD_BENCH_LATENCY=0.02 pytest tests/benchmarks
+"""
+import os
+
+import pytest
+
+from breadboard.client import BreadboardClient
+from tests.mock_server import MockBreadboard, MockServer
+
+SIZES = [int(size) for size in os.environ.get('BREADBOARD_BENCH_SIZES', '100,1000').split(',')]
+LATENCY = float(os.environ.get('BREADBOARD_BENCH_LATENCY', '0.005'))   # seconds per request
+LATENCY_PER_RECORD = float(os.environ.get('BREADBOARD_BENCH_LATENCY_PER_RECORD', '0.00002'))
+N_PARAMS = int(os.environ.get('BREADBOARD_BENCH_PARAMS', '200'))
+
+
+@pytest.fixture(params=SIZES, ids=lambda size: '{}runs'.format(size))
+def server(request):
+    breadboard = MockBreadboard(n_runs=request.param, n_params=N_PARAMS, page_size=100,
+                                latency=LATENCY, latency_per_record=LATENCY_PER_RECORD, etags=True)
+    with MockServer(breadboard) as server:
+        yield server
+
+
+@pytest.fixture
+def bc(server, tmp_path):
+    # no response cache, so repeated rounds measure the network path
+    return BreadboardClient(server.write_config(tmp_path, response_cache_size=0))
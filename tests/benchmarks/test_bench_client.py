@@ -0,0 +1,74 @@
+""" Offline benchmarks of the client against a local mock server. Needs pytest-benchmark:
+
+    pip install pytest-benchmark
+    pytest tests/benchmarks --benchmark-group-by=func,param
+"""
+import random
+import warnings
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+ROUNDS = 3
+
+
+def run(benchmark, fn, *args, **kwargs):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return benchmark.pedantic(fn, args=args, kwargs=kwargs, rounds=ROUNDS, iterations=1, warmup_rounds=0)
+
+
+def image_names(server):
+    return [image['name'] for image in server.breadboard.images]
+
+
+def test_get_images_df(benchmark, bc, server):
+    df = run(benchmark, bc.get_images_df, image_names(server), paramsin='*', tqdm_disable=True)
+    assert len(df) == len(server.breadboard.images)
+
+
+def test_get_images_df_few_params(benchmark, bc, server):
+    df = run(benchmark, bc.get_images_df, image_names(server), paramsin=['param1', 'param2'], tqdm_disable=True)
+    assert len(df) == len(server.breadboard.images)
+
+
+def test_get_runs_df(benchmark, bc, server):
+    df = run(benchmark, bc.get_runs_df, paramsin='*', tqdm_disable=True)
+    assert len(df) == len(server.breadboard.runs)
+
+
+def test_get_runs_df_from_ids(benchmark, bc, server):
+    n_runs = len(server.breadboard.runs)
+    rng = random.Random(0)
+    # a dense block of ids, plus a sprinkling of scattered ones
+    run_ids = list(range(1, n_runs // 2)) + rng.sample(range(n_runs // 2, n_runs + 1), min(20, n_runs // 2))
+    df = run(benchmark, bc.get_runs_df_from_ids, run_ids)
+    assert len(df) == len(run_ids)
+
+
+def test_force_match_images(benchmark, bc, server):
+    names = image_names(server)
+    assert run(benchmark, bc.force_match_images, names, tqdm_disable=True) == len(names)
+
+
+def test_annotate_runs(benchmark, bc, server):
+    updates = [{'run_id': run['id'], 'analysis': {'atom_number': 1e5}} for run in server.breadboard.runs[:100]]
+    results = run(benchmark, bc.annotate_runs, updates, tqdm_disable=True)
+    assert all(result['ok'] for result in results.values())
+
+
+def test_append_analysis_to_run(benchmark, bc, server):
+    run_ids = [run['id'] for run in server.breadboard.runs[:100]]
+
+    def annotate_one_by_one():
+        for run_id in run_ids:
+            bc.append_analysis_to_run(run_id, {'atom_number': 1e5}, printing=False)
+
+    run(benchmark, annotate_one_by_one)
+
+
+def test_import_time(benchmark):
+    import sys
+    import subprocess
+    run(benchmark, subprocess.run, [sys.executable, '-c', 'import breadboard'], check=True)
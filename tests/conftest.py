@@ -0,0 +1,12 @@
+import os
+
+
+def pytest_ignore_collect(collection_path, config):
+    """ The benchmarks take a while, so they only run when asked for: by path (pytest tests/benchmarks),
+    with --benchmark-only, or with BREADBOARD_BENCH=1
+    """
+    if collection_path.name != 'benchmarks':
+        return None
+    asked = (os.environ.get('BREADBOARD_BENCH') or config.getoption('benchmark_only', False)
+             or any('benchmarks' in str(arg) for arg in config.args))
+    return None if asked else True
@@ -0,0 +1,118 @@
+import json
+import threading
+from urllib.parse import parse_qs
+
+from breadboard.client import BreadboardClient
+from breadboard.instrumentation import Instrumentation
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200, headers=None):
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(json.dumps(self._payload))
+
+
+def make_image(idx):
+    return {
+        'id': idx,
+        'name': '2019-06-20_04-{:02d}-{:02d}_SensicamQE'.format(idx // 60, idx % 60),
+        'run': {
+            'runtime': '2019-06-20T04:00:00Z',
+            'parameters': {'ListBoundVariables': ['holdTime'], 'holdTime': float(idx)},
+        },
+    }
+
+
+class PagedImageClient(BreadboardClient):
+    """ A client that serves a fixed list of images with limit/offset pagination """
+    def __init__(self, n_images, page_size):
+        self.lab_name = 'fermi3'
+        self.api_url = 'http://testserver'
+        self.images = [make_image(i) for i in range(n_images)]
+        self.page_size = page_size
+        self.requested_offsets = []
+        self.requested_names = []
+        self.lock = threading.Lock()
+        self.cache = None
+        self.latency = {}
+        self.instrumentation = Instrumentation()
+
+    def _send_message(self, method, endpoint, params=None, data=None, headers=None):
+        payload = json.loads(data or '{}')
+        images = self.images
+        if payload.get('names'):
+            names = payload['names'].split(',')
+            self.requested_names.append(names)
+            images = [image for image in images if image['name'] in names]
+        query = parse_qs(endpoint.partition('?')[2])
+        offset = int(query.get('offset', [0])[0])
+        limit = int(query.get('limit', [self.page_size])[0])
+        with self.lock:
+            self.requested_offsets.append(offset)
+        nxt = None
+        if offset + limit < len(images):
+            nxt = '{}/images/?limit={}&offset={}'.format(self.api_url, limit, offset + limit)
+        return FakeResponse({
+            'count': len(images),
+            'next': nxt,
+            'results': images[offset:offset + limit],
+        })
+
+
+def make_run(idx):
+    return {
+        'id': idx,
+        'runtime': '2019-06-20T{:02d}:{:02d}:{:02d}Z'.format(idx // 3600 % 24, idx // 60 % 60, idx % 60),
+        'notes': '',
+        'parameters': {'ListBoundVariables': ['holdTime'], 'holdTime': float(idx)},
+    }
+
+
+class RunsClient(BreadboardClient):
+    """ A client that serves runs with ids 1..n_runs, one per second, with limit/offset pagination.
+    Runs can be PUT, and with etags=True, runs carry an ETag and PUTs honour If-Match.
+    """
+    def __init__(self, n_runs, page_size=100, etags=False):
+        self.lab_name = 'fermi3'
+        self.api_url = 'http://testserver'
+        self.runs = [make_run(i) for i in range(1, n_runs + 1)]
+        self.page_size = page_size
+        self.etags = etags
+        self.requests = []
+        self.lock = threading.Lock()
+        self.cache = None
+        self.latency = {}
+        self.instrumentation = Instrumentation()
+
+    def etag(self, run):
+        return str(hash(json.dumps(run, sort_keys=True)))
+
+    def _send_message(self, method, endpoint, params=None, data=None, headers=None):
+        with self.lock:
+            self.requests.append((method.lower(), endpoint))
+        path, _, querystring = endpoint.partition('?')
+        query = {key: values[0] for key, values in parse_qs(querystring).items()}
+        query.update(params or {})
+        if path.strip('/') != 'runs':
+            run_id = int(path.strip('/').split('/')[-1])
+            run = self.runs[run_id - 1]
+            if method.lower() == 'put':
+                if self.etags and (headers or {}).get('If-Match') != self.etag(run):
+                    return FakeResponse({'detail': 'precondition failed'}, status_code=412)
+                self.runs[run_id - 1] = json.loads(data)
+                return FakeResponse(self.runs[run_id - 1])
+            return FakeResponse(run, headers={'ETag': self.etag(run)} if self.etags else None)
+
+        runs = [run for run in self.runs
+                if query.get('start_datetime', '') <= run['runtime'] <= query.get('end_datetime', 'Z')]
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', self.page_size))
+        nxt = None
+        if offset + limit < len(runs):
+            query.update({'offset': offset + limit, 'limit': limit})
+            nxt = '{}/runs/?{}'.format(self.api_url, '&'.join('{}={}'.format(k, v) for k, v in query.items()))
+        return FakeResponse({'count': len(runs), 'next': nxt, 'results': runs[offset:offset + limit]})
@@ -0,0 +1,274 @@
+""" A local stand-in for the Breadboard API, for tests and benchmarks that run without the network.
+
+It serves /labs/, POST /images/, GET /runs/, GET/PUT /runs/{id}/, PUT /images/{id}/ and optionally
+a batched POST /images/bulk/ over synthetic data,
+with limit/offset pagination like the real API. Queries can ask for a 'fields' projection, which trims
+run parameters down to the requested ones, and the server counts the bytes it sends.
+Latency can be injected per request and per record, to stand in for a real server and network.
+"""
+import json
+import time
+import hashlib
+import datetime
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EPOCH = datetime.datetime(2019, 6, 20)
+
+
+def run_time(run_id, seconds_per_run=10):
+    return EPOCH + datetime.timedelta(seconds=run_id * seconds_per_run)
+
+
+def make_runs(n_runs, n_params, list_bound=2):
+    runs = []
+    for run_id in range(1, n_runs + 1):
+        parameters = {'param{}'.format(j): float(run_id + j) for j in range(n_params)}
+        parameters['ListBoundVariables'] = ['param{}'.format(j) for j in range(min(list_bound, n_params))]
+        runs.append({
+            'id': run_id,
+            'runtime': run_time(run_id).isoformat() + 'Z',
+            'lab': 'fermi3',
+            'notes': '',
+            'parameters': parameters,
+        })
+    return runs
+
+
+def make_images(runs, cameras=('TopA', 'TopB')):
+    images = []
+    for run in runs:
+        stamp = run_time(run['id']).strftime('%Y-%m-%d_%H-%M-%S')
+        for camera in cameras:
+            image_id = len(images) + 1
+            images.append({
+                'id': image_id,
+                'name': '{}_{}'.format(stamp, camera),
+                'url': '/images/{}/'.format(image_id),
+                'camera': camera,
+                'atomsperpixel': None,
+                'settings': None,
+                'thumbnail': None,
+                'run': run,
+            })
+    return images
+
+
+def project(record, fields, nested):
+    """ Trim the parameters of a run (or of an image's run) down to the requested fields """
+    if not fields:
+        return record
+    record = dict(record)
+    if nested:
+        if record.get('run'):
+            record['run'] = project(record['run'], fields, nested=False)
+        return record
+    parameters = record.get('parameters') or {}
+    record['parameters'] = {key: parameters[key] for key in fields if key in parameters}
+    return record
+
+
+class MockBreadboard:
+    """ The data and request log of a mock server
+
+    Inputs:
+    - n_runs: the number of runs
+    - n_params: the number of parameters per run
+    - cameras: one image per camera per run
+    - page_size: the default page size
+    - latency: seconds added to every response
+    - latency_per_record: seconds added per record in a response (or per image matched by a force_match)
+    - etags: send ETags with runs, and honour If-Match on run PUTs and If-None-Match on run GETs
+    - batch_updates: serve POST /images/bulk/, which takes a list of image updates with their ids
+    """
+
+    def __init__(self, n_runs=100, n_params=20, cameras=('TopA', 'TopB'), page_size=100,
+                 latency=0.0, latency_per_record=0.0, etags=False, batch_updates=False):
+        self.runs = make_runs(n_runs, n_params)
+        self.images = make_images(self.runs, cameras)
+        self.images_by_name = {image['name']: image for image in self.images}
+        self.page_size = page_size
+        self.latency = latency
+        self.latency_per_record = latency_per_record
+        self.etags = etags
+        self.batch_updates = batch_updates
+        self.requests = []
+        self.bytes_sent = 0
+        self.not_modified = 0
+        self.lock = threading.Lock()
+
+    def add_runs(self, n_runs, cameras=('TopA', 'TopB')):
+        """ Add n_runs new runs, with their images, after the existing ones """
+        n_params = len(self.runs[0]['parameters']) - 1 if self.runs else 0
+        with self.lock:
+            new_runs = make_runs(len(self.runs) + n_runs, n_params)[len(self.runs):]
+            new_images = make_images(new_runs, cameras)
+            for image in new_images:
+                image['id'] += len(self.images)
+                image['url'] = '/images/{}/'.format(image['id'])
+            self.runs.extend(new_runs)
+            self.images.extend(new_images)
+            self.images_by_name.update({image['name']: image for image in new_images})
+        return new_runs
+
+    def page(self, url, path, query, records, nested):
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', self.page_size))
+        fields = [field for field in query.get('fields', '').split(',') if field]
+        nxt = None
+        if offset + limit < len(records):
+            next_query = dict(query, offset=offset + limit, limit=limit)
+            nxt = url + path + '?' + '&'.join('{}={}'.format(key, value) for key, value in next_query.items())
+        return {
+            'count': len(records),
+            'next': nxt,
+            'previous': None,
+            'results': [project(record, fields, nested) for record in records[offset:offset + limit]],
+        }
+
+    def in_range(self, runtime, query):
+        return query.get('start_datetime', '') <= runtime <= query.get('end_datetime', '~')
+
+    def etag(self, run):
+        return '"{}"'.format(hashlib.md5(json.dumps(run, sort_keys=True).encode()).hexdigest())
+
+    def delay(self, payload, body):
+        """ The injected latency for a response """
+        records = len(payload.get('results') or ())
+        if isinstance(body, list):
+            records = len(body)
+        elif body.get('force_match') and body.get('names'):
+            records = len(body['names'].split(','))
+        return self.latency + self.latency_per_record * records
+
+    def handle(self, url, method, path, query, body, headers=None):
+        """ Returns (status, payload, response headers) """
+        status, payload = self._handle(url, method, path, query, body, headers or {})
+        extra = {}
+        parts = [part for part in path.split('/') if part]
+        if self.etags and parts[:1] == ['runs'] and len(parts) == 2 and status == 200:
+            extra['ETag'] = self.etag(payload)
+        return status, payload, extra
+
+    def _handle(self, url, method, path, query, body, headers):
+        parts = [part for part in path.split('/') if part]
+        if parts == ['labs']:
+            return 200, {'count': 1, 'next': None, 'results': [{'id': 1, 'name': 'fermi3'}]}
+
+        if parts == ['images'] and method == 'POST':
+            query = dict(query, **{key: str(value) for key, value in body.items()
+                                   if key in ('fields', 'start_datetime', 'end_datetime')})
+            if body.get('names'):
+                images = [self.images_by_name[name] for name in body['names'].split(',') if name in self.images_by_name]
+            else:
+                images = [image for image in self.images if self.in_range(image['run']['runtime'], query)]
+            if not images:
+                return 200, {'count': 0, 'next': None, 'results': [], 'detail': 'No images found'}
+            return 200, self.page(url, '/images/', query, images, nested=True)
+
+        if parts == ['images', 'bulk'] and method == 'POST' and self.batch_updates:
+            if any(not 1 <= update.get('id', 0) <= len(self.images) for update in body):
+                return 400, {'detail': 'Unknown image.'}
+            for update in body:
+                self.images[update['id'] - 1].update({key: value for key, value in update.items() if key not in ('id', 'name')})
+            return 200, {'count': len(body)}
+
+        if parts[:1] == ['images'] and len(parts) == 2 and method == 'PUT':
+            if not parts[1].isdigit() or not 1 <= int(parts[1]) <= len(self.images):
+                return 404, {'detail': 'Not found.'}
+            image = self.images[int(parts[1]) - 1]
+            image.update({key: value for key, value in body.items() if key != 'name'})
+            return 200, image
+
+        if parts == ['runs'] and method == 'GET':
+            runs = [run for run in self.runs if self.in_range(run['runtime'], query)]
+            if not runs:
+                return 200, {'count': 0, 'next': None, 'results': [], 'detail': 'No runs found'}
+            return 200, self.page(url, '/runs/', query, runs, nested=False)
+
+        if parts[:1] == ['runs'] and len(parts) == 2:
+            run_id = int(parts[1])
+            if not 1 <= run_id <= len(self.runs):
+                return 404, {'detail': 'Not found.'}
+            if method == 'PUT':
+                if self.etags and headers.get('If-Match') not in (None, self.etag(self.runs[run_id - 1])):
+                    return 412, {'detail': 'Precondition failed.'}
+                self.runs[run_id - 1].clear()
+                self.runs[run_id - 1].update(body)
+            return 200, self.runs[run_id - 1]
+
+        return 404, {'detail': 'Not found.'}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    def respond(self, method):
+        server = self.server.breadboard
+        split = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(split.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        with server.lock:
+            server.requests.append((method, self.path))
+            status, payload, headers = server.handle(self.server.url, method, split.path, query, body, self.headers)
+            content = json.dumps(payload).encode()
+            if method == 'GET' and headers.get('ETag') and self.headers.get('If-None-Match') == headers['ETag']:
+                status, content = 304, b''
+                server.not_modified += 1
+            server.bytes_sent += len(content)
+        delay = server.delay(payload, body)
+        if delay:
+            time.sleep(delay)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def do_PUT(self):
+        self.respond('PUT')
+
+    def log_message(self, *args):
+        pass
+
+
+class MockServer:
+    """ Runs a MockBreadboard on a local port, in a background thread.
+
+        with MockServer(MockBreadboard(n_runs=1000)) as server:
+            bc = BreadboardClient(server.write_config(tmp_path))
+    """
+
+    def __init__(self, breadboard=None):
+        self.breadboard = breadboard or MockBreadboard()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.breadboard = self.breadboard
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+        self.httpd.url = self.url
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def write_config(self, folder, **options):
+        """ Write an API_CONFIG.json pointing at this server, without client-side rate limits """
+        config = {'api_key': 'KEY', 'lab_name': 'fermi3', 'api_url': self.url, **options}
+        path = str(folder) + '/API_CONFIG.json'
+        with open(path, 'w') as file:
+            json.dump(config, file)
+        return path
@@ -0,0 +1,62 @@
+import pytest
+
+from tests.fakes import RunsClient
+
+
+def count(client, method):
+    return sum(1 for request_method, endpoint in client.requests if request_method == method)
+
+
+def test_annotate_runs_merges_updates_into_one_put_per_run():
+    client = RunsClient(n_runs=20)
+    results = client.annotate_runs([
+        {'run_id': 3, 'analysis': {'atom_number': 1e5}},
+        {'run_id': 3, 'instruments': {'wavemeter_in_THz': 446.8}, 'image_filenames': ['imgA']},
+        {'run_id': 4, 'analysis': {'atom_number': 2e5}, 'measurement_name': 'scan1'},
+    ], tqdm_disable=True)
+
+    assert results[3]['ok'] and results[4]['ok']
+    assert count(client, 'put') == 2
+    parameters = client.runs[2]['parameters']
+    assert parameters['atom_number'] == 1e5 and parameters['wavemeter_in_THz'] == 446.8
+    assert parameters['analyzed_variables'] == ['atom_number']
+    assert parameters['image_filenames'] == ['imgA']
+    assert client.runs[3]['parameters']['measurement_name'] == 'scan1'
+
+
+def test_annotate_runs_reports_per_run_failures():
+    client = RunsClient(n_runs=5)
+    client.runs[0]['parameters']['measurement_name'] = 'taken'
+    with pytest.warns(UserWarning):
+        results = client.annotate_runs({1: {'measurement_name': 'new'}, 2: {'analysis': {'a': 1}}}, tqdm_disable=True)
+    assert not results[1]['ok'] and 'already associated' in results[1]['error']
+    assert results[2]['ok']
+
+
+def test_annotate_runs_rejects_bad_updates_up_front():
+    client = RunsClient(n_runs=5)
+    with pytest.raises(ValueError):
+        client.annotate_runs([{'run_id': 1, 'instruments': {'wavemeter': 1}}])
+    with pytest.raises(ValueError):
+        client.annotate_runs([{'run_id': 1, 'notes': 'typo'}])
+    assert client.requests == []
+
+
+class ChangingRunsClient(RunsClient):
+    """ Someone else edits run 1 every time we read it """
+    def _send_message(self, method, endpoint, params=None, data=None, headers=None):
+        response = super()._send_message(method, endpoint, params, data, headers)
+        if method.lower() == 'get' and endpoint.startswith('/runs/1/'):
+            self.runs[0] = dict(self.runs[0], notes=self.runs[0]['notes'] + 'x')
+        return response
+
+
+@pytest.mark.parametrize('etags', [False, True])
+def test_annotate_runs_detects_conflicts(etags):
+    client = ChangingRunsClient(n_runs=5, etags=etags)
+    with pytest.warns(UserWarning):
+        results = client.annotate_runs([{'run_id': 1, 'analysis': {'a': 1}}, {'run_id': 2, 'analysis': {'a': 2}}],
+                                       conflict_retries=2, tqdm_disable=True)
+    assert results[1]['conflict'] and not results[1]['ok']
+    assert 'a' not in client.runs[0]['parameters']
+    assert results[2]['ok'] and client.runs[1]['parameters']['a'] == 2
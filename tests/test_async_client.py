@@ -0,0 +1,91 @@
+import json
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+
+from breadboard.async_client import AsyncBreadboardClient
+from tests.fakes import make_run
+
+
+def make_client(tmp_path, handler):
+    config_path = tmp_path / 'API_CONFIG.json'
+    config_path.write_text(json.dumps({'api_key': 'KEY', 'lab_name': 'fermi3', 'api_url': 'http://testserver/'}))
+    client = AsyncBreadboardClient(config_path=str(config_path))
+    client.session = httpx.AsyncClient(headers=client.auth.headers, transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_get_runs_keeps_commas_and_colons(tmp_path):
+    seen = []
+
+    def handler(request):
+        seen.append(str(request.url))
+        return httpx.Response(200, json={'count': 1, 'next': None, 'results': [make_run(1)]})
+
+    async def run():
+        client = make_client(tmp_path, handler)
+        response = await client.get_runs(datetime_range=['2019-06-20T04:00:00Z', '2019-06-20T05:00:00Z'])
+        await client.aclose()
+        return response
+
+    response = asyncio.run(run())
+    assert response.json()['results'][0]['id'] == 1
+    assert 'start_datetime=2019-06-20T04:00:00Z' in seen[0]
+    assert seen[0].startswith('http://testserver/runs/?lab=fermi3')
+
+
+def test_append_analysis_to_run_puts_merged_run(tmp_path):
+    puts = []
+
+    def handler(request):
+        if request.method == 'PUT':
+            puts.append(json.loads(request.content))
+            return httpx.Response(200, json=puts[-1])
+        return httpx.Response(200, json=make_run(5))
+
+    async def run():
+        client = make_client(tmp_path, handler)
+        await client.append_analysis_to_run(5, {'atom_number': 1e5}, printing=False)
+        await client.aclose()
+
+    asyncio.run(run())
+    assert puts[0]['parameters']['atom_number'] == 1e5
+    assert puts[0]['parameters']['analyzed_variables'] == ['atom_number']
+
+
+def test_get_lab_raises_value_error_for_an_unknown_lab(tmp_path):
+    def handler(request):
+        return httpx.Response(200, json={'count': 1, 'next': None, 'results': [{'id': 1, 'name': 'bec1'}]})
+
+    async def run():
+        client = make_client(tmp_path, handler)
+        try:
+            await client.get_lab()
+        finally:
+            await client.aclose()
+
+    with pytest.raises(ValueError, match='fermi3'):
+        asyncio.run(run())
+
+
+def test_send_message_chains_transport_errors(tmp_path):
+    def handler(request):
+        if request.url.path.startswith('/runs/'):
+            raise httpx.ReadTimeout('timed out', request=request)
+        raise httpx.ConnectError('refused', request=request)
+
+    async def run(endpoint):
+        client = make_client(tmp_path, handler)
+        try:
+            await client._send_message('get', endpoint)
+        finally:
+            await client.aclose()
+
+    with pytest.raises(RuntimeError, match='timed out on GET /runs/') as info:
+        asyncio.run(run('/runs/'))
+    assert isinstance(info.value.__cause__, httpx.ReadTimeout)
+    with pytest.raises(RuntimeError, match='check your API url') as info:
+        asyncio.run(run('/labs/'))
+    assert isinstance(info.value.__cause__, httpx.ConnectError)
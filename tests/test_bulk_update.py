@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from breadboard.client import BreadboardClient
+from breadboard.mixins.ImageMixins import image_update_items, image_update_body
+
+from tests.mock_server import MockBreadboard, MockServer
+
+
+def puts(server):
+    return [path for method, path in server.breadboard.requests if method == 'PUT']
+
+
+def test_update_items_and_validation():
+    df = pd.DataFrame({'id': [1, 2], 'imagename': ['a', 'b'], 'atomsperpixel': [0.5, float('nan')]})
+    assert list(image_update_items(df)) == [(1, 'a', {'atomsperpixel': 0.5}), (2, 'b', {})]
+    assert list(image_update_items([{'id': 3, 'name': 'c', 'params': {'x': 1}}, (4, 'd', {'y': 2})])) == \
+        [(3, 'c', {'x': 1}), (4, 'd', {'y': 2})]
+
+    # array cells, like an ROI, are kept and sent as lists
+    df = pd.DataFrame({'id': [1, 2], 'imagename': ['a', 'b'], 'roi': [np.array([1, 2, 3, 4]), float('nan')]})
+    assert [params for id, name, params in image_update_items(df)][1] == {}
+    assert json.loads(image_update_body(*next(image_update_items(df)))[1]) == {'name': 'a', 'roi': [1, 2, 3, 4]}
+    assert list(image_update_items([(3, 'c')])) == [(None, None, (3, 'c'))]
+
+    id, body = image_update_body(5.0, 'e', {'x': np.float64(0.5)})
+    assert id == 5 and json.loads(body) == {'name': 'e', 'x': 0.5}
+    for id, name, params in [(None, 'e', {}), (5, '', {}), (5, 'e', []), (5, 'e', {'x': object()})]:
+        with pytest.raises(ValueError):
+            image_update_body(id, name, params)
+
+
+def test_bulk_update_with_puts(tmp_path):
+    with MockServer(MockBreadboard(n_runs=20, n_params=3)) as server:
+        bc = BreadboardClient(server.write_config(tmp_path))
+        images = server.breadboard.images
+        updates = ((image['id'], image['name'], {'atomsperpixel': 2}) for image in images[:10])
+        results = bc.bulk_update_images(updates, max_workers=4, tqdm_disable=True)
+        assert list(results) == [image['id'] for image in images[:10]]
+        assert all(result['ok'] for result in results.values())
+        assert len(puts(server)) == 10
+        assert all(image['atomsperpixel'] == 2 for image in images[:10])
+
+        # invalid updates are reported without being sent
+        with pytest.warns(UserWarning):
+            results = bc.bulk_update_images([(1, 'x', {}), ('nope', 'y', {}), (10**6, 'z', {}), (2, 'w')], tqdm_disable=True)
+        assert results[1]['ok'] and not results['nope']['ok'] and results[10**6]['status_code'] == 404
+        assert not results[None]['ok']
+        assert len(puts(server)) == 12
+
+
+def test_bulk_update_with_batches(tmp_path):
+    with MockServer(MockBreadboard(n_runs=20, n_params=3, batch_updates=True)) as server:
+        bc = BreadboardClient(server.write_config(tmp_path, image_batch_endpoint='/images/bulk/'))
+        images = server.breadboard.images
+        updates = [{'id': image['id'], 'name': image['name'], 'settings': 's'} for image in images[:25]]
+        results = bc.bulk_update_images(updates, batch_size=10, tqdm_disable=True)
+        assert len(results) == 25 and all(result['ok'] for result in results.values())
+        assert sum(method == 'POST' for method, path in server.breadboard.requests) == 3
+        assert not puts(server)
+        assert all(image['settings'] == 's' for image in images[:25])
+
+        # a batch the endpoint rejects is retried one image at a time
+        with pytest.warns(UserWarning):
+            results = bc.bulk_update_images([(1, 'a', {}), (10**6, 'b', {})], tqdm_disable=True)
+        assert results[1]['ok'] and not results[10**6]['ok']
+        assert len(puts(server)) == 2
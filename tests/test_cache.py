@@ -0,0 +1,56 @@
+import time
+
+from breadboard.cache import RecordCache
+from tests.fakes import PagedImageClient, make_image
+
+
+def test_cache_roundtrip_and_ttl(tmp_path):
+    cache = RecordCache(str(tmp_path / 'records.sqlite'), ttl=60)
+    cache.put_many('fermi3', 'run', {1: {'id': 1, 'parameters': {}}})
+    assert cache.get_many('fermi3', 'run', [1, 2]) == {'1': {'id': 1, 'parameters': {}}}
+    assert cache.get_many('bec1', 'run', [1]) == {}
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get_many('fermi3', 'run', [1]) == {}
+
+
+def test_cache_evicts_oldest_when_too_big(tmp_path):
+    cache = RecordCache(str(tmp_path / 'records.sqlite'), max_bytes=None)
+    for i in range(10):
+        cache.put_many('fermi3', 'image', {'img{}'.format(i): make_image(i)})
+    cache.max_bytes = 3 * len(str(make_image(0)))
+    cache.evict()
+    remaining = cache.get_many('fermi3', 'image', ['img{}'.format(i) for i in range(10)])
+    assert 0 < len(remaining) < 10
+    assert 'img9' in remaining and 'img0' not in remaining
+
+
+def test_cache_invalidate_endpoint_drops_runs_and_their_images(tmp_path):
+    cache = RecordCache(str(tmp_path / 'records.sqlite'))
+    image = make_image(3)
+    image['run']['id'] = 42
+    cache.put_many('fermi3', 'image', {image['name']: image})
+    cache.put_many('fermi3', 'run', {42: {'id': 42}})
+    cache.invalidate_endpoint('fermi3', '/runs/42/')
+    assert cache.get_many('fermi3', 'run', [42]) == {}
+    assert cache.get_many('fermi3', 'image', [image['name']]) == {}
+
+
+def test_get_images_df_only_fetches_missing_images(tmp_path):
+    client = PagedImageClient(n_images=30, page_size=10)
+    client.cache = RecordCache(str(tmp_path / 'records.sqlite'))
+    names = [image['name'] for image in client.images]
+
+    df = client.get_images_df(names[:20], tqdm_disable=True)
+    assert len(df) == 20
+
+    client.requested_names = []
+    df = client.get_images_df(names, tqdm_disable=True)
+    assert len(df) == 30
+    assert df['holdTime'].tolist() == [float(i) for i in range(30)]
+    assert all(set(requested) == set(names[20:]) for requested in client.requested_names)
+
+    client.requested_names = []
+    client.get_images_df(names, tqdm_disable=True)
+    assert client.requested_names == []
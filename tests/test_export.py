@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from breadboard.export import read_export
+from tests.fakes import PagedImageClient, RunsClient
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_export_runs_roundtrip(tmp_path, format):
+    client = RunsClient(n_runs=250, page_size=100)
+    for run in client.runs[100:]:
+        run['parameters']['camera'] = 'TopA'
+        run['parameters']['badshot'] = run['id'] % 2 == 0
+    assert client.export_runs(str(tmp_path), format=format) == 250
+
+    df = read_export(str(tmp_path), format=format).sort_values('runtime').reset_index(drop=True)
+    assert len(df) == 250
+    assert df['holdTime'].dtype == 'float64'
+    assert df['holdTime'].tolist() == [float(i) for i in range(1, 251)]
+    assert df['camera'].isna().sum() == 100 and (df['camera'].dropna() == 'TopA').all()
+    assert df['badshot'].dropna().tolist() == [i % 2 == 0 for i in range(101, 251)]
+    assert set(df['lab']) == {'fermi3'} and set(df['date'].astype(str)) == {'2019-06-20'}
+    assert list((tmp_path / 'lab=fermi3').iterdir())[0].name == 'date=2019-06-20'
+
+
+def test_export_params_missing_from_some_pages(tmp_path):
+    client = RunsClient(n_runs=40, page_size=20)
+    for run in client.runs[20:]:
+        run['parameters']['mode'] = 'fast'
+        run['parameters']['badshot'] = False
+    assert client.export_runs(str(tmp_path), paramsin=['holdTime', 'mode', 'badshot']) == 40
+
+    df = read_export(str(tmp_path)).sort_values('runtime').reset_index(drop=True)
+    assert df['mode'].isna().sum() == 20 and (df['mode'].dropna() == 'fast').all()
+    assert df['badshot'].isna().sum() == 20 and not df['badshot'].dropna().any()
+    assert df['holdTime'].tolist() == [float(i) for i in range(1, 41)]
+
+
+def test_export_images(tmp_path):
+    client = PagedImageClient(n_images=45, page_size=20)
+    assert client.export_images(str(tmp_path), datetime_range=['2019-06-20', '2019-06-21']) == 45
+    df = read_export(str(tmp_path), columns=['imagename', 'holdTime'])
+    assert sorted(df['holdTime']) == [float(i) for i in range(45)]
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from breadboard.mixins import ImageMixins
+from breadboard.pagination import NoResultsError
+from tests.fakes import PagedImageClient
+
+
+class FlakyMatchClient(PagedImageClient):
+    """ Records force_match batches, and fails the first post of every `fail_every`-th batch """
+    def __init__(self, n_images, fail_every=None):
+        super().__init__(n_images, page_size=50)
+        self.matched = []
+        self.batches = 0
+        self.fail_every = fail_every
+        self.match_lock = threading.Lock()
+
+    def post_images(self, image_names=None, force_match=False, **kwargs):
+        if not force_match:
+            return super().post_images(image_names, **kwargs)
+        with self.match_lock:
+            self.batches += 1
+            if self.fail_every and self.batches % self.fail_every == 0:
+                raise RuntimeError('timeout')
+            self.matched.append(list(image_names))
+
+
+def test_force_match_posts_every_image_once_and_grows_batches(monkeypatch):
+    monkeypatch.setattr(ImageMixins, 'FORCEMATCH_BATCHSIZE', 4)
+    client = FlakyMatchClient(n_images=300)
+    names = [image['name'] for image in client.images]
+    client.force_match_images(names, match_workers=3, tqdm_disable=True)
+    matched = [name for batch in client.matched for name in batch]
+    assert sorted(matched) == sorted(names)
+    assert max(len(batch) for batch in client.matched) > 4
+
+
+def test_force_match_retries_failed_batches(monkeypatch):
+    monkeypatch.setattr(ImageMixins, 'FORCEMATCH_BATCHSIZE', 8)
+    monkeypatch.setattr(ImageMixins.time, 'sleep', lambda seconds: None)
+    client = FlakyMatchClient(n_images=100, fail_every=3)
+    names = [image['name'] for image in client.images]
+    client.force_match_images(names, match_workers=2, tqdm_disable=True)
+    assert sorted(name for batch in client.matched for name in batch) == sorted(names)
+
+
+def test_force_match_gives_up_after_retries(monkeypatch):
+    monkeypatch.setattr(ImageMixins.time, 'sleep', lambda seconds: None)
+    client = FlakyMatchClient(n_images=5, fail_every=1)
+    with pytest.raises(RuntimeError):
+        client.force_match_images([image['name'] for image in client.images], tqdm_disable=True)
+
+
+def test_force_match_fails_fast_on_unknown_images(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ImageMixins.time, 'sleep', sleeps.append)
+    client = FlakyMatchClient(n_images=10)
+
+    def post_images(image_names=None, force_match=False, **kwargs):
+        client.batches += 1
+        raise NoResultsError('No images found')
+    client.post_images = post_images
+    with pytest.raises(NoResultsError):
+        client.force_match_images(['unknown'], match_workers=2, tqdm_disable=True)
+    assert client.batches == 1 and not sleeps
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+from breadboard.client import BreadboardClient
+from breadboard.frames import concat_frames, compact_dtypes, page_frame
+
+from tests.mock_server import MockBreadboard, MockServer
+
+
+@pytest.fixture
+def server():
+    breadboard = MockBreadboard(n_runs=250, n_params=4, page_size=40)
+    # a flag set only on some runs, and a setting that repeats
+    for run in breadboard.runs:
+        if run['id'] > 200:
+            run['parameters']['imaging'] = True
+            # list-bound on the last pages only
+            run['parameters']['ListBoundVariables'] = run['parameters']['ListBoundVariables'] + ['mode']
+        run['parameters']['mode'] = 'mode{}'.format(run['id'] % 3)
+    with MockServer(breadboard) as server:
+        yield server
+
+
+def test_concat_frames_reconciles_dtypes():
+    a = compact_dtypes(pd.DataFrame({'n': [1, 2], 'flag': [True, False], 'mode': ['a', 'a']}))
+    b = compact_dtypes(pd.DataFrame({'n': [3.5, 4], 'mode': ['b', 'b']}))
+    df = concat_frames([a, b])
+    assert df['n'].dtype == 'float64'
+    assert df['flag'].dtype == 'boolean' and df['flag'].isna().sum() == 2
+    assert isinstance(df['mode'].dtype, pd.CategoricalDtype) and list(df['mode']) == ['a', 'a', 'b', 'b']
+
+
+def test_page_frame_decodes_raw_pages():
+    page = b'{"results": [{"id": 7, "runtime": "2019-06-20T00:00:00Z", "parameters": {"a": 1, "b": 2}}]}'
+    df, ids, seconds, warnings = page_frame(page, 'runs', paramsin=['a'], fields=['a'])
+    assert ids == [7] and list(df.columns) == ['runtime', 'x', 'a', 'unixtime'] and not warnings
+
+
+@pytest.mark.parametrize('paramsin', ['*', 'list_bound_only'])
+def test_runs_in_processes_match(server, tmp_path, paramsin):
+    bc = BreadboardClient(server.write_config(tmp_path, response_cache_size=0))
+    expected = bc.get_runs_df(paramsin=paramsin, tqdm_disable=True)
+    df = bc.get_runs_df(paramsin=paramsin, tqdm_disable=True, frame_workers=3)
+    pd.testing.assert_frame_equal(df, expected)
+    assert df['mode'].notna().all()
+
+
+def test_images_in_processes_match(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path, response_cache_size=0))
+    names = [image['name'] for image in server.breadboard.images]
+    expected = bc.get_images_df(names, paramsin='*', tqdm_disable=True)
+    df = bc.get_images_df(names, paramsin='*', tqdm_disable=True, frame_workers=2)
+    pd.testing.assert_frame_equal(df, expected)
@@ -0,0 +1,97 @@
+import math
+import datetime
+
+import pandas as pd
+import pytest
+
+from breadboard.frames import select_params, records_to_df, runtimes_to_unixtime, compact_dtypes, image_parameters, image_runtime, run_parameters, run_runtime
+from breadboard.mixins.ImageMixins import timestrs_to_datetimes, TIMEFORMATS
+
+
+IMAGES = [
+    {'id': 1, 'name': 'imgA', 'camera': 'TopA',
+     'run': {'runtime': '2018-10-09T00:21:57Z',
+             'parameters': {'ListBoundVariables': ['holdTime'], 'holdTime': 1.0, 'TOF': 2}}},
+    {'id': 2, 'name': 'imgB', 'camera': 'TopB',
+     'run': {'runtime': '2018-10-09T00:22:57Z',
+             'parameters': {'ListBoundVariables': ['evap'], 'evap': 1777, 'TOF': 3}}},
+    {'id': 3, 'name': 'imgC', 'camera': 'TopA', 'run': None},
+]
+
+IMAGE_REMOVEPARAMS = {'run', 'name', 'thumbnail', 'atomsperpixel', 'settings', 'ListBoundVariables', 'camera'}
+
+
+def test_select_params_list_bound_only():
+    params = select_params(IMAGES, 'list_bound_only', False, image_parameters, IMAGE_REMOVEPARAMS)
+    assert params == ['holdTime', 'evap', 'unixtime']
+
+
+def test_select_params_all_and_extended():
+    params = select_params(IMAGES, '*', True, image_parameters, IMAGE_REMOVEPARAMS)
+    assert set(params) == {'id', 'holdTime', 'TOF', 'evap', 'unixtime'}
+
+
+def test_select_params_explicit():
+    assert select_params(IMAGES, 'TOF', False, image_parameters, IMAGE_REMOVEPARAMS) == ['TOF', 'unixtime']
+
+
+def test_records_to_df_values_and_nans():
+    params = select_params(IMAGES, ['TOF', 'id', 'missing'], False, image_parameters, IMAGE_REMOVEPARAMS)
+    df = records_to_df(IMAGES, 'imagename', ['imgA', 'imgB', 'imgC'], params, image_parameters, image_runtime)
+    assert list(df.columns[:2]) == ['imagename', 'x']
+    assert df['TOF'].tolist()[:2] == [2, 3] and math.isnan(df.at[2, 'TOF'])
+    assert df['id'].tolist() == [1, 2, 3]
+    assert df['missing'].isna().all()
+    assert df.at[0, 'unixtime'] == 1539044517
+
+
+def test_records_to_df_runs_keeps_single_runtime_column():
+    runs = [{'id': 7, 'runtime': '2018-10-09T00:21:57Z', 'parameters': {'ListBoundVariables': ['a'], 'a': 1}}]
+    params = select_params(runs, 'list_bound_only', True, run_parameters, {'ListBoundVariables'})
+    df = records_to_df(runs, 'runtime', ['2018-10-09T00:21:57Z'], params, run_parameters, run_runtime)
+    assert list(df.columns).count('runtime') == 1
+    assert df.at[0, 'a'] == 1 and df.at[0, 'id'] == 7
+
+
+def test_runtimes_to_unixtime_batch():
+    runtimes = ['2018-10-09T00:21:57Z', '2018-10-09T00:21:57.5Z', '2019-06-20T04:00:00+02:00']
+    assert runtimes_to_unixtime(runtimes) == [1539044517, 1539044517, 1560996000]
+
+
+def test_runtimes_to_unixtime_on_old_pandas(monkeypatch):
+    # pandas < 2 doesn't know format='ISO8601', so it mustn't be asked for it
+    calls = []
+    to_datetime = pd.to_datetime
+    monkeypatch.setattr(pd, '__version__', '1.5.3')
+    monkeypatch.setattr(pd, 'to_datetime', lambda *args, **kwargs: calls.append(kwargs) or to_datetime(*args, **kwargs))
+    assert runtimes_to_unixtime(['2018-10-09T00:21:57Z', '2018-10-09T00:22:57Z']) == [1539044517, 1539044577]
+    assert calls and all('format' not in kwargs for kwargs in calls)
+
+
+def test_timestrs_to_datetimes_infers_format_once():
+    times = timestrs_to_datetimes(['2019-06-20_05-00-30_SensicamQE', '2019-06-20_05-00-31_SensicamQE'],
+                                  formats=[TIMEFORMATS['FERMI3'], TIMEFORMATS['FERMI3_2']])
+    assert times == [datetime.datetime(2019, 6, 20, 5, 0, 30), datetime.datetime(2019, 6, 20, 5, 0, 31)]
+    with pytest.raises(ValueError):
+        timestrs_to_datetimes(['2019-06-20_05-00-30_SensicamQE', 'not a time'])
+
+
+def test_compact_dtypes_infers_per_column():
+    import pandas as pd
+    df = pd.DataFrame({
+        'imagename': ['a', 'b', 'c', 'd'],
+        'holdTime': pd.Series([1.5, 2.5, float('nan'), 4.0], dtype=object),
+        'nshots': pd.Series([1, 2, 3, 4], dtype=object),
+        'badshot': pd.Series([True, False, float('nan'), True], dtype=object),
+        'camera': pd.Series(['TopA', 'TopA', 'TopB', 'TopA'], dtype=object),
+        'files': pd.Series([['x'], ['y'], [], ['z']], dtype=object),
+    })
+    compact_dtypes(df, dtypes={'nshots': 'int16'})
+    assert df['holdTime'].dtype == 'float64'
+    assert df['nshots'].dtype == 'int16'
+    assert df['badshot'].dtype == 'boolean'
+    assert df['camera'].dtype == 'category'
+    assert df['files'].dtype == object
+    assert df['imagename'].dtype != 'category'
+
+    assert compact_dtypes(pd.DataFrame({'a': [0.5, 1.5]}), float_precision='single')['a'].dtype == 'float32'
@@ -0,0 +1,67 @@
+import datetime
+
+import pytest
+
+from breadboard.client import BreadboardClient
+from breadboard.pagination import NoResultsError
+
+from tests.mock_server import MockBreadboard, MockServer, run_time
+
+
+@pytest.fixture
+def server():
+    with MockServer(MockBreadboard(n_runs=200, n_params=5, page_size=100)) as server:
+        yield server
+
+
+def run_requests(server):
+    return [path for method, path in server.breadboard.requests if path.startswith('/runs/')]
+
+
+def test_refresh_fetches_only_new_runs(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    query = bc.incremental_runs(start=run_time(0), paramsin='*', extended=True)
+    df = query.refresh()
+    assert df['id'].tolist() == list(range(1, 201))
+    assert query.high_water == run_time(200)
+
+    server.breadboard.add_runs(5)
+    df = query.refresh()
+    assert df['id'].tolist() == list(range(1, 206))
+    # only the run at the old high-water mark comes back again, besides the five new ones
+    assert query.new_rows == 6
+    assert 'start_datetime=2019-06-20T00:33:20Z' in run_requests(server)[-1]
+
+    # nothing new
+    assert query.refresh()['id'].tolist() == list(range(1, 206))
+    assert query.new_rows == 1
+
+
+def test_rolling_window_evicts_old_images(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    query = bc.incremental_images(start=run_time(0), window=datetime.timedelta(seconds=300), paramsin=['param0'])
+    df = query.refresh()
+    # runs are 10 s apart, with two images each: the last 31 runs are within 300 s of the latest
+    assert len(df) == 62
+    server.breadboard.add_runs(10)
+    df = query.refresh()
+    assert len(df) == 62
+    assert df['imagename'].str.startswith('2019-06-20_00-35-00').sum() == 2
+
+
+def test_max_rows_and_empty_start(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    query = bc.incremental_runs(start=run_time(1000), max_rows=3, paramsin='*')
+    assert query.refresh() is None
+    server.breadboard.add_runs(1000)
+    assert len(query.refresh()) == 3
+    with pytest.raises(ValueError):
+        bc.incremental_runs(datetime_range=[run_time(0), run_time(10)])
+
+
+def test_no_results_is_a_runtime_error(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    with pytest.raises(RuntimeError):
+        bc.get_runs(datetime_range=[run_time(500), run_time(600)])
+    with pytest.raises(NoResultsError):
+        bc.post_images(datetime_range=[run_time(500), run_time(600)])
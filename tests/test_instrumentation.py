@@ -0,0 +1,66 @@
+import time
+import socket
+
+from breadboard import serializer
+from breadboard.client import BreadboardClient
+from breadboard.instrumentation import (Instrumentation, StatsCollector, StatsdExporter,
+                                        endpoint_name, percentile)
+
+from tests.mock_server import MockBreadboard, MockServer
+
+
+def test_endpoint_name_and_percentile():
+    assert endpoint_name('/runs/259499/') == '/runs/{id}/'
+    assert endpoint_name('/runs/?lab=fermi3&offset=100') == '/runs/'
+    assert percentile([5, 1, 4, 2, 3], 50) == 3
+    assert percentile(list(range(1, 101)), 99) == 99
+
+
+def test_nothing_is_recorded_without_hooks():
+    instrumentation = Instrumentation()
+    with instrumentation.phase('frame'):
+        pass
+    assert list(instrumentation.timed_pages([[1], [2, 3]])) == [[1], [2, 3]]
+    assert not instrumentation.enabled
+
+
+def test_stats_collector_summarizes_a_query(tmp_path):
+    with MockServer(MockBreadboard(n_runs=250, page_size=100)) as server:
+        bc = BreadboardClient(server.write_config(tmp_path))
+        stats = StatsCollector(bc.instrumentation)
+        df = bc.get_runs_df(paramsin='*', tqdm_disable=True)
+    summary = stats.summary()
+
+    runs = summary['requests']['GET /runs/']
+    assert runs['count'] == 3 and runs['errors'] == 0 and runs['bytes'] > 0
+    assert runs['p50'] <= runs['p90'] <= runs['max']
+    assert summary['phases']['fetch']['records'] == len(df) == 250
+    assert summary['phases']['frame']['count'] == 3
+    assert summary['phases']['parse']['count'] == 3
+    assert summary['phases']['sort']['count'] == 1
+
+
+def test_parse_times_the_decode_of_every_image_page(tmp_path, monkeypatch):
+    loads = serializer.loads
+    monkeypatch.setattr(serializer, 'loads', lambda data: time.sleep(0.01) or loads(data))
+    with MockServer(MockBreadboard(n_runs=200, page_size=100)) as server:
+        bc = BreadboardClient(server.write_config(tmp_path))
+        stats = StatsCollector(bc.instrumentation)
+        bc.get_images_df(paramsin='*', tqdm_disable=True)
+    parse = stats.summary()['phases']['parse']
+    assert parse['count'] == 4 and parse['total'] >= 0.04
+
+
+def test_statsd_exporter_sends_lines():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(2)
+    instrumentation = Instrumentation()
+    StatsdExporter('127.0.0.1', receiver.getsockname()[1]).attach(instrumentation)
+
+    instrumentation.record_request('get', '/runs/7/', 200, 120, 0.25)
+    lines = [receiver.recv(1024).decode() for _ in range(3)]
+    receiver.close()
+    assert lines[0] == 'breadboard.request.latency:250.0|ms|#method:GET,endpoint:/runs/{id}/,status:200'
+    assert lines[1].startswith('breadboard.request.count:1|c')
+    assert lines[2].startswith('breadboard.request.bytes:120|c')
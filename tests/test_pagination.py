@@ -0,0 +1,70 @@
+import pytest
+
+from breadboard.pagination import remaining_pages, map_ordered
+from tests.fakes import PagedImageClient, RunsClient
+
+
+def test_remaining_pages_limit_offset():
+    pages = remaining_pages('http://x/images/?limit=100&offset=100', 'images/', 350, 100)
+    assert pages == ['?limit=100&offset=100', '?limit=100&offset=200', '?limit=100&offset=300']
+
+
+def test_remaining_pages_page_number():
+    pages = remaining_pages('http://x/images/?page=2', 'images/', 250, 100)
+    assert pages == ['?page=2', '?page=3']
+
+
+def test_remaining_pages_unknown_scheme():
+    assert remaining_pages('http://x/images/?cursor=abc', 'images/', 250, 100) is None
+
+
+def test_map_ordered_keeps_order():
+    assert list(map_ordered(lambda x: x * 2, range(50), max_workers=8)) == [2 * x for x in range(50)]
+
+
+@pytest.mark.parametrize('page_workers', [1, 4])
+def test_get_images_df_fetches_all_pages(page_workers):
+    client = PagedImageClient(n_images=250, page_size=20)
+    df = client.get_images_df(datetime_range=['2019-06-20', '2019-06-21'],
+                              tqdm_disable=True, page_workers=page_workers)
+    assert len(df) == 250
+    assert sorted(client.requested_offsets) == list(range(0, 250, 20))
+    assert df['holdTime'].tolist() == [float(i) for i in range(250)]
+
+
+def test_image_query_payload_is_built_once(monkeypatch):
+    from breadboard.mixins import ImageMixins
+    calls = []
+    build = ImageMixins.image_query_payload
+    monkeypatch.setattr(ImageMixins, 'image_query_payload', lambda *args, **kwargs: calls.append(1) or build(*args, **kwargs))
+    client = PagedImageClient(n_images=100, page_size=10)
+    names = [image['name'] for image in client.images]
+    df = client.get_images_df(names, tqdm_disable=True, page_workers=4)
+    assert len(df) == 100 and len(calls) == 1
+    assert all(requested == names for requested in client.requested_names)
+
+
+def test_get_images_df_keeps_params_list_bound_on_some_pages():
+    client = PagedImageClient(n_images=10, page_size=5)
+    for image in client.images:
+        image['run']['parameters']['detuning'] = 100 + image['id']
+        if image['id'] >= 5:
+            image['run']['parameters']['ListBoundVariables'] = ['holdTime', 'detuning']
+    df = client.get_images_df(datetime_range=['2019-06-20', '2019-06-21'], tqdm_disable=True)
+    assert list(df.columns) == ['imagename', 'x', 'holdTime', 'detuning', 'unixtime']
+    assert df['detuning'].tolist() == list(range(100, 110))
+
+
+def test_iter_images_streams_records_and_frames():
+    client = PagedImageClient(n_images=45, page_size=20)
+    assert [image['id'] for image in client.iter_images(page_workers=2)] == list(range(45))
+    frames = list(client.iter_images(as_frames=True, page_workers=2))
+    assert [len(frame) for frame in frames] == [20, 20, 5]
+
+
+def test_get_runs_df_reads_every_page():
+    client = RunsClient(n_runs=250, page_size=100)
+    df = client.get_runs_df(tqdm_disable=True)
+    assert len(df) == 250
+    assert df['holdTime'].tolist() == [float(i) for i in range(1, 251)]
+    assert sum(1 for run in client.iter_runs(page_workers=1)) == 250
@@ -0,0 +1,62 @@
+import pytest
+
+from breadboard.client import BreadboardClient
+from breadboard.frames import projection_fields, project_image, project_run
+
+from tests.mock_server import MockBreadboard, MockServer
+
+
+@pytest.fixture
+def server():
+    with MockServer(MockBreadboard(n_runs=150, n_params=200, page_size=100)) as server:
+        yield server
+
+
+def test_projection_fields():
+    assert projection_fields(['a', 'b']) == ['a', 'b']
+    assert projection_fields('a') == ['a']
+    assert projection_fields('*') is None
+    assert projection_fields('list_bound_only') is None
+    assert projection_fields(['a'], extended=True) is None
+
+
+def test_project_records_keep_top_level_keys():
+    run = {'id': 1, 'runtime': 'T', 'parameters': {'a': 1, 'b': 2, 'c': 3}}
+    assert project_run(run, ['a', 'missing']) == {'id': 1, 'runtime': 'T', 'parameters': {'a': 1}}
+    assert run['parameters'] == {'a': 1, 'b': 2, 'c': 3}
+    image = {'id': 5, 'name': 'img', 'run': run}
+    assert project_image(image, ['b'])['run']['parameters'] == {'b': 2}
+    assert project_image({'name': 'img', 'run': None}, ['b']) == {'name': 'img', 'run': None}
+
+
+def test_images_projection_reduces_payload(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    names = [image['name'] for image in server.breadboard.images]
+
+    server.breadboard.bytes_sent = 0
+    full = bc.get_images_df(names, paramsin='*', tqdm_disable=True)
+    full_bytes = server.breadboard.bytes_sent
+
+    server.breadboard.bytes_sent = 0
+    projected = bc.get_images_df(names, paramsin=['param3', 'param7'], tqdm_disable=True)
+    projected_bytes = server.breadboard.bytes_sent
+
+    assert projected_bytes * 10 < full_bytes
+    assert list(projected.columns) == ['imagename', 'x', 'param3', 'param7', 'unixtime']
+    assert projected[['param3', 'param7', 'unixtime']].equals(full[['param3', 'param7', 'unixtime']])
+
+
+def test_runs_projection_follows_next_links(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    df = bc.get_runs_df(paramsin=['param1'], tqdm_disable=True)
+    assert len(df) == 150
+    assert df['param1'].tolist() == [float(run_id + 1) for run_id in range(1, 151)]
+    assert all('fields=param1' in path for method, path in server.breadboard.requests if path.startswith('/runs/'))
+
+
+def test_client_trims_when_the_api_ignores_fields(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    server.breadboard.page = lambda url, path, query, records, nested, page=server.breadboard.page: \
+        page(url, path, dict(query, fields=''), records, nested)
+    runs = next(bc._iter_run_pages(fields=['param2']))
+    assert all(set(run['parameters']) == {'param2'} for run in runs)
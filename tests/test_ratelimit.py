@@ -0,0 +1,55 @@
+import time
+import threading
+
+import pytest
+
+from breadboard.ratelimit import TokenBucket, RateLimiter, fcntl
+from breadboard.client import make_rate_limiter
+
+
+def test_token_bucket_allows_burst_then_spaces_requests():
+    bucket = TokenBucket(rate=100, burst=5)
+    waits = [bucket.reserve() for _ in range(8)]
+    assert waits[:5] == [0.0] * 5
+    assert waits[5] == pytest.approx(0.01, abs=0.005)
+    assert waits[7] == pytest.approx(0.03, abs=0.005)
+
+
+def test_rate_limiter_picks_most_specific_budget():
+    limiter = RateLimiter({'default': {'rate': 10}, 'GET /runs/': {'rate': 5}, 'POST /images/': {'rate': 2}})
+    assert limiter.budget('post', '/images/?offset=100') == 'POST /images/'
+    assert limiter.budget('get', '/runs/123/') == 'GET /runs/'
+    assert limiter.budget('put', '/runs/123/') == 'default'
+    assert RateLimiter({'GET /runs/': {'rate': 5}}).budget('get', '/labs/') is None
+
+
+def test_rate_limiter_is_off_unless_configured():
+    assert make_rate_limiter({'api_url': 'http://localhost'}) is None
+    assert make_rate_limiter({'rate_limits': None}) is None
+    limiter = make_rate_limiter({'rate_limits': {'GET /runs/': {'rate': 5}}})
+    assert limiter.budget('get', '/runs/') == 'GET /runs/'
+
+
+def test_rate_limiter_is_thread_safe_and_records_waits():
+    limiter = RateLimiter({'default': {'rate': 200, 'burst': 10}})
+    start = time.monotonic()
+    threads = [threading.Thread(target=lambda: [limiter.acquire('get', '/runs/') for _ in range(10)]) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = limiter.stats()['default']
+    assert stats['requests'] == 50
+    assert stats['waits'] == 40
+    assert time.monotonic() - start >= 40 / 200 * 0.9
+
+
+@pytest.mark.skipif(fcntl is None, reason='needs file locks')
+def test_rate_limiter_shares_buckets_through_lockfile(tmp_path):
+    lockfile = str(tmp_path / 'ratelimit.json')
+    first = RateLimiter({'default': {'rate': 1, 'burst': 3}}, lockfile=lockfile)
+    second = RateLimiter({'default': {'rate': 1, 'burst': 3}}, lockfile=lockfile)
+    waits = [first.reserve('get', '/runs/'), second.reserve('get', '/runs/'),
+             first.reserve('get', '/runs/'), second.reserve('get', '/runs/')]
+    assert waits[:3] == [0.0] * 3
+    assert waits[3] > 0.9
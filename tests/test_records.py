@@ -0,0 +1,67 @@
+import json
+import pickle
+import tracemalloc
+
+import pandas as pd
+
+from breadboard import serializer
+from breadboard.cache import RecordCache
+from breadboard.frames import runs_frame, images_frame
+from breadboard.records import KeyTable, CompactDict, compact, to_plain
+
+from tests.mock_server import make_runs, make_images
+
+
+def test_compact_dicts_read_like_dicts():
+    run = make_runs(1, 3)[0]
+    record = compact(run)
+    assert isinstance(record, CompactDict) and isinstance(record['parameters'], CompactDict)
+    assert record == run and to_plain(record) == run and record.to_dict() == run
+    assert list(record) == list(run) and len(record['parameters']) == 4
+    assert 'param1' in record['parameters'] and 'nope' not in record['parameters']
+    assert record['parameters']['param1'] == 2.0 and record['parameters']['ListBoundVariables'] == ['param0', 'param1']
+    assert record.get('nope', 5) == 5 and {**record}['id'] == 1
+    assert pickle.loads(pickle.dumps(record)) == run
+    assert json.loads(serializer.dumps(record)) == run
+
+
+def test_records_with_the_same_keys_share_them():
+    table = KeyTable()
+    runs = [compact(run, table) for run in make_runs(50, 10)]
+    assert len(table) == 2 # the run, and its parameters
+    assert runs[0]['parameters']._schema is runs[-1]['parameters']._schema
+
+
+def test_compact_records_use_less_memory():
+    body = json.dumps(make_runs(500, 100))
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        plain = json.loads(body)
+        plain_size = tracemalloc.get_traced_memory()[0] - start
+        table = KeyTable()
+        start = tracemalloc.get_traced_memory()[0]
+        compacted = [compact(run, table) for run in json.loads(body)]
+        compact_size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    assert compact_size * 3 < plain_size
+
+
+def test_frames_from_compact_records():
+    runs = make_runs(20, 5)
+    table = KeyTable()
+    for paramsin in ('*', 'list_bound_only', ['param3', 'id']):
+        pd.testing.assert_frame_equal(runs_frame([compact(run, table) for run in runs], paramsin, extended=True),
+                                      runs_frame(runs, paramsin, extended=True))
+    images = make_images(runs)
+    pd.testing.assert_frame_equal(images_frame([compact(image, table) for image in images], '*'), images_frame(images, '*'))
+
+
+def test_cache_returns_compact_records(tmp_path):
+    cache = RecordCache(str(tmp_path / 'records.sqlite'))
+    runs = make_runs(3, 2)
+    cache.put_many('fermi3', 'run', {run['id']: compact(run) for run in runs})
+    found = cache.get_many('fermi3', 'run', [1, 2, 3], compact=True)
+    assert all(isinstance(run, CompactDict) for run in found.values())
+    assert [found[str(run['id'])] for run in runs] == runs
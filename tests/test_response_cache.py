@@ -0,0 +1,98 @@
+import pytest
+
+from breadboard.cache import ResponseCache
+from breadboard.client import BreadboardClient
+
+from tests.mock_server import MockBreadboard, MockServer
+
+
+@pytest.fixture
+def server():
+    with MockServer(MockBreadboard(n_runs=20, n_params=5)) as server:
+        yield server
+
+
+def gets(server, path):
+    return [request for request in server.breadboard.requests if request == ('GET', path)]
+
+
+def test_repeated_reads_are_served_from_memory(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path, response_cache_ttl=30))
+    assert bc.get_run(5) == bc.get_run(5)
+    assert len(gets(server, '/runs/5/')) == 1
+    assert bc.response_cache.hits == 1
+
+
+def test_reads_are_checked_by_default(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    bc.get_run(5)
+    server.breadboard.runs[4]['parameters']['from_elsewhere'] = 1
+    assert bc.get_run(5)['parameters']['from_elsewhere'] == 1
+
+
+def test_image_queries_are_always_checked(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path, response_cache_ttl=30))
+    image = server.breadboard.images[0]
+    run, image['run'] = image['run'], None
+    assert bc.post_images([image['name']]).json()['results'][0]['run'] is None
+    # the server matches the image
+    image['run'] = run
+    assert bc.post_images([image['name']]).json()['results'][0]['run']['id'] == run['id']
+    assert sum(method == 'POST' for method, path in server.breadboard.requests) == 2
+
+
+def test_writes_invalidate_the_run(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    bc.get_run(5)
+    bc.append_analysis_to_run(5, {'atom_number': 1e5}, printing=False)
+    # the append checked with the server before writing, and the put dropped the cached run
+    assert len(gets(server, '/runs/5/')) == 2
+    assert bc.get_run(5)['parameters']['atom_number'] == 1e5
+    assert len(gets(server, '/runs/5/')) == 3
+
+
+def test_updates_read_the_latest_run(server, tmp_path):
+    a = BreadboardClient(server.write_config(tmp_path))
+    b = BreadboardClient(server.write_config(tmp_path))
+    a.get_runs_df_from_ids([5])
+    b.append_analysis_to_run(5, {'from_b': 1}, printing=False)
+    a.append_analysis_to_run(5, {'from_a': 2}, printing=False)
+    parameters = server.breadboard.runs[4]['parameters']
+    assert parameters['from_b'] == 1 and parameters['from_a'] == 2
+    assert set(parameters['analyzed_variables']) == {'from_b', 'from_a'}
+
+
+def test_lists_are_always_checked(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    bc.get_runs()
+    server.breadboard.add_runs(5)
+    assert bc.get_runs().json()['count'] == 25
+
+
+def test_etag_revalidation(tmp_path):
+    with MockServer(MockBreadboard(n_runs=20, n_params=5, etags=True)) as server:
+        bc = BreadboardClient(server.write_config(tmp_path, response_cache_ttl=0))
+        first = bc.get_run(3)
+        assert bc.get_run(3) == first
+        assert len(gets(server, '/runs/3/')) == 2
+        assert server.breadboard.not_modified == 1
+
+        # annotating always checks with the server, even when the cached run is fresh
+        bc.response_cache.ttl = 60
+        results = bc.annotate_runs([{'run_id': 3, 'analysis': {'n': 1}}])
+        assert results[3]['ok']
+        assert server.breadboard.not_modified == 2
+
+
+def test_lru_bounds_and_keys():
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    keys = [cache.key('get', '/runs/{}/'.format(i)) for i in range(3)]
+    for key in keys:
+        cache.put(key, 200, {}, b'1234', 'url')
+    assert cache.get(keys[0]) is None and cache.get(keys[2]) is not None
+    cache.put(cache.key('get', '/runs/9/'), 200, {}, b'12345678901', 'url')
+    assert cache.get(cache.key('get', '/runs/9/')) is None
+
+    assert cache.key('put', '/runs/1/') is None
+    assert cache.key('post', '/images/', data='{"names": "a", "force_match": true}') is None
+    assert cache.key('post', '/images/', data='{"b": 1, "a": 2}') == cache.key('post', '/images/', data='{"a": 2, "b": 1}')
@@ -0,0 +1,67 @@
+import datetime
+
+import pytest
+
+from breadboard.client import BreadboardClient
+from breadboard.mixins.RunMixins import split_time_range, to_utc_datetime
+
+from tests.mock_server import MockBreadboard, MockServer, run_time
+
+
+def test_split_time_range_by_density():
+    start, end = datetime.datetime(2019, 6, 1), datetime.datetime(2019, 7, 1)
+    windows = split_time_range(start, end, count=10000, window_runs=2000)
+    assert len(windows) == 5
+    assert windows[0][0] == start and windows[-1][1] == end
+    assert all(a[1] == b[0] for a, b in zip(windows, windows[1:]))
+    assert split_time_range(start, end, count=10) == [(start, end)]
+    assert len(split_time_range(start, end, count=10**7, max_windows=64)) == 64
+
+
+def test_to_utc_datetime():
+    assert to_utc_datetime('2019-06-20T04:00:00+02:00') == datetime.datetime(2019, 6, 20, 2)
+    assert to_utc_datetime(datetime.datetime(2019, 6, 20)) == datetime.datetime(2019, 6, 20)
+
+
+@pytest.fixture
+def server():
+    with MockServer(MockBreadboard(n_runs=3000, n_params=5, page_size=100)) as server:
+        yield server
+
+
+def test_long_range_is_fetched_in_windows(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    datetime_range = [run_time(0), run_time(3001)]
+    df = bc.get_runs_df(datetime_range=datetime_range, paramsin='*', extended=True, tqdm_disable=True, window_runs=500)
+    assert len(df) == 3000
+    assert df['id'].tolist() == list(range(1, 3001))
+    windows = {path.split('start_datetime=')[1].split('&')[0] for method, path in server.breadboard.requests
+               if 'start_datetime' in path}
+    assert len(windows) >= 6
+
+
+def test_dense_windows_are_split_again(server, tmp_path):
+    # Squeeze most of the runs into the first hour, so the even first split is far off
+    for run in server.breadboard.runs[:2500]:
+        run['runtime'] = (run_time(0) + datetime.timedelta(seconds=run['id'])).isoformat() + 'Z'
+    bc = BreadboardClient(server.write_config(tmp_path))
+    window_fetches = []
+    fetch = bc._fetch_run_window
+    bc._fetch_run_window = lambda window, *args, **kwargs: window_fetches.append(window) or fetch(window, *args, **kwargs)
+
+    df = bc.get_runs_df(datetime_range=[run_time(0), run_time(3001)], paramsin='*', extended=True,
+                        tqdm_disable=True, window_runs=500)
+    assert df['id'].tolist() == list(range(1, 3001))
+    # six windows from the overall density, and the first (with 2500 runs) split again into five
+    assert len(window_fetches) == 6 + 5
+    first = min(window_fetches, key=lambda window: (window[0], -window[1].timestamp()))
+    inside = [window for window in window_fetches if window != first and first[0] <= window[0] and window[1] <= first[1]]
+    assert len(inside) == 5
+    assert max(int(path.split('limit=')[1].split('&')[0]) for method, path in server.breadboard.requests
+               if 'limit=' in path) == 500
+
+
+def test_short_range_is_not_split(server, tmp_path):
+    bc = BreadboardClient(server.write_config(tmp_path))
+    df = bc.get_runs_df(datetime_range=[run_time(0), run_time(150)], paramsin='*', tqdm_disable=True, window_runs=500)
+    assert len(df) == 150
@@ -0,0 +1,31 @@
+from breadboard.mixins.RunMixins import plan_run_id_fetches
+from tests.fakes import RunsClient
+
+
+def test_plan_splits_dense_clusters_from_sparse_ids():
+    run_ids = list(range(1000, 1100)) + [5000, 9000, 20000]
+    clusters, singles = plan_run_id_fetches(run_ids, get_latency=0.1, page_latency=0.3, page_size=500, workers=8)
+    assert clusters == [list(range(1000, 1100))]
+    assert singles == [5000, 9000, 20000]
+
+
+def test_plan_prefers_single_gets_for_few_ids():
+    clusters, singles = plan_run_id_fetches([10, 12], get_latency=0.1, page_latency=0.3)
+    assert clusters == [] and singles == [10, 12]
+
+
+def test_get_runs_df_from_ids_mixes_windows_and_single_gets():
+    client = RunsClient(n_runs=3000, page_size=100)
+    run_ids = list(range(200, 400, 2)) + [1500, 2900]
+    df = client.get_runs_df_from_ids(run_ids)
+    assert df['run_id'].tolist() == run_ids
+    assert df['holdTime'].tolist() == [float(run_id) for run_id in run_ids]
+    single_gets = [endpoint for method, endpoint in client.requests if endpoint.strip('/') != 'runs' and '?' not in endpoint]
+    assert len(single_gets) == 4  # two boundaries and two sparse ids
+    assert 'page' in client.latency and 'run' in client.latency
+
+
+def test_get_runs_df_from_ids_single_id():
+    client = RunsClient(n_runs=10)
+    df = client.get_runs_df_from_ids(7)
+    assert df.at[0, 'run_id'] == 7 and df.at[0, 'badshot'] == False
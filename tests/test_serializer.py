@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pytest
+import requests
+
+from breadboard import serializer
+from breadboard.client import BreadboardClient
+
+from tests.mock_server import MockBreadboard, MockServer
+
+
+@pytest.fixture(params=['json', 'orjson', 'msgspec'])
+def backend(request):
+    previous = serializer.backend
+    try:
+        serializer.set_backend(request.param)
+    except ImportError:
+        pytest.skip(request.param + ' is not installed')
+    yield request.param
+    serializer.set_backend(previous)
+
+
+def test_round_trip(backend):
+    record = {'name': 'a', 'n': np.int64(3), 'x': np.float32(0.5), 'list': [1, 'b', None], 'nested': {'ok': True}}
+    assert json.loads(serializer.dumps(record)) == {'name': 'a', 'n': 3, 'x': 0.5, 'list': [1, 'b', None], 'nested': {'ok': True}}
+    assert serializer.loads(serializer.dumps(record).encode()) == serializer.loads(serializer.dumps(record))
+    with pytest.raises(ValueError):
+        serializer.loads(b'{"unfinished": ')
+
+
+def test_payloads_are_the_same_with_every_backend(backend):
+    payload = {'fit': float('nan'), 'big': 2**70, 'n': np.int64(3)}
+    assert serializer.dumps(payload) == '{"fit": NaN, "big": 1180591620717411303424, "n": 3}'
+    decoded = serializer.loads(serializer.dumps(payload).encode())
+    assert decoded['fit'] != decoded['fit'] and decoded['big'] == 2**70
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        serializer.set_backend('yaml')
+
+
+def test_responses_are_decoded_once(backend, tmp_path, monkeypatch):
+    with MockServer(MockBreadboard(n_runs=5, n_params=2)) as server:
+        bc = BreadboardClient(server.write_config(tmp_path))
+        calls = []
+        loads = serializer.loads
+        monkeypatch.setattr(serializer, 'loads', lambda data: calls.append(1) or loads(data))
+        response = bc.post_images([image['name'] for image in server.breadboard.images])
+        assert response.json() is response.json()
+        assert len(response.json()['results']) == 10
+        assert len(calls) == 1
+
+
+def test_empty_body_raises_as_usual():
+    response = serializer.decode_once(requests.Response())
+    response._content = b''
+    with pytest.raises(requests.exceptions.JSONDecodeError):
+        response.json()
@@ -0,0 +1,120 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import requests
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError
+
+from breadboard.client import BreadboardClient, is_read_timeout
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """ Serves /labs/, and answers /runs/1/ with a 429 and a 503 before succeeding. Posts are slow """
+    calls = []
+
+    def do_GET(self):
+        FlakyHandler.calls.append(self.path)
+        if self.path.startswith('/labs/'):
+            return self.reply(200, {'results': [{'name': 'fermi3', 'id': 1}]})
+        attempts = sum(1 for path in FlakyHandler.calls if path == self.path)
+        if attempts == 1:
+            return self.reply(429, {'detail': 'slow down'}, {'Retry-After': '0'})
+        if attempts == 2:
+            return self.reply(503, {'detail': 'unavailable'})
+        return self.reply(200, {'id': 1})
+
+    def do_POST(self):
+        FlakyHandler.calls.append(self.path)
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(0.5)
+        try:
+            self.reply(200, {'results': []})
+        except OSError:
+            pass # the client gave up waiting
+
+    def reply(self, status, payload, headers={}):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    FlakyHandler.calls = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+
+
+def make_config(tmp_path, api_url, **options):
+    config_path = tmp_path / 'API_CONFIG.json'
+    config_path.write_text(json.dumps({'api_key': 'KEY', 'lab_name': 'fermi3', 'api_url': api_url, **options}))
+    return str(config_path)
+
+
+def test_retries_429_and_5xx(tmp_path, server):
+    client = BreadboardClient(make_config(tmp_path, server, backoff_factor=0.01, read_timeout=5))
+    response = client._send_message('get', '/runs/1/')
+    assert response.status_code == 200
+    assert FlakyHandler.calls.count('/runs/1/') == 3
+    assert client.timeout == (10, 5)
+
+
+def test_no_retries_returns_last_response(tmp_path, server):
+    client = BreadboardClient(make_config(tmp_path, server, max_retries=0))
+    assert client._send_message('get', '/runs/1/').status_code == 429
+
+
+def test_pool_size_from_config(tmp_path, server):
+    client = BreadboardClient(make_config(tmp_path, server, pool_maxsize=64))
+    assert client.session.get_adapter(server)._pool_maxsize == 64
+
+
+def test_request_hook_sees_retries(tmp_path, server):
+    client = BreadboardClient(make_config(tmp_path, server, backoff_factor=0.01))
+    events = []
+    client.instrumentation.add_request_hook(events.append)
+    client._send_message('get', '/runs/1/')
+    assert len(events) == 1
+    assert events[0].endpoint == '/runs/{id}/' and events[0].status == 200 and events[0].retries == 2
+
+
+def test_read_timeouts_are_not_resent(tmp_path, server):
+    client = BreadboardClient(make_config(tmp_path, server, read_timeout=0.1))
+    with pytest.raises(RuntimeError, match='timed out'):
+        client._send_message('post', '/images/', data='{"force_match": true}')
+    assert FlakyHandler.calls.count('/images/') == 1
+
+
+def test_read_timeout_after_retries_is_reported():
+    error = requests.exceptions.ConnectionError(MaxRetryError(None, '/images/', ReadTimeoutError(None, '/images/', 'timed out')))
+    assert is_read_timeout(error)
+    assert not is_read_timeout(requests.exceptions.ConnectionError('refused'))
+
+
+def test_session_on_urllib3_before_1_26(monkeypatch):
+    from breadboard import client
+
+    class OldRetry(client.Retry):
+        """ urllib3 < 1.26: no jitter, and method_whitelist instead of allowed_methods """
+        def __init__(self, method_whitelist=None, **kwargs):
+            if 'backoff_jitter' in kwargs or 'allowed_methods' in kwargs:
+                raise TypeError('unexpected keyword argument')
+            super().__init__(allowed_methods=method_whitelist, **kwargs)
+
+    monkeypatch.setattr(client, 'Retry', OldRetry)
+    retry = client.make_session({}).get_adapter('http://').max_retries
+    assert isinstance(retry, OldRetry) and retry.allowed_methods is None and retry.read is False
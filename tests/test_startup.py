@@ -0,0 +1,41 @@
+import sys
+import json
+import subprocess
+
+from breadboard.client import BreadboardClient
+
+from tests.mock_server import MockServer
+
+HEAVY_MODULES = ('pandas', 'numpy', 'dateutil', 'tqdm', 'httpx', 'pyarrow')
+
+
+def test_import_skips_heavy_dependencies():
+    code = 'import sys, json, breadboard; print(json.dumps(sorted(set(sys.modules) & set({}))))'.format(list(HEAVY_MODULES))
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert json.loads(output) == []
+
+
+def test_lab_is_looked_up_on_first_use_and_cached(tmp_path):
+    with MockServer() as server:
+        config_path = server.write_config(tmp_path, lab_cache_path=str(tmp_path / 'labs.json'))
+        bc = BreadboardClient(config_path)
+        assert server.breadboard.requests == []
+        assert bc.lab['name'] == 'fermi3'
+        assert bc.lab['id'] == 1
+        assert server.breadboard.requests == [('GET', '/labs/')]
+
+        # a new session reads the lab from the cache file
+        assert BreadboardClient(config_path).lab == {'id': 1, 'name': 'fermi3'}
+        assert len(server.breadboard.requests) == 1
+
+
+def test_client_leaves_logging_alone(tmp_path):
+    import logging
+    handler = logging.NullHandler()
+    logging.root.addHandler(handler)
+    try:
+        with MockServer() as server:
+            BreadboardClient(server.write_config(tmp_path))
+        assert handler in logging.root.handlers
+    finally:
+        logging.root.removeHandler(handler)
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import threading
+import importlib.util
+
+# The watchdog folder shares its name with the watchdog package, so load the script from its path
+spec = importlib.util.spec_from_file_location(
+    'breadboard_image_watchdog',
+    os.path.join(os.path.dirname(__file__), '..', 'watchdog', 'breadboard_image_watchdog.py'))
+watchdog = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(watchdog)
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = 'error {}'.format(status_code)
+
+
+class FakeClient:
+    """ Records the posts, and fails the first `failures` posts of each image """
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = {}
+        self.posts = []
+        self.lock = threading.Lock()
+
+    def post_images(self, image_names, image_times, auto_time, **kwargs):
+        with self.lock:
+            name = image_names[0]
+            self.attempts[name] = self.attempts.get(name, 0) + 1
+            if self.attempts[name] <= self.failures:
+                return FakeResponse(500)
+            self.posts.append((image_names, kwargs))
+        return FakeResponse(200)
+
+
+def make_images(folder, names):
+    paths = []
+    for name in names:
+        path = os.path.join(str(folder), name + '.fits')
+        open(path, 'w').close()
+        paths.append(path)
+    return paths
+
+
+def make_uploader(folder, bc, **options):
+    journal = watchdog.Journal(os.path.join(str(folder), watchdog.JOURNAL_NAME))
+    return watchdog.Uploader(bc, journal, backoff=0, **options)
+
+
+def journal_lines(folder):
+    with open(os.path.join(str(folder), watchdog.JOURNAL_NAME)) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_burst_is_posted_with_each_filepath(tmp_path):
+    bc = FakeClient()
+    uploader = make_uploader(tmp_path, bc, coalesce_time=0.2)
+    paths = make_images(tmp_path, ['shot1_TopA', 'shot1_TopB', 'shot1_TopC', 'shot1_TopD'])
+    for path in paths:
+        uploader.put(path)
+    uploader.start()
+    deadline = time.monotonic() + 5
+    while len(uploader.journal.posted) < len(paths) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert sorted(kwargs['filepath'] for names, kwargs in bc.posts) == paths
+    assert all(os.path.basename(kwargs['filepath']).startswith(names[0]) for names, kwargs in bc.posts)
+    # one drain of the queue, recorded as one batch
+    assert [line['names'] for line in journal_lines(tmp_path)] == [[watchdog.image_name(path) for path in paths]]
+
+
+def test_journal_is_replayed_after_a_restart(tmp_path):
+    posted, missed = make_images(tmp_path, ['shot1_TopA', 'shot2_TopA'])
+    make_uploader(tmp_path, FakeClient()).journal.record([watchdog.image_name(posted)])
+
+    bc = FakeClient()
+    uploader = make_uploader(tmp_path, bc)
+    for path in (posted, missed):
+        uploader.put(path)
+    uploader.upload([uploader.queue.get()])
+    assert uploader.queue.empty()
+    assert [kwargs['filepath'] for names, kwargs in bc.posts] == [missed]
+    assert uploader.journal.posted == {'shot1_TopA', 'shot2_TopA'}
+
+
+def test_failed_posts_are_retried_then_given_up(tmp_path):
+    flaky, failing = make_images(tmp_path, ['shot1_TopA', 'shot1_TopB'])
+    bc = FakeClient(failures=2)
+    uploader = make_uploader(tmp_path, bc, retries=2)
+    uploader.upload([flaky])
+    assert bc.attempts == {'shot1_TopA': 3}
+    assert uploader.journal.posted == {'shot1_TopA'}
+
+    bc.failures = 10
+    uploader.upload([failing])
+    assert bc.attempts['shot1_TopB'] == 3
+    assert 'shot1_TopB' not in uploader.journal.posted
+
+
+def test_images_are_not_posted_twice(tmp_path):
+    path, = make_images(tmp_path, ['shot1_TopA'])
+    bc = FakeClient()
+    uploader = make_uploader(tmp_path, bc)
+    uploader.put(path)
+    uploader.put(path)
+    assert uploader.queue.qsize() == 1
+    uploader.upload([uploader.queue.get()])
+    uploader.queued.clear()
+    uploader.put(path)
+    assert uploader.queue.empty() and len(bc.posts) == 1
+
+
+def test_vanished_files_are_skipped(tmp_path):
+    kept, vanished = make_images(tmp_path, ['shot1_TopA', 'shot1_TopB'])
+    os.remove(vanished)
+    bc = FakeClient()
+    uploader = make_uploader(tmp_path, bc)
+    uploader.upload([kept, vanished])
+    assert [kwargs['filepath'] for names, kwargs in bc.posts] == [kept]
+    assert uploader.journal.posted == {'shot1_TopA'}
@@ -1,73 +1,244 @@
 '''
 breadboard_python_watchdog.py
 =============================
-This lets you watch a folder for new single images and upload the metadata to Breadboard. 
+This lets you watch a folder for new images and upload their metadata to Breadboard.
 Usage:
 
-python3 breadboard_python_watchdog.py [WATCHFOLDER]
+python3 breadboard_python_watchdog.py [WATCHFOLDER] --config [API_CONFIG.json]
 
 where [WATCHFOLDER] is the folder your camera program writes images to.
 
+New files are picked up with inotify (through the watchdog package, if it's installed),
+or else by polling the folder. They are queued, bursts of files are coalesced into a single
+batch, and the images of a batch are posted concurrently, each with its own filepath, from a worker
+thread with retries. Every posted image is written
+to a journal in the watchfolder, so after a restart the images that were missed get posted,
+and the ones that were already posted don't get posted again.
+
 '''
 
-# Imports 
+# Imports
 import os
 import time
+import json
+import queue
+import argparse
 import datetime
-import shutil
-import posixpath
-import sys
+import threading
 from breadboard import BreadboardClient
+from breadboard.pagination import map_ordered
 import warnings
 warnings.filterwarnings("ignore", "Your application has authenticated using end user credentials")
 warnings.filterwarnings("ignore", "Could not find appropriate MS Visual C Runtime")
 
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+JOURNAL_NAME = '.breadboard_journal'
+
+
 def getFileList(folder = 'Not Provided'):
     # Get a list of files in a folder
     if not os.path.exists(folder): raise ValueError("Folder '{}' doesn't exist".format(folder))
     # Folder contents
-    filenames = [filename for filename in os.listdir(folder)]
+    filenames = [filename for filename in os.listdir(folder) if is_image_file(filename)]
     # Output
     paths = [os.path.join(folder,f) for f in filenames]
     return (filenames, paths)
 
-def main():
-    # Global settings 
-    # bc = BreadboardClient(config_path='API_CONFIG.json') # enter your path to the API_config
-    refresh_time = 0.5 # seconds
-    watchfolder = sys.argv[1] # feed the program your watchfolder
-    print("\n\n Watching this folder for changes: " + sys.argv[1] + "\n\n")
 
-    names_old, paths_old = getFileList(watchfolder)
+def image_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
 
-    # Main Loop 
-    while True: 
-        # Get a list of all the images in the folder 
-        names, paths = getFileList(watchfolder)
-        names = sorted(names)
-        paths = sorted(paths)
-        # check if a new image has come in
-        if len(names)>len(names_old):
-            output_filename = names[-1]
-            print('New file: ' + output_filename)
-            output_filepath = paths[-1]
-            dt = datetime.datetime.fromtimestamp(os.path.getctime(output_filepath))
-        
-            # Write to Breadboard
+
+def is_image_file(filename):
+    # Skip hidden files, like the journal
+    return not os.path.basename(filename).startswith('.')
+
+
+class Journal:
+    """ An append-only record of the images that have been posted, one json line per batch """
+
+    def __init__(self, path):
+        self.path = path
+        self.posted = set()
+        self.is_new = not os.path.exists(path)
+        if not self.is_new:
+            with open(path) as file:
+                for line in file:
+                    try:
+                        self.posted.update(json.loads(line)['names'])
+                    except (ValueError, KeyError):
+                        pass # a torn last line from a crash
+
+    def record(self, names, status='posted'):
+        with open(self.path, 'a') as file:
+            file.write(json.dumps({status: datetime.datetime.now().isoformat(), 'names': names}) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.posted.update(names)
+
+
+class Uploader(threading.Thread):
+    """ Posts queued image paths to breadboard, coalescing bursts into batches.
+    Each image of a batch is posted with its own filepath, post_workers at a time.
+    """
+
+    def __init__(self, bc, journal, coalesce_time=0.5, max_batch=50, retries=5, post_workers=4, backoff=1):
+        super().__init__(daemon=True)
+        self.bc = bc
+        self.journal = journal
+        self.queue = queue.Queue()
+        self.coalesce_time = coalesce_time
+        self.max_batch = max_batch
+        self.retries = retries
+        self.post_workers = post_workers
+        self.backoff = backoff
+        self.queued = set()
+        self.lock = threading.Lock()
+
+    def put(self, path):
+        name = image_name(path)
+        with self.lock:
+            if name in self.journal.posted or name in self.queued:
+                return
+            self.queued.add(name)
+        print('New file: ' + os.path.basename(path))
+        self.queue.put(path)
+
+    def next_batch(self):
+        # Wait for a file, then gather everything else that arrives within the coalesce time
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.coalesce_time
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def post(self, path):
+        # Returns True once the image is posted, False if every attempt failed, and None if the file is gone
+        try:
+            image_time = datetime.datetime.fromtimestamp(os.path.getctime(path))
+        except OSError:
+            print('File disappeared before it was posted: ' + path)
+            return None
+        for attempt in range(self.retries + 1):
             try:
-                resp = bc.post_images(
-                            image_names = os.path.splitext(output_filename)[0],
-                            filepath = output_filepath,
-                            image_times = [dt], 
-                            auto_time = False # Add more information here
+                resp = self.bc.post_images(
+                            image_names = [image_name(path)],
+                            image_times = [image_time],
+                            auto_time = False, # Add more information here
+                            filepath = path
                             )
-                if resp.status_code!=200:
-                    print(resp.text)
-            except: pass
-            names_old = names
+                if resp.status_code == 200:
+                    return True
+                print(resp.text)
+            except (RuntimeError, ValueError) as e:
+                print('Error posting {}: {}'.format(path, e))
+            if attempt < self.retries:
+                time.sleep(min(30, self.backoff * 2**attempt))
+        return False
+
+    def upload(self, paths):
+        results = list(map_ordered(self.post, paths, max_workers=self.post_workers))
+        names = [image_name(path) for path, posted in zip(paths, results) if posted]
+        failed = [path for path, posted in zip(paths, results) if posted is False]
+        if names:
+            self.journal.record(names)
+            print('Posted {} images'.format(len(names)))
+        if failed:
+            print('Giving up on these images for now, they will be retried on restart: ' + str(failed))
+
+    def run(self):
+        while True:
+            paths = self.next_batch()
+            try:
+                self.upload(paths)
+            except Exception as e:
+                # keep the service running, whatever went wrong with this batch
+                print('Error uploading {}: {!r}'.format(paths, e))
+            finally:
+                # posted images are in the journal now, and the rest can be queued again
+                with self.lock:
+                    self.queued.difference_update(image_name(path) for path in paths)
+
+
+class NewFileHandler(FileSystemEventHandler):
+    """ Queues files as they are created in (or moved into) the watchfolder """
+
+    def __init__(self, uploader):
+        self.uploader = uploader
+
+    def on_created(self, event):
+        if not event.is_directory and is_image_file(event.src_path):
+            self.uploader.put(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory and is_image_file(event.dest_path):
+            self.uploader.put(event.dest_path)
 
-        # Wait before checking again 
+
+def poll(watchfolder, uploader, refresh_time):
+    # Fallback when inotify isn't available: look for names we haven't seen yet
+    seen = set()
+    while True:
+        names, paths = getFileList(watchfolder)
+        for name, path in zip(names, paths):
+            if name not in seen:
+                seen.add(name)
+                uploader.put(path)
         time.sleep(refresh_time)
 
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch a folder for new images and upload their metadata to Breadboard.')
+    parser.add_argument('watchfolder', help='the folder your camera program writes images to')
+    parser.add_argument('--config', default='API_CONFIG.json', help='path to your API_CONFIG.json')
+    parser.add_argument('--coalesce', type=float, default=0.5, help='seconds to wait for more images before posting a batch')
+    parser.add_argument('--max-batch', type=int, default=50, help='maximum number of images per post')
+    parser.add_argument('--refresh', type=float, default=0.5, help='seconds between folder checks when polling')
+    parser.add_argument('--poll', action='store_true', help='poll the folder even if inotify is available')
+    args = parser.parse_args()
+
+    # Global settings
+    bc = BreadboardClient(config_path=args.config)
+    watchfolder = args.watchfolder
+    if not os.path.isdir(watchfolder): raise ValueError("Folder '{}' doesn't exist".format(watchfolder))
+    print("\n\n Watching this folder for changes: " + watchfolder + "\n\n")
+
+    journal = Journal(os.path.join(watchfolder, JOURNAL_NAME))
+    if journal.is_new:
+        # First run in this folder: only upload images that arrive from now on
+        names = [image_name(name) for name in getFileList(watchfolder)[0]]
+        journal.record(names, status='existing')
+    uploader = Uploader(bc, journal, coalesce_time=args.coalesce, max_batch=args.max_batch)
+    uploader.start()
+
+    if Observer is not None and not args.poll:
+        observer = Observer()
+        observer.schedule(NewFileHandler(uploader), watchfolder, recursive=False)
+        observer.start()
+        # Catch up on anything that arrived while we weren't watching
+        for path in sorted(getFileList(watchfolder)[1]):
+            uploader.put(path)
+        try:
+            while True:
+                time.sleep(1)
+        finally:
+            observer.stop()
+            observer.join()
+    else:
+        # Polling also catches up on anything that arrived while we weren't watching
+        poll(watchfolder, uploader, args.refresh)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()